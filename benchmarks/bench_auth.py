@@ -0,0 +1,118 @@
+"""
+Startup cost of authenticating with Cognito.
+
+Serves the cognito-config lookup and a stand-in Cognito InitiateAuth endpoint
+from a local HTTP server, then authenticates in fresh interpreters, once over
+the direct HTTP path and once through boto3. Each run covers interpreter
+start, imports, client setup and both requests, so the difference is what a
+short-lived command pays for boto3. Reports the median and minimum wall-clock
+time, the peak RSS and the number of loaded modules per backend.
+
+Usage:
+    uv run benchmarks/bench_auth.py
+    uv run benchmarks/bench_auth.py --runs 20
+"""
+#%%
+import json
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import typer
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Runs in the child: authenticate once, then report peak RSS (KiB) and loaded modules
+AUTHENTICATE = """
+import resource, sys
+from clients.authentication_client import AuthenticationClient
+client = AuthenticationClient(api_host=sys.argv[1], endpoint_url=sys.argv[2], use_boto3=sys.argv[3] == "boto3")
+assert client.authenticate("key", "secret") == "bench-token"
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, len(sys.modules))
+"""
+
+#%%
+def start_server():
+    """
+    Start an HTTP server answering the cognito-config lookup and InitiateAuth.
+
+    Returns:
+        ThreadingHTTPServer: The running server
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self._send({"region": "us-east-1", "tokenPool": {"appClientId": "bench-client"}}, "application/json")
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self._send({"AuthenticationResult": {"AccessToken": "bench-token"}}, "application/x-amz-json-1.1")
+
+        def _send(self, payload, content_type):
+            body = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def time_backend(backend, base_url, runs):
+    """
+    Authenticate in fresh subprocesses.
+
+    Args:
+        backend (str): "http" or "boto3"
+        base_url (str): URL of the local server
+        runs (int): Number of timed runs
+
+    Returns:
+        tuple: (list of durations in seconds, peak RSS in KiB, loaded modules) of the last run
+    """
+    cmd = [sys.executable, "-c", AUTHENTICATE, base_url, f"{base_url}/cognito", backend]
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(cmd, cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+        durations.append(time.perf_counter() - start)
+    rss_kib, modules = (int(value) for value in result.stdout.split())
+    return durations, rss_kib, modules
+
+def main(runs: int = typer.Option(10, "--runs", "-r", help="Number of timed runs per backend")):
+    """
+    Benchmark authenticating over the direct HTTP path against boto3.
+
+    Args:
+        runs: Number of timed runs per backend
+    """
+    server = start_server()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    results = {}
+    for backend in ("http", "boto3"):
+        try:
+            # Warm the filesystem cache and bytecode first
+            time_backend(backend, base_url, 1)
+            results[backend] = time_backend(backend, base_url, runs)
+        except subprocess.CalledProcessError as e:
+            print(f"{backend:<8} failed (exit code {e.returncode}): {e.stderr.strip().splitlines()[-1:]}")
+    server.shutdown()
+
+    print(f"{'backend':<8} {'median (ms)':>12} {'min (ms)':>10} {'peak RSS (MiB)':>15} {'modules':>8}")
+    for backend, (durations, rss_kib, modules) in results.items():
+        print(f"{backend:<8} {statistics.median(durations) * 1000:>12.1f} {min(durations) * 1000:>10.1f} "
+              f"{rss_kib / 1024:>15.1f} {modules:>8}")
+
+#%%
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,160 @@
+"""
+Sustained write throughput of the pull download paths.
+
+Serves generated files from a local HTTP server and downloads them
+concurrently into a target directory, once through curl's own output handling
+(the previous pull path) and once through download_writer (preallocation,
+aligned buffers, batched fdatasync, atomic rename). Point --target-dir at the
+shared storage pulls write to; the local server keeps the network out of the
+measurement. Reports wall-clock throughput and, where `filefrag` is
+installed, the average number of extents per file.
+
+Usage:
+    uv run benchmarks/bench_download_write.py --target-dir /shared/scratch/bench
+    uv run benchmarks/bench_download_write.py --target-dir /shared/scratch/bench --files 16 --size-mb 2048 --jobs 8
+"""
+#%%
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import typer
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from download_writer import download_file
+from pull_pennseive_datasets import download_file_with_curl_backoff
+
+
+CHUNK = os.urandom(1 << 20)
+
+#%%
+def start_server(size):
+    """
+    Start an HTTP server answering every GET with `size` bytes of generated data.
+
+    Args:
+        size (int): Bytes per response
+
+    Returns:
+        ThreadingHTTPServer: The running server
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            remaining = size
+            while remaining:
+                count = min(remaining, len(CHUNK))
+                self.wfile.write(CHUNK[:count])
+                remaining -= count
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def count_extents(paths):
+    """
+    Average number of extents per file, or None without filefrag.
+
+    Args:
+        paths (list): Files to inspect
+
+    Returns:
+        float or None: Mean extent count
+    """
+    if shutil.which("filefrag") is None:
+        return None
+    counts = []
+    for path in paths:
+        result = subprocess.run(["filefrag", str(path)], capture_output=True, text=True)
+        try:
+            counts.append(int(result.stdout.rsplit(":", 1)[1].split()[0]))
+        except (IndexError, ValueError):
+            return None
+    return sum(counts) / len(counts) if counts else None
+
+def run(name, download, url, target_dir, files, jobs):
+    """
+    Download `files` copies concurrently with one download path.
+
+    Args:
+        name (str): Name of the path, used as subdirectory
+        download (callable): Called with (url, output_path)
+        url (str): URL of the test file
+        target_dir (Path): Directory to write to
+        files (int): Number of files
+        jobs (int): Concurrent downloads
+
+    Returns:
+        tuple: (seconds, output paths)
+    """
+    out_dir = target_dir / name
+    shutil.rmtree(out_dir, ignore_errors=True)
+    out_dir.mkdir(parents=True)
+    paths = []
+    for index in range(files):
+        path = out_dir / f"file{index}.bin"
+        path.write_text("N:package:placeholder")
+        paths.append(path)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        list(pool.map(lambda path: download(url, path), paths))
+    # Include writeback of what is still dirty, as a later reader would wait for it
+    os.sync()
+    return time.perf_counter() - start, paths
+
+def main(
+    target_dir: str = typer.Option("benchmarks/.download_write", "--target-dir", help="Directory to write to (use the shared storage pulls write to)"),
+    files: int = typer.Option(8, "--files", help="Number of files per run"),
+    size_mb: int = typer.Option(512, "--size-mb", help="Size of each file in MiB"),
+    jobs: int = typer.Option(8, "--jobs", "-j", help="Concurrent downloads"),
+    keep: bool = typer.Option(False, "--keep", help="Keep the downloaded files")
+):
+    """
+    Benchmark sustained write throughput of curl against download_writer.
+
+    Args:
+        target_dir: Directory to write to
+        files: Number of files per run
+        size_mb: Size of each file in MiB
+        jobs: Concurrent downloads
+        keep: Keep the downloaded files
+    """
+    size = size_mb << 20
+    server = start_server(size)
+    url = f"http://127.0.0.1:{server.server_address[1]}/file"
+    target = Path(target_dir)
+
+    scenarios = {
+        "curl (baseline)": lambda url, path: download_file_with_curl_backoff(url, path),
+        "download_writer": lambda url, path: download_file(url, path, expected_size=size),
+    }
+
+    print(f"{files} files x {size_mb} MiB, {jobs} concurrent, into {target}")
+    print(f"{'path':<20} {'seconds':>9} {'MiB/s':>9} {'extents/file':>13}")
+    try:
+        for name, download in scenarios.items():
+            seconds, paths = run(name.split()[0], download, url, target, files, jobs)
+            extents = count_extents(paths)
+            print(f"{name:<20} {seconds:>9.2f} {files * size_mb / seconds:>9.1f} {f'{extents:.1f}' if extents is not None else '-':>13}")
+    finally:
+        server.shutdown()
+        if not keep:
+            shutil.rmtree(target, ignore_errors=True)
+
+#%%
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,269 @@
+"""
+Peak memory of the pipeline stages on synthetic datasets.
+
+Builds mapped datasets of 10k, 100k and 1M placeholder files (with their
+.pennsieve/manifest.json and a `pennsieve map diff` table listing every file
+as ADDED) and runs each stage on them in a fresh interpreter, with a stand-in
+`pennsieve` command on the PATH:
+
+    manifest   load_valid_package_ids + load_package_paths on the manifest
+    pull scan  find the placeholders to download (manifest, tree scan, reads)
+    diff       diff_dataset: tree snapshot, streamed diff table, DataFrame
+    push       push_dataset --dry-run: diff, ADDED selection, local file index
+
+Each stage runs inside `memprofile.stage()` in rss mode; the report shows its
+peak RSS (interpreter included) and how far it rose during the stage,
+imports of the stage's modules included. Peaks are compared with
+benchmarks/memory_baseline.json and the run exits with code 1 when a peak
+exceeds its baseline by more than --threshold. After an intended change,
+refresh the baseline with --update-baseline.
+
+Absolute peaks depend on the interpreter, the platform and the pandas build,
+so the baseline keeps one set of peaks per environment (e.g.
+"CPython 3.13 Linux x86_64 pandas 2.3.3") and a run is only compared with the
+peaks of its own environment. A machine without a baseline reports its peaks
+without failing; save them with --update-baseline to start tracking it.
+
+The datasets are generated once into --work-dir and reused; 1M files take a
+few minutes and about 4 GB of inodes and data.
+
+Usage:
+    uv run benchmarks/bench_memory.py
+    uv run benchmarks/bench_memory.py --sizes 10000,100000 --threshold 0.1
+    uv run benchmarks/bench_memory.py --update-baseline
+"""
+#%%
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import typer
+
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from state import load_state
+
+
+BASELINE_FILE = Path(__file__).resolve().parent / "memory_baseline.json"
+FILES_PER_DIR = 1000
+DATASET = "bench"
+
+SCENARIOS = {
+    "manifest": """
+from pull_pennseive_datasets import load_package_paths, load_valid_package_ids
+manifest_path = dataset_path / ".pennsieve" / "manifest.json"
+load_valid_package_ids(manifest_path)
+load_package_paths(manifest_path)
+""",
+    "pull scan": """
+from pull_pennseive_datasets import iter_path_placeholders
+assert sum(1 for _ in iter_path_placeholders([dataset_path], {})) == files
+""",
+    "diff": """
+from diff_pennseive_datasets import diff_dataset
+assert len(diff_dataset(DATASET, str(base_data_dir))) == files
+""",
+    "push": """
+from push_pennseive_datasets import push_dataset
+assert push_dataset("N:dataset:bench", DATASET, str(base_data_dir), dry_run=True)
+""",
+}
+
+# Runs in the child: the scenario inside one measured stage, then the stage's memory as JSON
+RUNNER = """
+import json, logging, sys
+from pathlib import Path
+import memprofile
+
+logging.basicConfig(level=logging.WARNING)
+memprofile.configure("rss")
+base_data_dir, files, DATASET = Path(sys.argv[1]), int(sys.argv[2]), sys.argv[3]
+dataset_path = base_data_dir / "output" / DATASET
+with memprofile.stage(sys.argv[4]) as memory:
+    exec(sys.argv[5])
+print(json.dumps({"rss_start": memory.rss_start, "rss_peak": memory.rss_peak, "seconds": memory.seconds}))
+"""
+
+FAKE_PENNSIEVE = """#!/bin/sh
+case "$1 $2" in
+    "map diff") cat "$BENCH_DIFF_TABLE" ;;
+    "dataset use") echo "Set active dataset to $3" ;;
+    *) echo "unsupported: $*" >&2; exit 1 ;;
+esac
+"""
+
+#%%
+def make_dataset(work_dir, files):
+    """
+    Generate a mapped dataset of placeholder files, unless it already exists.
+
+    Args:
+        work_dir (Path): Directory holding the generated datasets
+        files (int): Number of files
+
+    Returns:
+        Path: Base data directory of the dataset (<base>/output/bench)
+    """
+    base_data_dir = work_dir / f"files-{files}"
+    if (base_data_dir / ".complete").exists():
+        return base_data_dir
+
+    print(f"Generating a dataset of {files} files in {base_data_dir}")
+    dataset_path = base_data_dir / "output" / DATASET
+    (dataset_path / ".pennsieve").mkdir(parents=True, exist_ok=True)
+
+    manifest_files = []
+    with open(base_data_dir / "diff_table.txt", "w") as diff_table:
+        diff_table.write("+------------------+-----------+--------+\n")
+        diff_table.write("| FILE NAME        | PATH      | UPDATE |\n")
+        diff_table.write("+------------------+-----------+--------+\n")
+        for i in range(files):
+            folder = f"sub-{i // FILES_PER_DIR:04d}"
+            name = f"file-{i:07d}.edf"
+            package_id = f"{i:08x}-0000-4000-8000-{i:012x}"
+            if i % FILES_PER_DIR == 0:
+                (dataset_path / folder).mkdir(exist_ok=True)
+            with open(dataset_path / folder / name, "w") as f:
+                f.write(package_id)
+            manifest_files.append({"packageId": f"N:package:{package_id}", "path": folder, "name": name, "size": 1 << 20})
+            diff_table.write(f"| {name} | {folder} | ADDED  |\n")
+        diff_table.write("+------------------+-----------+--------+\n")
+
+    with open(dataset_path / ".pennsieve" / "manifest.json", "w") as f:
+        json.dump({"files": manifest_files}, f)
+    (base_data_dir / ".complete").touch()
+    return base_data_dir
+
+def environment():
+    """
+    Describe what the peaks depend on besides the code.
+
+    Returns:
+        dict: python, platform and pandas versions
+    """
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        pandas_version = version("pandas")
+    except PackageNotFoundError:
+        pandas_version = None
+    return {
+        "python": f"{platform.python_implementation()} {sys.version_info.major}.{sys.version_info.minor}",
+        "platform": f"{platform.system()} {platform.machine()}",
+        "pandas": pandas_version,
+    }
+
+def environment_key(env):
+    """
+    Name an environment in the baseline file.
+
+    Args:
+        env (dict): Output of environment()
+
+    Returns:
+        str: e.g. "CPython 3.13 Linux x86_64 pandas 2.3.3"
+    """
+    return f"{env['python']} {env['platform']} pandas {env['pandas']}"
+
+def save_baseline(baselines):
+    """
+    Save the baselines indented and newline-terminated, so updates diff line by line.
+
+    Args:
+        baselines (dict): Environment key -> environment and its peaks
+    """
+    BASELINE_FILE.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+
+def run_scenario(name, base_data_dir, files, env):
+    """
+    Run a scenario in a fresh interpreter.
+
+    Args:
+        name (str): Scenario name
+        base_data_dir (Path): Base data directory of the generated dataset
+        files (int): Number of files in the dataset
+        env (dict): Environment with the stand-in pennsieve command on the PATH
+
+    Returns:
+        dict: rss_start and rss_peak in bytes, seconds
+    """
+    cmd = [sys.executable, "-c", RUNNER, str(base_data_dir), str(files), DATASET, name, SCENARIOS[name]]
+    result = subprocess.run(cmd, cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{name} on {files} files failed:\n{result.stderr.strip()}")
+    return json.loads(result.stdout.splitlines()[-1])
+
+def main(
+    sizes: str = typer.Option("10000,100000,1000000", "--sizes", help="Comma-separated dataset sizes in files"),
+    runs: int = typer.Option(1, "--runs", "-r", help="Runs per scenario and size; the median peak is reported"),
+    threshold: float = typer.Option(0.2, "--threshold", help="Fail when a peak exceeds its baseline by more than this fraction"),
+    work_dir: str = typer.Option(os.path.join(tempfile.gettempdir(), "pennsieve-bench-memory"), "--work-dir", help="Where the synthetic datasets are generated and kept"),
+    update_baseline: bool = typer.Option(False, "--update-baseline", help="Save the measured peaks as the new baseline")
+):
+    """
+    Benchmark peak memory per pipeline stage and check it against the baseline.
+
+    Args:
+        sizes: Comma-separated dataset sizes in files
+        runs: Runs per scenario and size
+        threshold: Allowed growth over the baseline, as a fraction
+        work_dir: Directory for the generated datasets
+        update_baseline: If True, save the measured peaks as the baseline
+    """
+    work_dir = Path(work_dir)
+    bin_dir = work_dir / "bin"
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    (bin_dir / "pennsieve").write_text(FAKE_PENNSIEVE)
+    (bin_dir / "pennsieve").chmod(0o755)
+
+    current = environment()
+    key_env = environment_key(current)
+    # Entries of the old flat format carry no environment and are dropped
+    baselines = {key: entry for key, entry in load_state(BASELINE_FILE, default={}).items() if isinstance(entry, dict)}
+    baseline = baselines.get(key_env, {}).get("peaks", {})
+    if not baseline:
+        print(f"No baseline for {key_env}; peaks are reported, not checked")
+    measured = {}
+    regressions = []
+
+    datasets = {int(size): make_dataset(work_dir, int(size)) for size in sizes.split(",")}
+
+    print(f"{'scenario':<10} {'files':>8} {'peak RSS (MiB)':>15} {'stage (MiB)':>12} {'seconds':>8} {'baseline':>9}  status")
+    for files, base_data_dir in datasets.items():
+        env = {**os.environ, "PATH": f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+               "BENCH_DIFF_TABLE": str(base_data_dir / "diff_table.txt")}
+        for name in SCENARIOS:
+            samples = [run_scenario(name, base_data_dir, files, env) for _ in range(max(1, runs))]
+            peak = statistics.median(sample["rss_peak"] for sample in samples) / (1 << 20)
+            growth = statistics.median(sample["rss_peak"] - sample["rss_start"] for sample in samples) / (1 << 20)
+            seconds = statistics.median(sample["seconds"] for sample in samples)
+
+            key = f"{name} @ {files}"
+            measured[key] = round(peak, 1)
+            expected = baseline.get(key)
+            status = "-"
+            if expected is not None:
+                status = "ok"
+                if peak > expected * (1 + threshold):
+                    status = f"REGRESSION (+{(peak / expected - 1) * 100:.0f}%)"
+                    regressions.append(key)
+            print(f"{name:<10} {files:>8} {peak:>15.1f} {growth:>12.1f} {seconds:>8.1f} "
+                  f"{expected if expected is not None else '-':>9}  {status}")
+
+    if update_baseline:
+        baselines[key_env] = {**current, "peaks": {**baseline, **measured}}
+        save_baseline(baselines)
+        print(f"Saved {len(measured)} peaks for {key_env} to {BASELINE_FILE}")
+    elif regressions:
+        print(f"Peak memory regressed by more than {threshold * 100:.0f}%: {', '.join(regressions)}")
+        raise typer.Exit(code=1)
+
+#%%
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,81 @@
+"""
+Startup-time benchmark for the pipeline CLI.
+
+Runs each scenario in a fresh interpreter several times and reports the
+median and minimum wall-clock time. The "eager imports" scenario loads the
+dependency set every entry point used to import at module load (boto3,
+pandas, requests, typer) and serves as the baseline the CLI is compared to.
+
+Usage:
+    uv run benchmarks/bench_startup.py
+    uv run benchmarks/bench_startup.py --runs 20
+"""
+#%%
+import statistics
+import subprocess
+import sys
+import time
+import typer
+
+from pathlib import Path
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+SCENARIOS = {
+    "eager imports (baseline)": [sys.executable, "-c", "import boto3, pandas, requests, typer"],
+    "cli --help": [sys.executable, "cli.py", "--help"],
+    "cli diff --help": [sys.executable, "cli.py", "diff", "--help"],
+    "cli pull --help": [sys.executable, "cli.py", "pull", "--help"],
+    "cli push --help": [sys.executable, "cli.py", "push", "--help"],
+}
+
+#%%
+def time_command(cmd, runs):
+    """
+    Time a command in fresh subprocesses.
+
+    Args:
+        cmd (list): Command and arguments to run
+        runs (int): Number of timed runs
+
+    Returns:
+        list: Wall-clock durations in seconds
+    """
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def main(runs: int = typer.Option(10, "--runs", "-r", help="Number of timed runs per scenario")):
+    """
+    Benchmark CLI startup time against eagerly importing every dependency.
+
+    Args:
+        runs: Number of timed runs per scenario
+    """
+    # Warm the filesystem cache and bytecode so the first scenario is not penalized
+    for cmd in SCENARIOS.values():
+        subprocess.run(cmd, cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    results = {}
+    for name, cmd in SCENARIOS.items():
+        try:
+            results[name] = time_command(cmd, runs)
+        except subprocess.CalledProcessError as e:
+            print(f"{name:<28} failed (exit code {e.returncode})")
+
+    baseline = results.get("eager imports (baseline)")
+    baseline_median = statistics.median(baseline) if baseline else None
+
+    print(f"{'scenario':<28} {'median (ms)':>12} {'min (ms)':>10} {'vs baseline':>12}")
+    for name, durations in results.items():
+        median = statistics.median(durations)
+        ratio = f"{median / baseline_median:.2f}x" if baseline_median else "-"
+        print(f"{name:<28} {median * 1000:>12.1f} {min(durations) * 1000:>10.1f} {ratio:>12}")
+
+#%%
+if __name__ == "__main__":
+    typer.run(main)
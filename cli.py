@@ -0,0 +1,121 @@
+"""
+Pennsieve Dataset Curation CLI - one entry point for the whole pipeline
+
+Runs every pipeline stage (get, map, diff, pull, transcode, push, validate,
+inventory, dehydrate) as a subcommand of a single typer app in one process. The stage
+modules only import heavy dependencies (boto3, pandas, the API clients) inside
+the functions that need them, so `--help` and small commands start without
+paying for the full dependency set.
+
+Usage:
+    # List commands
+    uv run cli.py --help
+
+    # Fetch available PennEPI datasets
+    uv run cli.py get
+
+    # Map, diff, pull, transcode and push
+    uv run cli.py map -n "PennEPI00143" --base-data-dir /app/data
+    uv run cli.py diff "PennEPI00143" --base-data-dir /app/data
+    uv run cli.py pull -i "/app/data/output/PennEPI00143/archive"
+    uv run cli.py pull -n "PennEPI00143,PennEPI00049" --base-data-dir /app/data --jobs 8
+    uv run cli.py transcode -n "PennEPI00143" --base-data-dir /app/data
+    uv run cli.py push -n "PennEPI00143" --dry-run --base-data-dir /app/data
+    uv run cli.py validate -n "PennEPI00143" --base-data-dir /app/data
+    uv run cli.py inventory --base-data-dir /app/data
+    uv run cli.py dehydrate --budget-gb 500 --base-data-dir /app/data
+
+    # Download to local NVMe first, move into the mapped tree in the background
+    uv run cli.py pull -n "PennEPI00143" --base-data-dir /shared/data --scratch-dir /local/scratch --scratch-gb 200
+
+    # Share downloads between containers and hosts through one cache directory
+    uv run cli.py pull -n "PennEPI00143" --cache-dir /shared/pennsieve-cache
+
+    # See what a pull would download (JSON) before running it
+    uv run cli.py pull -i "/app/data/output/PennEPI00143" --plan
+
+    # Split a pull across machines: run on every node against a shared queue
+    uv run cli.py pull -i "/shared/data/output/PennEPI00143" --queue /shared/data/state/PennEPI00143/pull_queue.db
+
+    # Push in 8 concurrent manifests and wait until every file is uploaded
+    uv run cli.py push -n "PennEPI00143" --shards 8 --wait --base-data-dir /app/data
+
+    # Keep pushing new derivatives in batches as a pipeline writes them
+    uv run cli.py push -n "PennEPI00143" --watch --base-data-dir /app/data
+
+    # Trace a run and open trace.json in https://ui.perfetto.dev
+    uv run cli.py --trace-file trace.json pull -i "/app/data/output/PennEPI00143/archive"
+
+    # Log peak RSS and Python heap per stage, with the allocation sites holding the most memory
+    uv run cli.py --memory-profile python diff "PennEPI00143" --base-data-dir /app/data
+"""
+#%%
+import logging
+import typer
+import tracing
+import memprofile
+
+import get_pennseive_datasets
+import map_pennseive_datasets
+import diff_pennseive_datasets
+import pull_pennseive_datasets
+import push_pennseive_datasets
+import transcode_pennsieve_datasets
+import validate_pennsieve_datasets
+import inventory_pennsieve_datasets
+import dehydrate_pennsieve_datasets
+
+
+log = logging.getLogger(__name__)
+
+app = typer.Typer(
+    help="Curate epilepsy.science datasets on Pennsieve.",
+    no_args_is_help=True,
+    add_completion=False,
+)
+
+#%%
+@app.callback()
+def setup(
+    verbose: bool = typer.Option(False, "--verbose", "-v", help="Show debug log messages"),
+    trace_file: str = typer.Option(None, "--trace-file", envvar="PENNSIEVE_TRACE_FILE", help="Write tracing spans to this file (Chrome trace JSON, open in Perfetto)"),
+    trace_sample_rate: float = typer.Option(1.0, "--trace-sample-rate", envvar="PENNSIEVE_TRACE_SAMPLE_RATE", help="Fraction of datasets/commands traced"),
+    memory_profile: str = typer.Option(None, "--memory-profile", envvar="PENNSIEVE_MEMORY_PROFILE", help="Log peak memory per stage: 'rss', or 'python' to add tracemalloc heap peaks and top allocation sites"),
+    memory_snapshot_dir: str = typer.Option(None, "--memory-snapshot-dir", envvar="PENNSIEVE_MEMORY_SNAPSHOT_DIR", help="Dump a tracemalloc snapshot per stage to this directory (with --memory-profile python)")
+):
+    """
+    Curate epilepsy.science datasets on Pennsieve.
+    """
+    # Configure logging once for whichever subcommand runs
+    logging.basicConfig(
+        level=logging.DEBUG if verbose else logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    if trace_file:
+        tracing.configure(trace_file, trace_sample_rate)
+    if memory_profile:
+        try:
+            memprofile.configure(memory_profile, memory_snapshot_dir)
+        except ValueError as e:
+            raise typer.BadParameter(str(e), param_hint="--memory-profile")
+
+@app.command("get")
+def get():
+    """
+    Fetch available PennEPI datasets from Pennsieve.
+    """
+    pennepi_collection = get_pennseive_datasets.main()
+    log.info(f"PennEPI collection: {pennepi_collection}")
+
+app.command("map")(map_pennseive_datasets.main)
+app.command("diff")(diff_pennseive_datasets.main)
+app.command("pull")(pull_pennseive_datasets.main)
+app.command("transcode")(transcode_pennsieve_datasets.main)
+app.command("push")(push_pennseive_datasets.main)
+app.command("validate")(validate_pennsieve_datasets.main)
+app.command("inventory")(inventory_pennsieve_datasets.main)
+app.command("dehydrate")(dehydrate_pennsieve_datasets.main)
+
+#%%
+if __name__ == "__main__":
+    app()
@@ -1,5 +1,26 @@
-from .base_client import SessionManager, BaseClient
-from .authentication_client import AuthenticationClient
-from .import_client import ImportClient, ImportFile
-from .datasets_client import DatasetsClient
-from .package_client import PackageClient
\ No newline at end of file
+# Client classes are resolved on first access so that importing the package
+# does not pull in requests until a command actually talks to the API.
+import importlib
+
+_EXPORTS = {
+    "SessionManager": ".base_client",
+    "BaseClient": ".base_client",
+    "AuthenticationClient": ".authentication_client",
+    "ImportClient": ".import_client",
+    "ImportFile": ".import_client",
+    "DatasetsClient": ".datasets_client",
+    "PackageClient": ".package_client",
+    "HttpClient": ".http_client",
+    "EndpointPolicy": ".http_client",
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
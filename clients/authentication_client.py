@@ -1,46 +1,122 @@
-import boto3
 import requests
 import json
 import logging
+import os
+
+from tracing import traced, span
+from .http_client import default_http_client, POLICIES
 
 log = logging.getLogger()
 
+COGNITO_TARGET = "AWSCognitoIdentityProviderService.InitiateAuth"
+
+# a Cognito error answer, e.g. NotAuthorizedException for a wrong key or secret
+class CognitoError(Exception):
+    def __init__(self, error_type, message):
+        super().__init__(f"{error_type}: {message}")
+        self.error_type = error_type
+        self.message = message
+
 class AuthenticationClient:
-    def __init__(self, api_host):
+    def __init__(self, api_host, http_client=None, use_boto3=None, endpoint_url=None):
         self.api_host = api_host
+        self.http = http_client or default_http_client()
+        # PENNSIEVE_AUTH_BACKEND=boto3 switches back to the boto3 client without code changes
+        self.use_boto3 = os.environ.get("PENNSIEVE_AUTH_BACKEND") == "boto3" if use_boto3 is None else use_boto3
+        # optional Cognito endpoint (VPC endpoint, local test server) instead of the regional one
+        self.endpoint_url = endpoint_url
 
+    @traced("AuthenticationClient.authenticate", category="client")
     def authenticate(self, api_key, api_secret):
         url = f"{self.api_host}/authentication/cognito-config"
 
         try:
-            response = requests.get(url)
+            response = self.http.get(url, "cognito-config")
             response.raise_for_status()
             data = json.loads(response.content)
 
             cognito_app_client_id = data["tokenPool"]["appClientId"]
             cognito_region = data["region"]
 
+            if self.use_boto3:
+                return self._initiate_auth_boto3(cognito_region, cognito_app_client_id, api_key, api_secret)
+
+            try:
+                return self._initiate_auth_http(cognito_region, cognito_app_client_id, api_key, api_secret)
+            except CognitoError:
+                # Cognito answered: boto3 would get the same answer
+                raise
+            except (requests.RequestException, KeyError, ValueError) as e:
+                if not _boto3_available():
+                    raise
+                log.warning(f"direct Cognito call failed ({e}), retrying with boto3")
+                return self._initiate_auth_boto3(cognito_region, cognito_app_client_id, api_key, api_secret)
+        except requests.HTTPError as e:
+            log.error(f"failed to reach authentication server with error: {e}")
+            raise e
+        except json.JSONDecodeError as e:
+            log.error(f"failed to decode authentication response with error: {e}")
+            raise e
+        except Exception as e:
+            log.error(f"failed to authenticate with error: {e}")
+            raise e
+
+    def _initiate_auth_http(self, region, client_id, api_key, api_secret):
+        # the same JSON request boto3 sends, over the shared session and without importing botocore
+        url = self.endpoint_url or f"https://cognito-idp.{region}.amazonaws.com/"
+        payload = {
+            "AuthFlow": "USER_PASSWORD_AUTH",
+            "AuthParameters": {"USERNAME": api_key, "PASSWORD": api_secret},
+            "ClientId": client_id,
+        }
+        headers = {
+            "Content-Type": "application/x-amz-json-1.1",
+            "X-Amz-Target": COGNITO_TARGET,
+        }
+
+        with span("cognito InitiateAuth", category="client", backend="http"):
+            response = self.http.post(url, "cognito-auth", data=json.dumps(payload), headers=headers)
+
+        if 400 <= response.status_code < 500:
+            try:
+                error = response.json()
+            except ValueError:
+                error = {}
+            if "__type" in error:
+                # "__type" may carry a namespace prefix: "...#NotAuthorizedException"
+                raise CognitoError(error["__type"].rsplit("#", 1)[-1], error.get("message") or error.get("Message", ""))
+        response.raise_for_status()
+
+        return response.json()["AuthenticationResult"]["AccessToken"]
+
+    def _initiate_auth_boto3(self, region, client_id, api_key, api_secret):
+        # boto3 is only needed for this call, so keep it out of module import time
+        import boto3
+        from botocore.config import Config
+
+        policy = POLICIES["cognito-auth"]
+        with span("cognito InitiateAuth", category="client", backend="boto3"):
             cognito_idp_client = boto3.client(
                 "cognito-idp",
-                region_name=cognito_region,
+                region_name=region,
+                endpoint_url=self.endpoint_url,
                 aws_access_key_id="",
                 aws_secret_access_key="",
+                config=Config(
+                    connect_timeout=policy.connect_timeout,
+                    read_timeout=policy.read_timeout,
+                    retries={"max_attempts": policy.max_retries + 1, "mode": "standard"},
+                ),
             )
 
             login_response = cognito_idp_client.initiate_auth(
               AuthFlow="USER_PASSWORD_AUTH",
               AuthParameters={"USERNAME": api_key, "PASSWORD": api_secret},
-              ClientId=cognito_app_client_id,
+              ClientId=client_id,
             )
 
-            access_token = login_response["AuthenticationResult"]["AccessToken"]
-            return access_token
-        except requests.HTTPError as e:
-            log.error(f"failed to reach authentication server with error: {e}")
-            raise e
-        except json.JSONDecodeError as e:
-            log.error(f"failed to decode authentication response with error: {e}")
-            raise e
-        except Exception as e:
-            log.error(f"failed to authenticate with error: {e}")
-            raise e
+        return login_response["AuthenticationResult"]["AccessToken"]
+
+def _boto3_available():
+    import importlib.util
+    return importlib.util.find_spec("boto3") is not None
@@ -1,6 +1,9 @@
 import requests
 import logging
 
+from tracing import span
+from .http_client import default_http_client
+
 log = logging.getLogger()
 
 # encapsulates a shared API session and re-authentication functionality
@@ -23,17 +26,20 @@ class SessionManager:
         self.__session_token = self.authentication_client.authenticate(self.api_key, self.api_secret)
 
 class BaseClient:
-    def __init__(self, session_manager):
+    def __init__(self, session_manager, http_client=None):
         self.session_manager = session_manager
+        self.http = http_client or default_http_client()
 
     def retry_with_refresh(func):
         def wrapper(self, *args, **kwargs):
-            try:
-                return func(self, *args, **kwargs)
-            except requests.exceptions.HTTPError as e:
-                if e.response.status_code in (401, 403):
-                    log.warning("refreshing session")
-                    self.session_manager.refresh_session()
+            # every client call is a span, parented to the dataset/file being worked on
+            with span(f"{type(self).__name__}.{func.__name__}", category="client"):
+                try:
                     return func(self, *args, **kwargs)
-                raise
+                except requests.exceptions.HTTPError as e:
+                    if e.response.status_code in (401, 403):
+                        log.warning("refreshing session")
+                        self.session_manager.refresh_session()
+                        return func(self, *args, **kwargs)
+                    raise
         return wrapper
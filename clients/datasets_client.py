@@ -21,7 +21,7 @@ class DatasetsClient(BaseClient):
         }
 
         try:
-            response = requests.get(url, headers=headers)
+            response = self.http.get(url, "datasets", headers=headers)
             response.raise_for_status()
             datasets = response.json()
 
@@ -0,0 +1,204 @@
+import logging
+import random
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from tracing import span, wrap
+
+log = logging.getLogger()
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+DEFAULT_POOL_SIZE = 32
+
+# timeouts, retries and hedging for one kind of API call
+class EndpointPolicy:
+    def __init__(self, connect_timeout=5, read_timeout=60, idempotent=True, max_retries=4, hedge=False):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idempotent = idempotent
+        self.max_retries = max_retries
+        self.hedge = hedge
+
+    def __repr__(self):
+        return (f"EndpointPolicy(connect_timeout={self.connect_timeout}, read_timeout={self.read_timeout}, "
+                f"idempotent={self.idempotent}, max_retries={self.max_retries}, hedge={self.hedge})")
+
+# small lookups that sit between every pair of transfers are hedged, and so are
+# small range reads, while large ones are not worth duplicating; slow listings
+# get long read timeouts; creating an import is never retried once sent
+POLICIES = {
+    "cognito-config": EndpointPolicy(connect_timeout=5, read_timeout=15),
+    "cognito-auth": EndpointPolicy(connect_timeout=5, read_timeout=15),
+    "datasets": EndpointPolicy(connect_timeout=5, read_timeout=120),
+    "download-manifest": EndpointPolicy(connect_timeout=5, read_timeout=30, hedge=True),
+    "package-files": EndpointPolicy(connect_timeout=5, read_timeout=30, hedge=True),
+    "import-create": EndpointPolicy(connect_timeout=5, read_timeout=60, idempotent=False),
+    "import-presign": EndpointPolicy(connect_timeout=5, read_timeout=30, hedge=True),
+    "range-read": EndpointPolicy(connect_timeout=5, read_timeout=60, hedge=True),
+    "range-read-large": EndpointPolicy(connect_timeout=5, read_timeout=60),
+    "download": EndpointPolicy(connect_timeout=10, read_timeout=300, max_retries=0),
+    "import-upload": EndpointPolicy(connect_timeout=10, read_timeout=300, max_retries=0),
+}
+DEFAULT_POLICY = EndpointPolicy()
+
+# shared session with per-endpoint timeouts, jittered retries and optional hedging
+class HttpClient:
+    def __init__(self, policies=None, pool_size=DEFAULT_POOL_SIZE, backoff_base=0.5, backoff_cap=30,
+                 hedge_quantile=0.95, hedge_min_samples=20, latency_window=200):
+        self.policies = {**POLICIES, **(policies or {})}
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.pool_size = pool_size
+
+        # one connection pool for every client, so TLS handshakes are reused
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._latencies = {}
+        self._latency_window = latency_window
+        self._lock = threading.Lock()
+        self._hedge_pool = None
+
+    def __repr__(self):
+        return f"HttpClient(endpoints={len(self.policies)}, pool_size={self.pool_size}, hedge_quantile={self.hedge_quantile})"
+
+    def get(self, url, endpoint, **kwargs):
+        return self.request("GET", url, endpoint, **kwargs)
+
+    def post(self, url, endpoint, **kwargs):
+        return self.request("POST", url, endpoint, **kwargs)
+
+    def put(self, url, endpoint, **kwargs):
+        return self.request("PUT", url, endpoint, **kwargs)
+
+    def request(self, method, url, endpoint, **kwargs):
+        """
+        Send a request with the endpoint's timeouts, retrying idempotent calls
+        on connection errors, timeouts and retryable statuses with full-jitter
+        exponential backoff. Returns the last response; callers still call
+        raise_for_status() on it.
+        """
+        policy = self.policies.get(endpoint, DEFAULT_POLICY)
+        kwargs.setdefault("timeout", (policy.connect_timeout, policy.read_timeout))
+
+        attempt = 0
+        while True:
+            try:
+                if policy.hedge and policy.idempotent:
+                    response = self._hedged_send(method, url, endpoint, kwargs)
+                else:
+                    response = self._send(method, url, endpoint, kwargs)
+                if response.status_code not in RETRYABLE_STATUS or not policy.idempotent or attempt >= policy.max_retries:
+                    return response
+                delay = self._retry_after(response)
+                log.warning(f"{endpoint} returned {response.status_code}, retrying (attempt {attempt + 1}/{policy.max_retries})")
+                response.close()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # a request that never connected is safe to resend even if not idempotent
+                retryable = policy.idempotent or isinstance(e, requests.ConnectTimeout)
+                if not retryable or attempt >= policy.max_retries:
+                    raise
+                delay = None
+                log.warning(f"{endpoint} failed with {type(e).__name__}, retrying (attempt {attempt + 1}/{policy.max_retries})")
+
+            if delay is None:
+                delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+            time.sleep(delay)
+            attempt += 1
+
+    def _send(self, method, url, endpoint, kwargs, hedged=False):
+        with span(f"{method} {endpoint}", category="http", hedged=hedged) as request_span:
+            start = time.monotonic()
+            response = self.session.request(method, url, **kwargs)
+            self._record_latency(endpoint, time.monotonic() - start)
+            request_span.set(status=response.status_code)
+            return response
+
+    def _hedged_send(self, method, url, endpoint, kwargs):
+        threshold = self.hedge_threshold(endpoint)
+        if threshold is None:
+            return self._send(method, url, endpoint, kwargs)
+
+        pool = self._get_hedge_pool()
+        primary = pool.submit(wrap(self._send), method, url, endpoint, kwargs)
+        done, _ = wait([primary], timeout=threshold)
+        if done:
+            return primary.result()
+
+        # the first request is slower than usual: race a duplicate against it
+        log.debug(f"hedging {endpoint} after {threshold:.3f}s")
+        backup = pool.submit(wrap(self._send), method, url, endpoint, kwargs, True)
+        pending = {primary, backup}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.add_done_callback(self._discard)
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    @staticmethod
+    def _discard(future):
+        if future.exception() is None:
+            future.result().close()
+
+    @staticmethod
+    def _retry_after(response):
+        value = response.headers.get("Retry-After")
+        try:
+            return min(float(value), 300) if value is not None else None
+        except ValueError:
+            return None
+
+    def _get_hedge_pool(self):
+        with self._lock:
+            if self._hedge_pool is None:
+                # a primary and its backup per pooled connection, so hedges never queue behind each other
+                self._hedge_pool = ThreadPoolExecutor(max_workers=2 * self.pool_size, thread_name_prefix="hedge")
+            return self._hedge_pool
+
+    def _record_latency(self, endpoint, seconds):
+        with self._lock:
+            samples = self._latencies.get(endpoint)
+            if samples is None:
+                samples = self._latencies[endpoint] = deque(maxlen=self._latency_window)
+            samples.append(seconds)
+
+    def hedge_threshold(self, endpoint):
+        """
+        Latency after which a duplicate request is sent: the configured
+        percentile of the endpoint's recent latencies, or None until enough
+        samples were seen.
+        """
+        with self._lock:
+            samples = sorted(self._latencies.get(endpoint, ()))
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(self.hedge_quantile * len(samples)))]
+
+_default_client = None
+_default_lock = threading.Lock()
+
+def default_http_client(pool_size=None):
+    # pool_size only applies when the shared client is created, so callers that
+    # know their concurrency (pull --jobs) ask for it before any client is built
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = HttpClient(pool_size=pool_size or DEFAULT_POOL_SIZE)
+        elif pool_size and pool_size > _default_client.pool_size:
+            log.warning(f"shared HTTP client already has {_default_client.pool_size} connections, {pool_size} requested")
+        return _default_client
@@ -37,7 +37,7 @@ class ImportClient(BaseClient):
         }
 
         try:
-            response = requests.post(url, headers=headers, json=body)
+            response = self.http.post(url, "import-create", headers=headers, json=body)
             response.raise_for_status()
             data = response.json()
 
@@ -62,7 +62,7 @@ class ImportClient(BaseClient):
         }
 
         try:
-            response = requests.get(url, headers=headers)
+            response = self.http.get(url, "import-presign", headers=headers)
             response.raise_for_status()
             data = response.json()
 
@@ -24,7 +24,7 @@ class PackageClient(BaseClient):
         }
 
         try:
-            response = requests.post(url, json=payload, headers=headers)
+            response = self.http.post(url, "download-manifest", json=payload, headers=headers)
             response.raise_for_status()
             data = response.json()
 
@@ -38,3 +38,55 @@ class PackageClient(BaseClient):
         except Exception as e:
             log.error(f"failed to get download manifest with error: {e}")
             raise e
+
+    @BaseClient.retry_with_refresh
+    def get_download_manifests(self, package_ids):
+        url = f"{self.api_host}/packages/download-manifest?api_key={self.session_manager.session_token}"
+
+        # one lookup for many packages; each entry of "data" has its nodeId, path, fileName, size and url
+        payload = { "nodeIds": [f"N:package:{package_id}" for package_id in package_ids] }
+
+        headers = {
+            "accept": "*/*",
+            "Content-type": "application/json"
+        }
+
+        try:
+            response = self.http.post(url, "download-manifest", json=payload, headers=headers)
+            response.raise_for_status()
+            data = response.json()
+
+            return data
+        except requests.HTTPError as e:
+            log.error(f"failed to get download manifests with error: {e}")
+            raise e
+        except json.JSONDecodeError as e:
+            log.error(f"failed to decode download manifests response with error: {e}")
+            raise e
+        except Exception as e:
+            log.error(f"failed to get download manifests with error: {e}")
+            raise e
+
+    @BaseClient.retry_with_refresh
+    def get_package_files(self, package_id):
+        url = f"{self.api_host}/packages/N:package:{package_id}/files?api_key={self.session_manager.session_token}"
+
+        headers = {
+            "accept": "*/*",
+        }
+
+        try:
+            response = self.http.get(url, "package-files", headers=headers)
+            response.raise_for_status()
+            data = response.json()
+
+            return data
+        except requests.HTTPError as e:
+            log.error(f"failed to get package files with error: {e}")
+            raise e
+        except json.JSONDecodeError as e:
+            log.error(f"failed to decode package files response with error: {e}")
+            raise e
+        except Exception as e:
+            log.error(f"failed to get package files with error: {e}")
+            raise e
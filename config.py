@@ -8,4 +8,5 @@ class Config:
         self.API_KEY = os.getenv('PENNSIEVE_API_KEY')
         self.API_SECRET = os.getenv('PENNSIEVE_API_SECRET')
         self.API_HOST = os.getenv('PENNSIEVE_API_HOST', 'https://api.pennsieve.net')
-        self.API_HOST2 = os.getenv('PENNSIEVE_API_HOST2', 'https://api2.pennsieve.net')
\ No newline at end of file
+        self.API_HOST2 = os.getenv('PENNSIEVE_API_HOST2', 'https://api2.pennsieve.net')
+        self.INTEGRATION_ID = os.getenv('INTEGRATION_ID')
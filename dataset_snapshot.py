@@ -0,0 +1,154 @@
+"""
+Tree snapshots for incremental diffs of mapped datasets.
+
+A snapshot records every directory of a mapped dataset with its mtime, the
+files it contains with their size and mtime, the version of the dataset's
+`.pennsieve/manifest.json` and the remote `updatedAt` of the dataset. When a
+new snapshot matches the saved one, neither side has changed and the saved
+diff result is still valid.
+
+Directories whose mtime is unchanged since the previous snapshot are not
+listed again; only their known files are re-stat'ed so in-place rewrites are
+still detected. Directories whose mtime changed are rescanned.
+"""
+# %%
+import logging
+import os
+
+from pathlib import Path
+
+from fs_scanner import scan_directories, scan_directory, DEFAULT_WORKERS
+from state import dataset_state_dir, load_state, save_state
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = "diff_snapshot.json"
+
+# The agent's own bookkeeping directory is tracked through the manifest version
+IGNORED_DIRS = {".pennsieve"}
+
+# %%
+def manifest_version(dataset_path):
+    """
+    Get the version of a mapped dataset's manifest.
+
+    Args:
+        dataset_path (Path): Path to the mapped dataset
+
+    Returns:
+        list or None: [size, mtime_ns] of .pennsieve/manifest.json, or None if missing
+    """
+    try:
+        st = os.stat(Path(dataset_path) / ".pennsieve" / "manifest.json")
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _scan_directory(dir_path):
+    """
+    List a directory, returning its files with stat data and its subdirectories.
+    """
+    entries, subdirs = scan_directory(dir_path, IGNORED_DIRS)
+    files = {os.path.basename(entry.path): [entry.size, entry.mtime_ns] for entry in entries}
+    return files, sorted(subdirs)
+
+
+def _restat_directory(dir_path, previous_dir):
+    """
+    Refresh the stat data of a directory's known files without listing it.
+    """
+    files = {}
+    for name in previous_dir["files"]:
+        try:
+            st = os.stat(os.path.join(dir_path, name))
+        except FileNotFoundError:
+            continue
+        files[name] = [st.st_size, st.st_mtime_ns]
+    return files, previous_dir["subdirs"]
+
+
+def build_tree_snapshot(dataset_path, previous_tree=None, max_workers=DEFAULT_WORKERS):
+    """
+    Build a tree snapshot of a mapped dataset.
+
+    Args:
+        dataset_path (Path): Path to the mapped dataset
+        previous_tree (dict): Tree from the previous snapshot, used to skip
+            listing directories whose mtime has not changed
+        max_workers (int): Number of directories scanned concurrently
+
+    Returns:
+        tuple: (tree, rescanned) where tree maps relative directory paths to
+            {"mtime_ns", "files", "subdirs"} and rescanned is the number of
+            directories that had to be listed
+    """
+    previous_tree = previous_tree or {}
+    tree = {}
+    rescanned = []
+
+    def snapshot_directory(rel_dir, dir_path):
+        mtime_ns = os.stat(dir_path).st_mtime_ns
+
+        previous_dir = previous_tree.get(rel_dir)
+        if previous_dir is not None and previous_dir["mtime_ns"] == mtime_ns:
+            files, subdirs = _restat_directory(dir_path, previous_dir)
+        else:
+            files, subdirs = _scan_directory(dir_path)
+            rescanned.append(rel_dir)
+
+        tree[rel_dir] = {"mtime_ns": mtime_ns, "files": files, "subdirs": subdirs}
+        return files, subdirs
+
+    for _ in scan_directories(dataset_path, max_workers=max_workers, lister=snapshot_directory):
+        pass
+
+    return tree, len(rescanned)
+
+
+def load_snapshot(base_data_dir, dataset_name):
+    """
+    Load the saved snapshot of a dataset.
+
+    Args:
+        base_data_dir (str): Base directory where datasets are mapped
+        dataset_name (str): The name of the dataset
+
+    Returns:
+        dict or None: The saved snapshot, or None if there is none
+    """
+    return load_state(dataset_state_dir(base_data_dir, dataset_name) / SNAPSHOT_FILE)
+
+
+def save_snapshot(base_data_dir, dataset_name, snapshot):
+    """
+    Save the snapshot of a dataset.
+
+    Args:
+        base_data_dir (str): Base directory where datasets are mapped
+        dataset_name (str): The name of the dataset
+        snapshot (dict): Snapshot with "tree", "manifest", "remote_updated_at" and "diff" keys
+    """
+    save_state(dataset_state_dir(base_data_dir, dataset_name) / SNAPSHOT_FILE, snapshot)
+
+
+def is_unchanged(snapshot, tree, manifest, remote_updated_at):
+    """
+    Check whether neither the local nor the remote side changed since a snapshot.
+
+    Args:
+        snapshot (dict): The previously saved snapshot
+        tree (dict): The current tree snapshot
+        manifest (list): The current manifest version
+        remote_updated_at (str): The dataset's current remote updatedAt
+
+    Returns:
+        bool: True if the saved diff result is still valid
+    """
+    if snapshot is None or remote_updated_at is None:
+        return False
+    return (
+        snapshot.get("remote_updated_at") == remote_updated_at
+        and snapshot.get("manifest") == manifest
+        and snapshot.get("tree") == tree
+    )
@@ -0,0 +1,254 @@
+"""
+Dehydrate Pennsieve Datasets - Keep pulled files within a disk budget
+
+Pull records every file it downloads in
+`<base_data_dir>/state/<dataset_name>/pulled_files.json` (package ID, size,
+mtime and last access time). When the pulled files of all datasets take more
+than the budget, the least recently used ones are turned back into
+placeholders holding their package ID, the same format `pull` recognizes, so
+they are pulled again on demand. The mapped trees and all pipeline state stay
+in place.
+
+Only files pull downloaded and that are unchanged since are dehydrated; local
+derivatives and edited files are never touched. Every update of an index holds
+an exclusive flock on `pulled_files.json.lock`, so pulls on several nodes or
+containers and a dehydrate running during a pull never drop each other's
+entries (the filesystem must support flock across hosts, as for the shared
+download cache). The last access time is the
+later of the time recorded by `touch()` and the file's atime (coarse on
+relatime mounts), so pipelines reading pulled files should call `touch()`.
+
+Usage:
+    # Dehydrate least recently used files until pulled files fit in 500 GB
+    uv run dehydrate_pennsieve_datasets.py --budget-gb 500 --base-data-dir /app/data
+
+    # Show what would be dehydrated
+    uv run dehydrate_pennsieve_datasets.py --budget-gb 500 --dry-run
+
+    # Enforce the budget after every pull
+    uv run pull_pennseive_datasets.py -n "PennEPI00143" --disk-budget-gb 500
+"""
+#%%
+import fcntl
+import logging
+import os
+import time
+import typer
+
+from contextlib import contextmanager
+from pathlib import Path
+
+from state import dataset_state_dir, load_state, save_state
+
+
+log = logging.getLogger(__name__)
+
+PULLED_FILE = "pulled_files.json"
+
+#%%
+def pulled_index_path(dataset_path):
+    """
+    Get the index of pulled files of a mapped dataset.
+
+    Args:
+        dataset_path (Path): Path to the mapped dataset (<base_data_dir>/output/<dataset_name>)
+
+    Returns:
+        Path: Path of the dataset's pulled files index
+    """
+    dataset_path = Path(dataset_path)
+    return dataset_state_dir(dataset_path.parent.parent, dataset_path.name) / PULLED_FILE
+
+@contextmanager
+def locked_index(index_path):
+    """
+    Load a pulled files index under an exclusive lock and save it on exit.
+
+    Args:
+        index_path (Path): Path of the pulled files index
+
+    Yields:
+        dict: The index, saved when the block finishes without an error
+    """
+    index_path = Path(index_path)
+    lock_path = index_path.with_name(f"{index_path.name}.lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            index = load_state(index_path, default={})
+            yield index
+            save_state(index_path, index)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def record_pulled(dataset_path, files):
+    """
+    Add downloaded files to the dataset's pulled files index.
+
+    Args:
+        dataset_path (Path): Path to the mapped dataset
+        files (iterable): (file_path, package_id) tuples of downloaded files
+    """
+    entries = {}
+    now = time.time()
+    for file_path, package_id in files:
+        try:
+            st = os.stat(file_path)
+        except FileNotFoundError:
+            continue
+        rel_path = Path(os.path.relpath(file_path, dataset_path)).as_posix()
+        entries[rel_path] = {"package_id": package_id, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "accessed": now}
+    with locked_index(pulled_index_path(dataset_path)) as index:
+        index.update(entries)
+
+def touch(dataset_path, paths):
+    """
+    Mark pulled files as used, so they are dehydrated last.
+
+    Args:
+        dataset_path (Path): Path to the mapped dataset
+        paths (iterable): Paths of files in the dataset
+    """
+    rel_paths = [Path(os.path.relpath(path, dataset_path)).as_posix() for path in paths]
+    now = time.time()
+    with locked_index(pulled_index_path(dataset_path)) as index:
+        for rel_path in rel_paths:
+            entry = index.get(rel_path)
+            if entry is not None:
+                entry["accessed"] = now
+
+def write_placeholder(file_path, package_id):
+    """
+    Atomically replace a file with a placeholder holding its package ID.
+
+    Args:
+        file_path (Path): The pulled file
+        package_id (str): Its package ID (without "N:package:" prefix)
+    """
+    file_path = Path(file_path)
+    tmp_path = file_path.with_name(f".{file_path.name}.placeholder-{os.getpid()}")
+    with open(tmp_path, 'w') as f:
+        f.write(package_id)
+    os.replace(tmp_path, file_path)
+
+def pulled_files(base_data_dir, dataset_names=None):
+    """
+    Collect the pulled files that can be dehydrated, and the stale index entries.
+
+    Entries of files that were deleted, already dehydrated or changed since
+    the pull are reported as stale and left alone on disk.
+
+    Args:
+        base_data_dir (str): Base directory where datasets are mapped
+        dataset_names (list): Optional, only these datasets
+
+    Returns:
+        tuple: (list of (last_access, size, dataset_name, rel_path) tuples,
+            indexes by dataset name, stale entries by dataset name and path)
+    """
+    state_dir = Path(base_data_dir) / "state"
+    if dataset_names is None:
+        dataset_names = sorted(p.parent.name for p in state_dir.glob(f"*/{PULLED_FILE}"))
+
+    candidates = []
+    indexes = {}
+    stale = {}
+    for name in dataset_names:
+        dataset_path = Path(base_data_dir) / "output" / name
+        index = load_state(state_dir / name / PULLED_FILE, default={})
+        stale[name] = {}
+        for rel_path, entry in index.items():
+            try:
+                st = os.stat(dataset_path / rel_path)
+            except FileNotFoundError:
+                stale[name][rel_path] = entry
+                continue
+            if st.st_size != entry["size"] or st.st_mtime_ns != entry["mtime_ns"]:
+                log.debug(f"{name}/{rel_path} changed since it was pulled, no longer managed")
+                stale[name][rel_path] = entry
+                continue
+            candidates.append((max(entry["accessed"], st.st_atime), st.st_size, name, rel_path))
+        indexes[name] = index
+    return candidates, indexes, stale
+
+def dehydrate(base_data_dir="data", budget_bytes=0, dataset_names=None, dry_run=False):
+    """
+    Turn the least recently used pulled files back into placeholders until
+    the pulled files fit in the budget.
+
+    Args:
+        base_data_dir (str): Base directory where datasets are mapped
+        budget_bytes (int): Bytes the pulled files may take
+        dataset_names (list): Optional, only count and dehydrate these datasets
+        dry_run (bool): If True, only log what would be dehydrated
+
+    Returns:
+        dict: pulled_bytes before, dehydrated files and bytes, and pulled_bytes after
+    """
+    candidates, indexes, removed = pulled_files(base_data_dir, dataset_names)
+    total = sum(size for _, size, _, _ in candidates)
+    stats = {"pulled_bytes": total, "dehydrated_files": 0, "dehydrated_bytes": 0}
+
+    if total > budget_bytes:
+        log.info(f"Pulled files take {total / 1e9:.1f} GB, budget is {budget_bytes / 1e9:.1f} GB")
+        for _, size, name, rel_path in sorted(candidates):
+            if total <= budget_bytes:
+                break
+            file_path = Path(base_data_dir) / "output" / name / rel_path
+            if dry_run:
+                log.info(f"DRY RUN: Would dehydrate {name}/{rel_path} ({size} bytes)")
+            else:
+                try:
+                    write_placeholder(file_path, indexes[name][rel_path]["package_id"])
+                except OSError as e:
+                    log.error(f"Failed to dehydrate {file_path}: {e}")
+                    continue
+                removed[name][rel_path] = indexes[name][rel_path]
+                log.debug(f"Dehydrated {name}/{rel_path}")
+            total -= size
+            stats["dehydrated_files"] += 1
+            stats["dehydrated_bytes"] += size
+
+    if not dry_run:
+        # Drop only the entries read above: a pull may have recorded new ones meanwhile
+        for name, entries in removed.items():
+            if not entries:
+                continue
+            with locked_index(Path(base_data_dir) / "state" / name / PULLED_FILE) as index:
+                for rel_path, entry in entries.items():
+                    if index.get(rel_path) == entry:
+                        del index[rel_path]
+
+    stats["pulled_bytes_after"] = total
+    return stats
+
+# %%
+def main(
+    base_data_dir: str = typer.Option("data", help="The directory where the datasets are mapped"),
+    budget_gb: float = typer.Option(..., "--budget-gb", help="Disk space in GB the pulled files of all datasets may take"),
+    dataset_name: str = typer.Option("", "--dataset-name", "-n", help="Optional: Only count and dehydrate these dataset(s), comma-separated"),
+    dry_run: bool = typer.Option(False, "--dry-run", "-d", help="Show what would be dehydrated without changing files")
+):
+    """
+    Dehydrate least recently used pulled files back into placeholders to fit a disk budget.
+
+    Args:
+        base_data_dir: The directory where the datasets are mapped
+        budget_gb: Disk space in GB the pulled files may take
+        dataset_name: Optional dataset name(s) to limit dehydration to
+        dry_run: If True, only show what would be dehydrated
+    """
+    dataset_names = [name.strip() for name in dataset_name.split(",")] if dataset_name else None
+    stats = dehydrate(base_data_dir, int(budget_gb * 1e9), dataset_names, dry_run)
+    log.info(
+        f"{'Would dehydrate' if dry_run else 'Dehydrated'} {stats['dehydrated_files']} files "
+        f"({stats['dehydrated_bytes'] / 1e9:.2f} GB); pulled files now take "
+        f"{stats['pulled_bytes_after'] / 1e9:.2f} of {budget_gb} GB"
+    )
+
+# %%
+if __name__ == "__main__":
+    # Configure logging to show info messages
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    typer.run(main)
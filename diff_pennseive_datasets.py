@@ -1,125 +1,77 @@
 #%%
+import os
 import subprocess
+import tempfile
 import logging
 import typer
-import pandas as pd
-from io import StringIO
+import tracing
+import memprofile
+import dataset_snapshot
+import get_pennseive_datasets as pennseive
 
 from pathlib import Path
 
 
-# Configure logging to show info messages
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 log = logging.getLogger(__name__)
 
 #%%
-def diff_dataset(dataset_name, base_data_dir="data"):
+def diff_dataset(dataset_name, base_data_dir="data", remote_updated_at=None, use_snapshot=True):
     """
     Check if Pennsieve dataset has changed between local and remote.
     
+    When a snapshot from a previous diff exists and neither the local tree,
+    the manifest nor the remote `updatedAt` changed since then, the saved
+    result is returned without running `pennsieve map diff`.
+    
     Args:
         dataset_name (str): The name of the dataset (used for directory name)
         base_data_dir (str): Base directory where datasets will be stored (default: "data")
+        remote_updated_at (str): The dataset's `updatedAt` from the Pennsieve catalog.
+            If None, the remote side cannot be checked and a full diff always runs.
+        use_snapshot (bool): If True, reuse and update the dataset's diff snapshot
     
     Returns:
         pd.DataFrame or None: DataFrame with changed files, or None if error occurred
     """
+    # pandas is only needed once we have a diff table to build
+    import pandas as pd
+
     # Create the full path for the dataset directory
     dataset_path = Path(base_data_dir) / "output" / dataset_name
     
     try:
+        tree = manifest = None
+        if use_snapshot:
+            previous = dataset_snapshot.load_snapshot(base_data_dir, dataset_name)
+            tree, rescanned = dataset_snapshot.build_tree_snapshot(
+                dataset_path, previous.get("tree") if previous else None
+            )
+            manifest = dataset_snapshot.manifest_version(dataset_path)
+            
+            if dataset_snapshot.is_unchanged(previous, tree, manifest, remote_updated_at):
+                log.info(f"'{dataset_name}' unchanged locally and remotely since last diff, reusing snapshot")
+                return pd.DataFrame(previous["diff"]["rows"], columns=previous["diff"]["columns"])
+            
+            log.info(f"Rescanned {rescanned} of {len(tree)} directories of '{dataset_name}'")
+        
         # Ensure the base data directory exists
         data_dir = Path(base_data_dir)
         data_dir.mkdir(exist_ok=True)
         
         log.info(f"Checking if '{dataset_name}' has changed between local and remote")
-        # Run the pennsieve map command
-        result = subprocess.run([
-            'pennsieve', 
-            'map',
-            'diff', 
-            str(dataset_path)
-        ], capture_output=True, text=True, check=True)
-        log.info(result.stdout)
-
-        # Parse table from stdout manually
-        lines = result.stdout.strip().split('\n')
-        
-        # Find header row and data rows
-        header_row = None
-        data_rows = []
-        found_header = False
-        
-        for line in lines:
-            line = line.strip()
-            
-            # Skip separator lines (lines that start with + or are empty)
-            if not line or line.startswith('+'):
-                continue
-            
-            # Check if this is the header row (contains both PATH and FILE NAME)
-            if 'FILE NAME' in line.upper() and 'PATH' in line.upper():
-                header_row = line
-                found_header = True
-            elif found_header and '|' in line:
-                # This is a data row (has pipes but is not a header)
-                if 'FILE NAME' not in line.upper():
-                    data_rows.append(line)
-        
-        if not header_row:
-            log.warning("Could not find header row in diff output")
-            return pd.DataFrame()
-        
-        # Parse header row - split by pipe and clean
-        # Keep empty cells but remove leading/trailing pipes
-        header_parts = header_row.split('|')
-        headers = [col.strip() for col in header_parts[1:-1]]  # Skip first and last (empty due to leading/trailing pipes)
-        
-        # Parse data rows
-        rows = []
-        for row_line in data_rows:
-            # Split by pipe and keep ALL cells (including empty ones)
-            # Remove first and last elements (empty due to leading/trailing pipes)
-            row_parts = row_line.split('|')
-            cells = [cell.strip() for cell in row_parts[1:-1]]
-            # Only add rows that have the same number of columns as headers
-            if len(cells) == len(headers):
-                rows.append(cells)
-        
-        # Create DataFrame
-        if not rows:
-            log.info("No changes detected")
-            return pd.DataFrame(columns=headers)
-        
-        df = pd.DataFrame(rows, columns=headers)
-        
-        # Reset index after filtering
-        df = df.reset_index(drop=True)
-        
-        # Find column names (they might vary slightly)
-        file_name_col = None
-        path_col = None
-        update_col = None
-        for col in df.columns:
-            if 'FILE NAME' in col.upper() or 'FILENAME' in col.upper():
-                file_name_col = col
-            if 'PATH' in col.upper() and 'FULL' not in col.upper():
-                path_col = col
-            if 'UPDATE' in col.upper() or 'CHANGE' in col.upper():
-                update_col = col
-        
-        # Add full path column for easier use
-        base = Path(dataset_path)
-        if file_name_col:
-            if path_col:
-                df['FULL_PATH'] = df.apply(
-                    lambda row: str(base / str(row[path_col]).strip() / row[file_name_col]) 
-                    if pd.notna(row[path_col]) and str(row[path_col]).strip() 
-                    else str(base / row[file_name_col]),
-                    axis=1
-                )
-            else:
-                df['FULL_PATH'] = df[file_name_col].apply(lambda x: str(base / x))
+        # Stream the pennsieve map diff table straight into the DataFrame
+        with tracing.span("pennsieve map diff", category="subprocess", dataset=dataset_name) as span:
+            df = records_to_dataframe(iter_diff_records(dataset_path), dataset_path)
+            span.set(changed_files=len(df))
+        log.info(f"Found {len(df)} changed files in '{dataset_name}'")
+
+        if use_snapshot:
+            dataset_snapshot.save_snapshot(base_data_dir, dataset_name, {
+                "remote_updated_at": remote_updated_at,
+                "manifest": manifest,
+                "tree": tree,
+                "diff": {"columns": list(df.columns), "rows": df.values.tolist()},
+            })
 
         return df
         
@@ -137,11 +89,194 @@ def diff_dataset(dataset_name, base_data_dir="data"):
         log.error(traceback.format_exc())
         return None
 
+class DiffRecord:
+    """
+    A changed file reported by `pennsieve map diff`.
+    
+    `columns` is shared by every record of a table and `cells` holds the raw
+    row values in the same order.
+    """
+    __slots__ = ("columns", "cells", "path", "file_name", "change_type", "base")
+    
+    def __init__(self, columns, cells, path, file_name, change_type, base):
+        self.columns = columns
+        self.cells = cells
+        self.path = path
+        self.file_name = file_name
+        self.change_type = change_type
+        self.base = base
+    
+    @property
+    def full_path(self):
+        if self.path:
+            return os.path.join(self.base, self.path, self.file_name)
+        return os.path.join(self.base, self.file_name)
+    
+    def __repr__(self):
+        return f"DiffRecord(change_type={self.change_type}, path={self.path}, file_name={self.file_name})"
+
+def find_diff_columns(headers):
+    """
+    Find the file name, path and update columns of a diff table (names might vary slightly).
+    
+    Args:
+        headers (sequence): Column names of the diff table
+    
+    Returns:
+        tuple: (file_name_col, path_col, update_col), each None if not found
+    """
+    file_name_col = None
+    path_col = None
+    update_col = None
+    for col in headers:
+        if 'FILE NAME' in col.upper() or 'FILENAME' in col.upper():
+            file_name_col = col
+        if 'PATH' in col.upper() and 'FULL' not in col.upper():
+            path_col = col
+        if 'UPDATE' in col.upper() or 'CHANGE' in col.upper():
+            update_col = col
+    return file_name_col, path_col, update_col
+
+def parse_diff_lines(lines, dataset_path):
+    """
+    Parse the table printed by `pennsieve map diff` one line at a time.
+    
+    Args:
+        lines (iterable): Lines of the `pennsieve map diff` output
+        dataset_path (Path): Path to the mapped dataset, used to build full paths
+    
+    Yields:
+        DiffRecord: One record per data row
+    """
+    base = str(Path(dataset_path))
+    headers = None
+    
+    for line in lines:
+        line = line.strip()
+        
+        # Skip separator lines (lines that start with + or are empty)
+        if not line or line.startswith('+'):
+            continue
+        
+        # Check if this is the header row (contains both PATH and FILE NAME)
+        # Keep empty cells but remove leading/trailing pipes
+        if 'FILE NAME' in line.upper() and 'PATH' in line.upper():
+            headers = tuple(col.strip() for col in line.split('|')[1:-1])
+            file_name_col, path_col, update_col = find_diff_columns(headers)
+            file_name_idx = headers.index(file_name_col) if file_name_col else None
+            path_idx = headers.index(path_col) if path_col else None
+            update_idx = headers.index(update_col) if update_col else None
+            continue
+        
+        # This is a data row (has pipes and comes after the header)
+        if headers is None or '|' not in line:
+            continue
+        
+        # Split by pipe and keep ALL cells (including empty ones)
+        cells = tuple(cell.strip() for cell in line.split('|')[1:-1])
+        # Only keep rows that have the same number of columns as headers
+        if len(cells) != len(headers):
+            continue
+        
+        yield DiffRecord(
+            columns=headers,
+            cells=cells,
+            path=cells[path_idx].strip('/') if path_idx is not None else '',
+            file_name=cells[file_name_idx] if file_name_idx is not None else '',
+            change_type=cells[update_idx] if update_idx is not None else None,
+            base=base,
+        )
+    
+    if headers is None:
+        log.warning("Could not find header row in diff output")
+
+def _log_lines(lines):
+    for line in lines:
+        log.debug(line.rstrip())
+        yield line
+
+def iter_diff_records(dataset_path):
+    """
+    Run `pennsieve map diff` and stream its table as it is printed.
+    
+    Only the current line is held in memory, so callers can start consuming
+    records (e.g. ADDED files to upload) before the diff finishes.
+    
+    Args:
+        dataset_path (Path): Path to the mapped dataset
+    
+    Yields:
+        DiffRecord: One record per changed file
+    
+    Raises:
+        subprocess.CalledProcessError: If the diff command fails
+        FileNotFoundError: If the pennsieve command is not installed
+    """
+    cmd = ['pennsieve', 'map', 'diff', str(dataset_path)]
+    
+    # stderr goes to a file so a chatty CLI can never block on a full pipe
+    with tempfile.TemporaryFile(mode='w+') as stderr_file:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file, text=True)
+        try:
+            yield from parse_diff_lines(_log_lines(process.stdout), dataset_path)
+            
+            returncode = process.wait()
+            if returncode != 0:
+                stderr_file.seek(0)
+                raise subprocess.CalledProcessError(returncode, cmd, stderr=stderr_file.read())
+        finally:
+            # Consumer stopped early: don't leave the CLI blocked on a full pipe
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+
+def records_to_dataframe(records, dataset_path):
+    """
+    Collect diff records into a DataFrame with a FULL_PATH column.
+    
+    Args:
+        records (iterable): DiffRecord objects, e.g. from iter_diff_records
+        dataset_path (Path): Path to the mapped dataset, used to build FULL_PATH
+    
+    Returns:
+        pd.DataFrame: DataFrame with changed files
+    """
+    import pandas as pd
+    
+    columns = None
+    rows = []
+    for record in records:
+        columns = record.columns
+        rows.append(record.cells)
+    
+    if columns is None:
+        log.info("No changes detected")
+        return pd.DataFrame()
+    
+    with tracing.span("build diff table", rows=len(rows)), memprofile.stage("build diff table", rows=len(rows)):
+        df = pd.DataFrame(rows, columns=list(columns))
+        del rows
+        
+        # Add full path column for easier use, built column-wise instead of per row
+        file_name_col, path_col, _ = find_diff_columns(df.columns)
+        base = str(Path(dataset_path)) + os.sep
+        if file_name_col:
+            names = df[file_name_col]
+            if path_col:
+                dirs = df[path_col].fillna('').str.strip().str.strip('/')
+                df['FULL_PATH'] = (base + dirs + os.sep + names).where(dirs != '', base + names)
+            else:
+                df['FULL_PATH'] = base + names
+    
+    return df
+
 # %%
 def main(
     base_data_dir: str = typer.Option("data", help="The directory where the datasets are mapped"),
     dataset_name: str = typer.Argument(..., help="The name of the dataset to diff"),
-    output_csv: str = typer.Option(None, "--output-csv", "-o", help="Optional: Save results to CSV file")
+    output_csv: str = typer.Option(None, "--output-csv", "-o", help="Optional: Save results to CSV file"),
+    use_snapshot: bool = typer.Option(True, "--snapshot/--no-snapshot", help="Skip the diff when neither local nor remote changed since the last snapshot")
 ):
     """
     Check if Pennsieve datasets have changed between local and remote.
@@ -150,10 +285,23 @@ def main(
         base_data_dir: The directory where the datasets are mapped
         dataset_name: The name of the dataset to diff
         output_csv: Optional path to save results as CSV
+        use_snapshot: If True, reuse the last diff when nothing changed
     """
+    # Look up the dataset's remote updatedAt so an unchanged dataset can be skipped
+    remote_updated_at = None
+    if use_snapshot:
+        try:
+            pennepi_collection = pennseive.main()
+            remote_updated_at = next(
+                (dataset.get('updatedAt') for dataset in pennepi_collection if dataset['name'] == dataset_name),
+                None
+            )
+        except Exception as e:
+            log.warning(f"Could not look up '{dataset_name}' in the Pennsieve catalog, running a full diff: {e}")
     
     # Diff the datasets
-    df = diff_dataset(dataset_name, base_data_dir)
+    with tracing.span("diff dataset", dataset=dataset_name), memprofile.stage("diff dataset", dataset=dataset_name):
+        df = diff_dataset(dataset_name, base_data_dir, remote_updated_at=remote_updated_at, use_snapshot=use_snapshot)
     
     # Check if we got a valid DataFrame
     if df is None:
@@ -172,6 +320,9 @@ def main(
     return df
 # %%
 if __name__ == "__main__":
+    # Configure logging to show info messages
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
     # Set this to True for testing with hard-coded values
     # Set to False to use command-line arguments
     USE_HARDCODED_VALUES = True
@@ -181,7 +332,8 @@ if __name__ == "__main__":
         df = main(
             dataset_name="PennEPI00143", 
             base_data_dir=str(Path.cwd() / "data"), 
-            output_csv=str(Path.cwd() / "data" / "diff_pennseive_datasets.csv")
+            output_csv=str(Path.cwd() / "data" / "diff_pennseive_datasets.csv"),
+            use_snapshot=True
         )
         if df is not None:
             log.info(f"\nResults:\n{df}")
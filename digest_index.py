@@ -0,0 +1,158 @@
+"""
+Cached content digests for locally mapped datasets.
+
+Hashing multi-GB recordings is expensive, so the digests of every hashed
+file are kept in `<base_data_dir>/state/<dataset_name>/digests.json`
+together with the size and mtime they were computed for. A file is only
+hashed again when its size or mtime changed. Files are keyed by their path
+relative to the mapped dataset.
+
+Pennsieve stores a chunked checksum for newer packages,
+`{"chunkSize": ..., "checksum": ...}`: the SHA-256 of the concatenated SHA-256
+digests of each chunkSize-sized chunk (both the raw and the hex form of the
+digests are accepted). The local file is hashed with the same chunk
+size, in the same pass as its whole-file SHA-256 (older packages store that
+instead). Remote checksums are cached by package ID together with the
+version of the dataset's manifest, so they are looked up again after the
+dataset is mapped again, and an entry is dropped as soon as its file is
+queued for upload.
+"""
+# %%
+import hashlib
+import logging
+import os
+
+from pathlib import Path
+from dataset_snapshot import manifest_version
+from state import dataset_state_dir, load_state, save_state
+
+log = logging.getLogger(__name__)
+
+DIGEST_FILE = "digests.json"
+
+# %%
+class DigestIndex:
+    def __init__(self, base_data_dir, dataset_name):
+        self.dataset_path = Path(base_data_dir) / "output" / dataset_name
+        self.state_path = dataset_state_dir(base_data_dir, dataset_name) / DIGEST_FILE
+
+        data = load_state(self.state_path, default={})
+        self.local = data.get("local", {})
+        self.remote = data.get("remote", {})
+        self.manifest = manifest_version(self.dataset_path)
+        self.hashed = 0
+
+    def __repr__(self):
+        return f"DigestIndex(state_path={self.state_path}, local={len(self.local)}, remote={len(self.remote)})"
+
+    def local_digests(self, full_path, chunk_size=None):
+        """
+        Get the digests a local file can match Pennsieve's checksum with, hashing it only if it changed.
+
+        Args:
+            full_path (str): Path to the local file
+            chunk_size (int): Chunk size of Pennsieve's chunked checksum, or None
+
+        Returns:
+            set: Hex digests: the whole-file SHA-256 and, with a chunk size, the chunked checksums
+        """
+        key = Path(os.path.relpath(full_path, self.dataset_path)).as_posix()
+        st = os.stat(full_path)
+        chunk_key = str(chunk_size or 0)
+
+        cached = self.local.get(key)
+        if not (cached and cached["size"] == st.st_size and cached["mtime_ns"] == st.st_mtime_ns):
+            cached = self.local[key] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": None, "chunked": {}}
+        cached.setdefault("chunked", {})
+        if cached["sha256"] is None or (chunk_size and chunk_key not in cached["chunked"]):
+            log.debug(f"Hashing {key}")
+            with open(full_path, 'rb') as f:
+                cached["sha256"], chunked = hash_file(f, chunk_size)
+            if chunk_size:
+                cached["chunked"][chunk_key] = chunked
+            self.hashed += 1
+
+        return {cached["sha256"], *cached["chunked"].get(chunk_key, ())}
+
+    def remote_checksum(self, package_id, package_client):
+        """
+        Get the checksum Pennsieve stored for a package's source file.
+
+        Args:
+            package_id (str): Package ID (without "N:package:" prefix)
+            package_client: The Pennsieve package client
+
+        Returns:
+            tuple or None: (hex checksum, chunk size or None), or None if Pennsieve has none
+        """
+        cached = self.remote.get(package_id)
+        if isinstance(cached, dict) and cached["manifest"] == self.manifest:
+            return (cached["checksum"], cached["chunk_size"]) if cached["checksum"] else None
+
+        checksum = chunk_size = None
+        for file_info in package_client.get_package_files(package_id):
+            content = file_info.get("content", file_info)
+            value = content.get("checksum")
+            # Newer packages store {"chunkSize": ..., "checksum": ...}
+            if isinstance(value, dict):
+                chunk_size = value.get("chunkSize")
+                value = value.get("checksum")
+            if value:
+                checksum = value.lower()
+                break
+
+        self.remote[package_id] = {"checksum": checksum, "chunk_size": chunk_size, "manifest": self.manifest}
+        return (checksum, chunk_size) if checksum else None
+
+    def forget_remote(self, package_id):
+        """
+        Drop a package's cached checksum, e.g. because its file is uploaded again.
+
+        Args:
+            package_id (str): Package ID (without "N:package:" prefix)
+        """
+        self.remote.pop(package_id, None)
+
+    def save(self):
+        save_state(self.state_path, {"local": self.local, "remote": self.remote})
+
+def hash_file(f, chunk_size=None, buffer_size=8 << 20):
+    """
+    Hash a file in one pass: whole-file SHA-256 and, with a chunk size, chunked checksums.
+
+    Args:
+        f (file): File opened in binary mode
+        chunk_size (int): Size of the chunks hashed separately, or None
+        buffer_size (int): Bytes read at a time
+
+    Returns:
+        tuple: (whole-file hex digest, list of chunked hex digests: over the raw and over the hex chunk digests)
+    """
+    whole = hashlib.sha256()
+    chunk = hashlib.sha256()
+    chunk_digests = []
+    in_chunk = 0
+    buffer = memoryview(bytearray(buffer_size))
+    while True:
+        # Never read across a chunk boundary
+        want = min(buffer_size, chunk_size - in_chunk) if chunk_size else buffer_size
+        count = f.readinto(buffer[:want])
+        if not count:
+            break
+        data = buffer[:count]
+        whole.update(data)
+        if chunk_size:
+            chunk.update(data)
+            in_chunk += count
+            if in_chunk == chunk_size:
+                chunk_digests.append(chunk.digest())
+                chunk = hashlib.sha256()
+                in_chunk = 0
+    if in_chunk:
+        chunk_digests.append(chunk.digest())
+
+    chunked = []
+    if chunk_digests:
+        chunked.append(hashlib.sha256(b"".join(chunk_digests)).hexdigest())
+        chunked.append(hashlib.sha256("".join(d.hex() for d in chunk_digests).encode()).hexdigest())
+    return whole.hexdigest(), chunked
@@ -0,0 +1,184 @@
+"""
+Download cache - Share pulled packages between containers and hosts
+
+`pull --cache-dir` (or PENNSIEVE_DOWNLOAD_CACHE) points every container and
+analyst machine at one cache directory, e.g. a volume on shared storage. Pull
+resolves a placeholder's download manifest entry, then looks its package up in
+the cache; a hit whose checksum matches is copied into the mapped tree without
+downloading it. A miss is downloaded into the cache once and copied from
+there, so the next worker pulling the same package gets a hit. With
+`--cache-trust-size` the manifest lookup is skipped for cached packages, which
+are then served on size alone.
+
+Layout:
+
+    <cache_dir>/objects/<package_id[-2:]>/<package_id>        file content
+    <cache_dir>/objects/<package_id[-2:]>/<package_id>.json   size, checksum, filled_at
+    <cache_dir>/objects/<package_id[-2:]>/<package_id>.lock   fill lock
+
+Objects are keyed by package ID. The metadata keeps the size and the checksum
+Pennsieve reported when the object was filled: an object whose size doesn't
+match is treated as a miss and filled again, and so is one whose checksum
+differs from the one Pennsieve reports now (a package whose content was
+replaced). Without a checksum (`--cache-trust-size`, or none reported) a hit
+is decided on size alone.
+Fills hold an exclusive flock on the object's lock file, so two workers never
+download the same package at once: the second one waits and then finds the
+object. The object and its metadata are written to temp files and renamed into
+place, so readers never see partial content. flock needs a filesystem that
+supports it across hosts (local disks, NFSv4, Lustre, CephFS).
+"""
+#%%
+import fcntl
+import logging
+import os
+import shutil
+import threading
+import time
+
+from contextlib import contextmanager
+from pathlib import Path
+
+import tracing
+from download_writer import temp_path
+from state import load_state, save_state
+
+log = logging.getLogger(__name__)
+
+#%%
+class DownloadCache:
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        (self.cache_dir / "objects").mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.fills = 0
+        # Download workers share one cache
+        self._count_lock = threading.Lock()
+
+    def __repr__(self):
+        return f"DownloadCache(cache_dir={self.cache_dir}, hits={self.hits}, fills={self.fills})"
+
+    def object_path(self, package_id):
+        # The end of a package ID varies most, so it spreads objects over directories
+        return self.cache_dir / "objects" / package_id[-2:] / package_id
+
+    def lookup(self, package_id):
+        """
+        Get the metadata of a cached package.
+
+        Args:
+            package_id (str): Package ID (without "N:package:" prefix)
+
+        Returns:
+            dict or None: size, checksum and filled_at, or None if not cached
+        """
+        object_path = self.object_path(package_id)
+        meta = load_state(object_path.with_name(f"{package_id}.json"))
+        if meta is None:
+            return None
+        try:
+            if object_path.stat().st_size != meta["size"]:
+                return None
+        except FileNotFoundError:
+            return None
+        return meta
+
+    def _count(self, name):
+        with self._count_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _is_current(self, meta, checksum):
+        # Without a checksum on either side there is nothing to compare
+        return checksum is None or meta.get("checksum") is None or meta["checksum"] == checksum
+
+    @contextmanager
+    def _fill_lock(self, package_id):
+        lock_path = self.object_path(package_id).with_name(f"{package_id}.lock")
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def fill(self, package_id, download, checksum=None):
+        """
+        Download a package into the cache unless another worker already did
+        and its checksum matches.
+
+        Args:
+            package_id (str): Package ID (without "N:package:" prefix)
+            download (callable): Called with a path in the cache to download to; returns bytes written
+            checksum (str): Optional checksum Pennsieve reported for the package
+
+        Returns:
+            dict: Metadata of the cached package
+        """
+        with self._fill_lock(package_id):
+            # Whoever held the lock before us may have filled it
+            meta = self.lookup(package_id)
+            if meta is not None:
+                if self._is_current(meta, checksum):
+                    self._count("hits")
+                    return meta
+                log.warning(f"Cached {package_id} has checksum {meta['checksum']}, Pennsieve reports {checksum}; downloading it again")
+
+            object_path = self.object_path(package_id)
+            with tracing.span("cache fill", category="transfer", package_id=package_id) as span:
+                size = download(object_path)
+                span.set(bytes=size)
+            meta = {"size": object_path.stat().st_size, "checksum": checksum, "filled_at": time.time()}
+            save_state(object_path.with_name(f"{package_id}.json"), meta)
+            self._count("fills")
+            return meta
+
+    def copy_to(self, package_id, output_path):
+        """
+        Copy a cached package over its placeholder.
+
+        Args:
+            package_id (str): Package ID (without "N:package:" prefix)
+            output_path (str or Path): Placeholder in the mapped tree
+
+        Returns:
+            int: Bytes copied
+
+        Raises:
+            FileNotFoundError: If the package is not cached
+        """
+        output_path = Path(output_path)
+        tmp_path = temp_path(output_path)
+        try:
+            with tracing.span("cache copy", category="transfer", package_id=package_id) as span:
+                # A copy, not a link: edits in the mapped tree must never change the cache
+                shutil.copyfile(self.object_path(package_id), tmp_path)
+                size = tmp_path.stat().st_size
+                span.set(bytes=size)
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return size
+
+    def fetch(self, package_id, output_path, download, checksum=None):
+        """
+        Put a package's content at output_path, filling the cache first if needed.
+
+        Args:
+            package_id (str): Package ID (without "N:package:" prefix)
+            output_path (str or Path): Placeholder in the mapped tree
+            download (callable): Called with a path in the cache to download to on a miss
+            checksum (str): Optional checksum Pennsieve reported for the package;
+                a cached object with a different checksum is downloaded again
+
+        Returns:
+            int: Bytes copied into the mapped tree
+        """
+        meta = self.lookup(package_id)
+        if meta is not None and self._is_current(meta, checksum):
+            self._count("hits")
+            log.info(f"Cache hit for {package_id}")
+        else:
+            self.fill(package_id, download, checksum)
+        return self.copy_to(package_id, output_path)
@@ -0,0 +1,198 @@
+"""
+Download writer - Stream large downloads to disk without fragmenting shared storage
+
+Replaces curl's default output handling for pulls. For each file:
+
+    - the body is written to a temp file next to the placeholder, so the final
+      rename is atomic and never crosses filesystems
+    - the full size from the download manifest is reserved up front with
+      posix_fallocate, so concurrent multi-GB writes get contiguous extents
+    - data is written in large page-aligned buffers, one write per buffer
+    - dirty pages are flushed with fdatasync every `sync_bytes` and dropped from
+      the page cache, so writeback never piles up into one long stall
+    - the file is synced once more and renamed over the placeholder
+
+An interrupted download leaves the placeholder untouched. Connection errors,
+timeouts and 5xx responses are retried; 4xx responses (e.g. 403 for an expired
+presigned URL) and a full disk or quota are raised right away.
+"""
+#%%
+import errno
+import logging
+import mmap
+import os
+
+from pathlib import Path
+
+import backoff
+
+log = logging.getLogger(__name__)
+
+BUFFER_SIZE = 8 << 20
+SYNC_BYTES = 256 << 20
+
+# Local errors another attempt can't fix
+PERMANENT_ERRNOS = {errno.ENOSPC, errno.EDQUOT, errno.EROFS, errno.EACCES, errno.EPERM, errno.ENOENT}
+
+#%%
+def temp_path(output_path):
+    """
+    Get the temp file a download is written to before it replaces the placeholder.
+
+    Args:
+        output_path (Path): Final path of the file
+
+    Returns:
+        Path: Hidden file in the same directory
+    """
+    output_path = Path(output_path)
+    return output_path.with_name(f".{output_path.name}.part-{os.getpid()}")
+
+def preallocate(fd, size):
+    """
+    Reserve disk space for a file so it is written into contiguous extents.
+
+    Args:
+        fd (int): File descriptor open for writing
+        size (int): Size in bytes
+
+    Returns:
+        bool: True if the space was reserved; False if the filesystem can't
+    """
+    if not size or not hasattr(os, "posix_fallocate"):
+        return False
+    try:
+        os.posix_fallocate(fd, 0, size)
+        return True
+    except OSError as e:
+        if e.errno in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS):
+            log.debug(f"Preallocation not supported here: {e}")
+            return False
+        raise
+
+def _write_all(fd, view):
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+def _flush(fd, synced, offset):
+    os.fdatasync(fd)
+    # Written data is on disk; don't let it crowd the page cache of other transfers
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, synced, offset - synced, os.POSIX_FADV_DONTNEED)
+
+def write_stream(stream, output_path, expected_size=None, buffer_size=BUFFER_SIZE, sync_bytes=SYNC_BYTES):
+    """
+    Write a byte stream to a file through a same-directory temp file.
+
+    Args:
+        stream: Object with readinto(), e.g. a urllib3 response
+        output_path (str or Path): Final path of the file
+        expected_size (int): Optional, size to preallocate and verify
+        buffer_size (int): Bytes per write, rounded up to whole pages
+        sync_bytes (int): Bytes written between fdatasync calls
+
+    Returns:
+        int: Bytes written
+
+    Raises:
+        OSError: If the data was shorter or longer than expected_size
+    """
+    output_path = Path(output_path)
+    tmp_path = temp_path(output_path)
+    buffer_size = -(-buffer_size // mmap.PAGESIZE) * mmap.PAGESIZE
+
+    # Anonymous maps are page-aligned, so every full buffer is an aligned write
+    buffer = mmap.mmap(-1, buffer_size)
+    view = memoryview(buffer)
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_CLOEXEC", 0), 0o644)
+    try:
+        preallocated = preallocate(fd, expected_size)
+        offset = synced = 0
+        eof = False
+        while not eof:
+            filled = 0
+            while filled < buffer_size:
+                count = stream.readinto(view[filled:])
+                if not count:
+                    eof = True
+                    break
+                filled += count
+            _write_all(fd, view[:filled])
+            offset += filled
+            if offset - synced >= sync_bytes:
+                _flush(fd, synced, offset)
+                synced = offset
+
+        if expected_size is not None and offset != expected_size:
+            raise OSError(errno.EIO, f"Expected {expected_size} bytes, got {offset}")
+        if preallocated:
+            os.ftruncate(fd, offset)
+        os.fsync(fd)
+    except BaseException:
+        os.close(fd)
+        tmp_path.unlink(missing_ok=True)
+        raise
+    finally:
+        view.release()
+        buffer.close()
+
+    os.close(fd)
+    os.replace(tmp_path, output_path)
+    return offset
+
+def is_permanent_download_error(e):
+    """
+    Check whether a download error won't go away by downloading again.
+
+    Args:
+        e (Exception): Error raised by the download
+
+    Returns:
+        bool: True for 4xx responses other than 429 and for a full disk,
+            quota or unwritable directory; False for connection errors,
+            timeouts, 429, 5xx and short reads
+    """
+    import requests
+
+    if isinstance(e, requests.HTTPError):
+        status = e.response.status_code if e.response is not None else None
+        return status is not None and status < 500 and status != 429
+    if isinstance(e, requests.RequestException):
+        return False
+    return getattr(e, "errno", None) in PERMANENT_ERRNOS
+
+@backoff.on_exception(
+    backoff.expo,
+    OSError,  # requests' connection and read errors are OSErrors too
+    giveup=is_permanent_download_error,
+    max_tries=4,
+    max_time=300,
+    on_backoff=lambda details: log.warning(f"Download failed, retrying in {details['wait']:.1f}s (attempt {details['tries']}/{details['max_tries']})")
+)
+def download_file(url, output_path, expected_size=None, http_client=None, buffer_size=BUFFER_SIZE, sync_bytes=SYNC_BYTES):
+    """
+    Download a file with preallocation, aligned writes and batched syncs.
+
+    Args:
+        url (str): The URL to download from
+        output_path (str or Path): Local path where the file should be saved
+        expected_size (int): Optional, size from the download manifest
+        http_client (HttpClient): Optional, shared HTTP client
+        buffer_size (int): Bytes per write
+        sync_bytes (int): Bytes written between fdatasync calls
+
+    Returns:
+        int: Bytes written
+    """
+    if http_client is None:
+        from clients.http_client import default_http_client
+        http_client = default_http_client()
+
+    log.debug(f"Attempting download from {url[:100]}...")
+    with http_client.get(url, "download", stream=True) as response:
+        response.raise_for_status()
+        size = write_stream(response.raw, output_path, expected_size, buffer_size, sync_bytes)
+
+    log.info(f"Successfully downloaded file to {output_path}")
+    return size
@@ -0,0 +1,121 @@
+"""
+Filesystem scanner for mapped datasets.
+
+Walks a directory tree with `os.scandir`, reusing the stat data each directory
+listing already provides instead of stat'ing every path again, and lists
+subdirectories in parallel on a thread pool. Results are streamed as a
+generator so callers can start working before the walk finishes.
+"""
+# %%
+import logging
+import os
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+
+# %%
+class ScanEntry:
+    __slots__ = ("path", "size", "mtime_ns")
+
+    def __init__(self, path, size, mtime_ns):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+    def __repr__(self):
+        return f"ScanEntry(path={self.path}, size={self.size}, mtime_ns={self.mtime_ns})"
+
+
+def scan_directory(dir_path, skip_dirs=()):
+    """
+    List a single directory.
+
+    Args:
+        dir_path (str): Directory to list
+        skip_dirs (iterable): Subdirectory names to leave out
+
+    Returns:
+        tuple: (files, subdirs) where files is a list of ScanEntry and subdirs
+            a list of subdirectory names
+    """
+    files = []
+    subdirs = []
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in skip_dirs:
+                    subdirs.append(entry.name)
+            elif entry.is_file():
+                st = entry.stat()
+                files.append(ScanEntry(entry.path, st.st_size, st.st_mtime_ns))
+    return files, subdirs
+
+
+def scan_directories(root, max_workers=DEFAULT_WORKERS, skip_dirs=(), lister=None):
+    """
+    Walk a directory tree in parallel, yielding one result per directory.
+
+    Args:
+        root (str or Path): Directory to walk
+        max_workers (int): Number of directories listed concurrently
+        skip_dirs (iterable): Directory names not to descend into
+        lister (callable): Optional replacement for scan_directory, called as
+            lister(rel_dir, dir_path) and returning (files, subdirs)
+
+    Yields:
+        tuple: (rel_dir, files, subdirs) for each directory, in completion order
+    """
+    root = os.fspath(root)
+    skip_dirs = frozenset(skip_dirs)
+
+    def list_dir(rel_dir):
+        dir_path = os.path.join(root, rel_dir) if rel_dir else root
+        if lister is not None:
+            return lister(rel_dir, dir_path)
+        return scan_directory(dir_path, skip_dirs)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(list_dir, ""): ""}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel_dir = pending.pop(future)
+                try:
+                    files, subdirs = future.result()
+                except (FileNotFoundError, NotADirectoryError):
+                    # Removed while walking
+                    continue
+                except PermissionError as e:
+                    log.warning(f"Skipping unreadable directory {os.path.join(root, rel_dir)}: {e}")
+                    continue
+
+                for name in subdirs:
+                    child = os.path.join(rel_dir, name) if rel_dir else name
+                    pending[executor.submit(list_dir, child)] = child
+
+                yield rel_dir, files, subdirs
+
+
+def scan_tree(root, max_workers=DEFAULT_WORKERS, skip_dirs=()):
+    """
+    Stream every regular file under a path.
+
+    Args:
+        root (str or Path): File or directory to scan
+        max_workers (int): Number of directories listed concurrently
+        skip_dirs (iterable): Directory names not to descend into
+
+    Yields:
+        ScanEntry: One entry per regular file
+    """
+    root = os.fspath(root)
+    if not os.path.isdir(root):
+        st = os.stat(root)
+        yield ScanEntry(root, st.st_size, st.st_mtime_ns)
+        return
+
+    for _, files, _ in scan_directories(root, max_workers=max_workers, skip_dirs=skip_dirs):
+        yield from files
@@ -0,0 +1,205 @@
+"""
+Filesystem change watcher for mapped datasets.
+
+Reports files that were written, created or moved into a directory tree. On
+Linux it uses inotify through ctypes (no extra dependency), watching every
+directory and adding watches for new ones as they appear. Where inotify is not
+available (other platforms, exhausted watch limits, filesystems without
+notifications such as NFS) it falls back to rescanning the tree with
+`fs_scanner` and comparing sizes and mtimes.
+
+Both watchers only report changes made after they start.
+"""
+# %%
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+from fs_scanner import scan_tree
+
+log = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+EVENT_HEADER = struct.Struct("iIII")
+
+# %%
+class InotifyWatcher:
+    def __init__(self, root, skip_dirs=()):
+        self.root = str(root)
+        self.skip_dirs = set(skip_dirs)
+        self.started_ns = time.time_ns()
+
+        libc_name = ctypes.util.find_library("c")
+        self._libc = ctypes.CDLL(libc_name or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        self._dirs = {}
+        try:
+            self._watch_tree(self.root)
+        except OSError:
+            self.close()
+            raise
+
+    def __repr__(self):
+        return f"InotifyWatcher(root={self.root}, watched_dirs={len(self._dirs)})"
+
+    def _watch_dir(self, path):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_add_watch {path}: {os.strerror(err)}")
+        self._dirs[wd] = path
+
+    def _watch_tree(self, top, report=None):
+        for dir_path, dir_names, file_names in os.walk(top):
+            dir_names[:] = [name for name in dir_names if name not in self.skip_dirs]
+            self._watch_dir(dir_path)
+            # Files written before the watch on a new directory existed
+            if report is not None:
+                report.update(os.path.join(dir_path, name) for name in file_names)
+
+    def _rescan(self):
+        # Events were dropped, so fall back to mtimes for this round
+        log.warning("inotify queue overflowed, rescanning the tree")
+        return {
+            entry.path
+            for entry in scan_tree(self.root, skip_dirs=self.skip_dirs)
+            if entry.mtime_ns >= self.started_ns
+        }
+
+    def changes(self, timeout):
+        """
+        Wait for changes.
+
+        Args:
+            timeout (float): Seconds to wait for the first event
+
+        Returns:
+            set: Paths of files written, created or moved in since the last call
+        """
+        changed = set()
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return changed
+
+        while True:
+            try:
+                data = os.read(self._fd, 256 * 1024)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                name = os.fsdecode(data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0"))
+                offset += EVENT_HEADER.size + length
+
+                if mask & IN_Q_OVERFLOW:
+                    changed |= self._rescan()
+                    continue
+                if mask & IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                    continue
+
+                parent = self._dirs.get(wd)
+                if parent is None:
+                    continue
+                path = os.path.join(parent, name)
+                if mask & IN_ISDIR:
+                    if name not in self.skip_dirs and mask & (IN_CREATE | IN_MOVED_TO):
+                        try:
+                            self._watch_tree(path, report=changed)
+                        except OSError as e:
+                            log.warning(f"Could not watch new directory {path}: {e}")
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    changed.add(path)
+        return changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher:
+    def __init__(self, root, skip_dirs=(), interval=10.0):
+        self.root = str(root)
+        self.skip_dirs = set(skip_dirs)
+        self.interval = interval
+        self._snapshot = self._scan()
+        self._next_scan = time.monotonic() + interval
+
+    def __repr__(self):
+        return f"PollingWatcher(root={self.root}, interval={self.interval}, files={len(self._snapshot)})"
+
+    def _scan(self):
+        return {entry.path: (entry.size, entry.mtime_ns) for entry in scan_tree(self.root, skip_dirs=self.skip_dirs)}
+
+    def changes(self, timeout):
+        """
+        Wait for changes.
+
+        Args:
+            timeout (float): Seconds to wait at most; the tree is rescanned
+                only once per polling interval
+
+        Returns:
+            set: Paths of files created or changed since the last scan
+        """
+        wait = self._next_scan - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set()
+        if wait > 0:
+            time.sleep(wait)
+
+        snapshot = self._scan()
+        self._next_scan = time.monotonic() + self.interval
+        changed = {path for path, version in snapshot.items() if self._snapshot.get(path) != version}
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+# %%
+def create_watcher(root, skip_dirs=(), poll_interval=10.0, use_inotify=True):
+    """
+    Create the best available watcher for a directory tree.
+
+    Args:
+        root (str or Path): Directory to watch
+        skip_dirs (iterable): Directory names not to descend into
+        poll_interval (float): Seconds between rescans when polling
+        use_inotify (bool): If False, always poll (e.g. on network filesystems)
+
+    Returns:
+        InotifyWatcher or PollingWatcher
+    """
+    if use_inotify:
+        try:
+            watcher = InotifyWatcher(root, skip_dirs)
+            log.info(f"Watching {root} with inotify ({len(watcher._dirs)} directories)")
+            return watcher
+        except (OSError, AttributeError) as e:
+            hint = " (raise fs.inotify.max_user_watches)" if isinstance(e, OSError) and e.errno == errno.ENOSPC else ""
+            log.warning(f"inotify unavailable, falling back to polling every {poll_interval}s: {e}{hint}")
+
+    log.info(f"Watching {root} by polling every {poll_interval}s")
+    return PollingWatcher(root, skip_dirs, poll_interval)
@@ -6,11 +6,6 @@ This module contains functions for fetching and filtering EPS datasets.
 # %%
 import logging
 
-from config import Config
-from clients import AuthenticationClient, SessionManager
-from clients import DatasetsClient
-
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 log = logging.getLogger(__name__)
 
 # %%
@@ -21,6 +16,10 @@ def setup_pennsieve_clients():
     Returns:
         DatasetsClient: Client for accessing Pennsieve datasets
     """
+    from config import Config
+    from clients import AuthenticationClient, SessionManager
+    from clients import DatasetsClient
+
     log.info("Setting up Pennsieve clients...")
     config = Config()
     authorization_client = AuthenticationClient(api_host=config.API_HOST)
@@ -37,7 +36,7 @@ def get_PennEPI_datasets(datasets_client):
         datasets_client: Client for accessing Pennsieve datasets
         
     Returns:
-        list: List of PennEPI datasets with 'name' and 'id' keys, sorted by name
+        list: List of PennEPI datasets with 'name', 'id' and 'updatedAt' keys, sorted by name
     """
     log.info("Fetching all datasets from Pennsieve...")
     
@@ -49,8 +48,9 @@ def get_PennEPI_datasets(datasets_client):
     for dataset in datasets:
         name = dataset['content']['name']
         id = dataset['content']['id']
+        updated_at = dataset['content'].get('updatedAt')
         if 'pennepi' in name.lower():
-            pennepi_datasets.append({'name': name, 'id': id})
+            pennepi_datasets.append({'name': name, 'id': id, 'updatedAt': updated_at})
     
     # Sort alphabetically by name
     pennepi_datasets.sort(key=lambda x: x['name'])
@@ -67,5 +67,6 @@ def main():
 
 # %%
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     pennepi_collection = main()
     log.info(f"PennEPI collection: {pennepi_collection}")
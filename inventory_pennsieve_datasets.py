@@ -0,0 +1,233 @@
+"""
+Inventory Pennsieve Datasets - Export a columnar inventory of every mapped dataset
+
+Streams the manifest and the local tree of each mapped dataset into a Parquet
+dataset partitioned by dataset name:
+
+    <base_data_dir>/inventory/dataset=<dataset_name>/part-0.parquet
+
+One row per file, with typed columns:
+
+    path, file_name (string), extension, subject, session, modality (dictionary),
+    package_id (string), size (int64, null for placeholders), mtime (timestamp),
+    status (dictionary: pulled, placeholder, missing, local_only)
+
+Collection-wide questions then become column scans instead of tree walks, e.g.
+which subjects have post-implant CT and iEEG:
+
+    import pyarrow.dataset as ds
+    inv = ds.dataset("data/inventory", partitioning="hive")
+    df = inv.to_table(columns=["dataset", "subject", "modality"],
+                      filter=ds.field("session") == "ses-postimplant").to_pandas().astype(str)
+    by_modality = df.groupby("modality")[["dataset", "subject"]].apply(lambda g: set(map(tuple, g.values)))
+    by_modality["ct"] & by_modality["ieeg"]
+
+pyarrow is only imported by this command.
+
+Usage:
+    # Inventory every mapped dataset
+    uv run inventory_pennsieve_datasets.py --base-data-dir /app/data
+
+    # Inventory specific datasets
+    uv run inventory_pennsieve_datasets.py -n "PennEPI00143,PennEPI00049"
+"""
+#%%
+import logging
+import os
+import typer
+
+from pathlib import Path
+
+from fs_scanner import scan_tree
+from pull_pennseive_datasets import PLACEHOLDER_MAX_SIZE, find_manifest_file, load_package_paths
+from pull_planner import bids_entities
+
+
+log = logging.getLogger(__name__)
+
+# Rows buffered before a record batch is written
+BATCH_ROWS = 50_000
+
+#%%
+def inventory_schema():
+    """
+    Build the Arrow schema of the inventory.
+
+    Returns:
+        pyarrow.Schema: Schema of one inventory row
+    """
+    import pyarrow as pa
+
+    category = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ("path", pa.string()),
+        ("file_name", pa.string()),
+        ("extension", category),
+        ("package_id", pa.string()),
+        ("subject", category),
+        ("session", category),
+        ("modality", category),
+        ("size", pa.int64()),
+        ("mtime", pa.timestamp("ns")),
+        ("status", category),
+    ])
+
+def file_extension(file_name):
+    """
+    Get the lower-case extension of a file, keeping compound ones like .nii.gz.
+
+    Args:
+        file_name (str): Name of the file
+
+    Returns:
+        str: Extension including the leading dot, or "" if none
+    """
+    suffixes = Path(file_name).suffixes
+    if len(suffixes) >= 2 and suffixes[-1].lower() == '.gz':
+        return ''.join(suffixes[-2:]).lower()
+    return suffixes[-1].lower() if suffixes else ''
+
+def iter_inventory_rows(dataset_path):
+    """
+    Stream one inventory row per file of a mapped dataset.
+
+    Local files come from a single scan; manifest entries without a local
+    file are reported as missing.
+
+    Args:
+        dataset_path (Path): Path to the mapped dataset
+
+    Yields:
+        tuple: (path, file_name, extension, package_id, subject, session, modality, size, mtime_ns, status)
+    """
+    manifest_path = find_manifest_file(dataset_path)
+    package_paths = load_package_paths(manifest_path) if manifest_path else {}
+    unseen = set(package_paths)
+
+    for entry in scan_tree(dataset_path, skip_dirs={'.pennsieve'}):
+        rel_path = Path(os.path.relpath(entry.path, dataset_path)).as_posix()
+        package_id = package_paths.get(rel_path)
+        unseen.discard(rel_path)
+
+        size = entry.size
+        if package_id is None:
+            status = "local_only"
+        elif size <= PLACEHOLDER_MAX_SIZE and _holds_package_id(entry.path, package_id):
+            status = "placeholder"
+            size = None
+        else:
+            status = "pulled"
+
+        file_name = rel_path.rsplit('/', 1)[-1]
+        yield (rel_path, file_name, file_extension(file_name), package_id, *bids_entities(rel_path), size, entry.mtime_ns, status)
+
+    for rel_path in sorted(unseen):
+        file_name = rel_path.rsplit('/', 1)[-1]
+        yield (rel_path, file_name, file_extension(file_name), package_paths[rel_path], *bids_entities(rel_path), None, None, "missing")
+
+def _holds_package_id(path, package_id):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip() == package_id
+    except (OSError, UnicodeDecodeError):
+        return False
+
+def inventory_dataset(dataset_name, base_data_dir="data", batch_rows=BATCH_ROWS):
+    """
+    Write the inventory partition of one mapped dataset.
+
+    The partition file is written to a hidden temp file in the partition
+    directory (pyarrow skips files starting with ".") and renamed over the
+    old file when complete, so queries see either the old or the new
+    partition, never a half-written or missing one.
+
+    Args:
+        dataset_name (str): The name of the dataset (used for directory name)
+        base_data_dir (str): Base directory where datasets are mapped (default: "data")
+        batch_rows (int): Rows per record batch
+
+    Returns:
+        dict or None: Row count per status, or None on error
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    dataset_path = Path(base_data_dir) / "output" / dataset_name
+    if not dataset_path.exists():
+        log.error(f"Dataset directory does not exist: {dataset_path}")
+        return None
+
+    schema = inventory_schema()
+    partition_dir = Path(base_data_dir) / "inventory" / f"dataset={dataset_name}"
+    partition_dir.mkdir(parents=True, exist_ok=True)
+    part_path = partition_dir / "part-0.parquet"
+    tmp_path = partition_dir / f".part-0.parquet.tmp-{os.getpid()}"
+
+    counts = {}
+    columns = [[] for _ in schema]
+    status_index = schema.get_field_index("status")
+
+    def flush(writer):
+        arrays = [pa.array(values, type=field.type) for values, field in zip(columns, schema)]
+        writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+        for values in columns:
+            values.clear()
+
+    try:
+        with pq.ParquetWriter(tmp_path, schema, compression="zstd") as writer:
+            for row in iter_inventory_rows(dataset_path):
+                for values, value in zip(columns, row):
+                    values.append(value)
+                counts[row[status_index]] = counts.get(row[status_index], 0) + 1
+                if len(columns[0]) >= batch_rows:
+                    flush(writer)
+            if columns[0]:
+                flush(writer)
+        # A file rename is atomic, unlike replacing the whole partition directory
+        os.replace(tmp_path, part_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return counts
+
+# %%
+def main(
+    base_data_dir: str = typer.Option("data", help="The directory where the datasets are mapped"),
+    dataset_name: str = typer.Option("", "--dataset-name", "-n", help="The name(s) of the dataset(s) to inventory. Can be a single string or a comma-separated list. Defaults to all mapped datasets.")
+):
+    """
+    Export a partitioned Parquet inventory of mapped datasets.
+
+    Args:
+        base_data_dir: The directory where the datasets are mapped
+        dataset_name: The name(s) of the dataset(s) to inventory
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        log.error("The inventory needs pyarrow. Install the project dependencies with: uv sync")
+        raise typer.Exit(code=1)
+
+    if dataset_name:
+        dataset_names = [name.strip() for name in dataset_name.split(",")]
+    else:
+        output_dir = Path(base_data_dir) / "output"
+        dataset_names = sorted(p.name for p in output_dir.iterdir() if p.is_dir()) if output_dir.exists() else []
+
+    if not dataset_names:
+        log.warning("No mapped datasets found to inventory")
+        return
+
+    for name in dataset_names:
+        counts = inventory_dataset(name, base_data_dir=base_data_dir)
+        if counts is not None:
+            summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+            log.info(f"'{name}': {summary or 'no files'}")
+
+    log.info(f"Inventory written to: {Path(base_data_dir) / 'inventory'}")
+
+# %%
+if __name__ == "__main__":
+    # Configure logging to show info messages
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    typer.run(main)
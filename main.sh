@@ -27,13 +27,18 @@ pennsieve whoami
 # # Step 5: Pull specific files or directories from Pennsieve
 # echo "Step 5: Pulling specific files from Pennsieve..."
 # uv run pull_pennseive_datasets.py -i "/app/data/output/PennEPI00143/archive"
-# Additional pull examples:
-# uv run pull_pennseive_datasets.py -i "/app/data/output/PennEPI00049/participants.tsv"
-# uv run pull_pennseive_datasets.py -i "/app/data/output/PennEPI00049/participants.json"
-# uv run pull_pennseive_datasets.py -i "/app/data/output/PennEPI00049/derivatives"
-# uv run pull_pennseive_datasets.py -i "/app/data/output/PennEPI00049/primary/sub-PennEPI00049/ses-postimplant/ct"
-# uv run pull_pennseive_datasets.py -i "/app/data/output/PennEPI00049/primary/sub-PennEPI00049/ses-postsurgery/anat"
-# uv run pull_pennseive_datasets.py -i "/app/data/output/PennEPI00049/primary/sub-PennEPI00049/ses-preimplant"
+# Additional pull example: several paths in one run, sharing one client, manifest and download pool
+# uv run pull_pennseive_datasets.py --jobs 8 \
+#     -i "/app/data/output/PennEPI00049/participants.tsv" \
+#     -i "/app/data/output/PennEPI00049/participants.json" \
+#     -i "/app/data/output/PennEPI00049/derivatives" \
+#     -i "/app/data/output/PennEPI00049/primary/sub-PennEPI00049/ses-postimplant/ct" \
+#     -i "/app/data/output/PennEPI00049/primary/sub-PennEPI00049/ses-postsurgery/anat" \
+#     -i "/app/data/output/PennEPI00049/primary/sub-PennEPI00049/ses-preimplant"
+
+# # Step 6: Transcode pulled iEEG recordings into the memory-mappable store (optional)
+# echo "Step 6: Transcoding pulled recordings..."
+# uv run transcode_pennsieve_datasets.py -n "PennEPI00143" --base-data-dir /app/data
 
 # # Step 7: Check differences between local and remote
 echo "Step 7: Checking for differences between local and remote..."
@@ -47,6 +52,10 @@ uv run diff_pennseive_datasets.py --dataset-name "PennEPI00143" --base-data-dir
 # # # Uncomment to actually upload:
 # uv run push_pennseive_datasets.py -n "PennEPI00143" --base-data-dir /app/data
 
+# # Step 8b: Validate datasets are complete for downstream services
+# echo "Step 8b: Validating dataset completeness..."
+# uv run validate_pennsieve_datasets.py -n "PennEPI00143" --base-data-dir /app/data
+
 # # Step 9: Verify upload (optional)
 # echo "Step 9: Verifying upload..."
 # uv run diff_pennseive_datasets.py --dataset-name "PennEPI00143" --base-data-dir /app/data
@@ -3,13 +3,13 @@ import subprocess
 import logging
 import shutil
 import typer
+import tracing
+import memprofile
 import get_pennseive_datasets as pennseive
 
 from pathlib import Path
 
 
-# Configure logging to show info messages
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 log = logging.getLogger(__name__)
 
 #%%
@@ -39,12 +39,13 @@ def map_dataset(dataset_id, dataset_name, base_data_dir="data"):
         
         log.info(f"Mapping '{dataset_name}' to {dataset_path}")
         # Run the pennsieve map command
-        result = subprocess.run([
-            'pennsieve', 
-            'map', 
-            dataset_id, 
-            str(dataset_path)
-        ], capture_output=True, text=True, check=True)
+        with tracing.span("pennsieve map", category="subprocess", dataset=dataset_name):
+            result = subprocess.run([
+                'pennsieve', 
+                'map', 
+                dataset_id, 
+                str(dataset_path)
+            ], capture_output=True, text=True, check=True)
         log.info(result.stdout)
         return True
         
@@ -98,9 +99,12 @@ def main(
     
     # Map each dataset in the collection
     for dataset in pennepi_collection:
-        map_dataset(dataset_id=dataset['id'], dataset_name=dataset['name'], base_data_dir=base_data_dir)
+        with tracing.span("map dataset", dataset=dataset['name']), memprofile.stage("map dataset", dataset=dataset['name']):
+            map_dataset(dataset_id=dataset['id'], dataset_name=dataset['name'], base_data_dir=base_data_dir)
 # %%
 if __name__ == "__main__":
+    # Configure logging to show info messages
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     typer.run(main)
 
 # %%
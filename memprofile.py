@@ -0,0 +1,259 @@
+"""
+Opt-in memory profiling of the map/pull/diff/push stages.
+
+Stages are wrapped in `memprofile.stage(name, **attrs)`. With profiling on,
+every stage logs its peak resident set size (RSS) and how far it rose above
+the RSS the stage started with. Nested stages (the manifest load inside a
+pull) get their own peaks and still count towards their parents'.
+
+Profiling is off unless a mode is configured, either with the
+PENNSIEVE_MEMORY_PROFILE environment variable or `cli.py --memory-profile`:
+
+    rss      Peak RSS per stage only; costs a few /proc reads per stage
+    python   Also runs tracemalloc: peak Python heap per stage and the
+             allocation sites still holding the most memory when the stage
+             ends. Slows the run down and adds tracemalloc's own bookkeeping
+             to the RSS.
+
+With PENNSIEVE_MEMORY_SNAPSHOT_DIR (or `--memory-snapshot-dir`) in python
+mode, a tracemalloc snapshot is also dumped at the end of every stage; load
+it with `tracemalloc.Snapshot.load()` to compare two runs.
+
+Peak RSS per stage resets the kernel's high-water mark through
+/proc/self/clear_refs (Linux). Where that isn't possible the peak is the
+process's peak so far. When profiling is off, `stage()` returns a shared
+no-op object like `tracing.span()`.
+"""
+# %%
+import logging
+import os
+import re
+import resource
+import sys
+import threading
+import time
+
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+MODES = ("rss", "python")
+
+_profiler = None
+
+# %%
+class StageMemory:
+    __slots__ = ("name", "attrs", "rss_start", "rss_peak", "python_peak", "python_end", "seconds", "_start")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.rss_start = 0
+        self.rss_peak = 0
+        self.python_peak = None
+        self.python_end = None
+        self.seconds = 0.0
+
+    def __repr__(self):
+        return f"StageMemory(name={self.name}, rss_peak={self.rss_peak}, python_peak={self.python_peak})"
+
+    def summary(self):
+        attrs = ", ".join(f"{key}={value}" for key, value in self.attrs.items())
+        text = (f"Memory of '{self.name}'{f' ({attrs})' if attrs else ''}: peak RSS {self.rss_peak / (1 << 20):.1f} MiB "
+                f"(+{(self.rss_peak - self.rss_start) / (1 << 20):.1f} MiB) in {self.seconds:.1f}s")
+        if self.python_peak is not None:
+            text += f", Python heap peak {self.python_peak / (1 << 20):.1f} MiB, {self.python_end / (1 << 20):.1f} MiB left at the end"
+        return text
+
+
+class _NoopStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_STAGE = _NoopStage()
+
+
+class _Stage:
+    __slots__ = ("profiler", "memory")
+
+    def __init__(self, profiler, memory):
+        self.profiler = profiler
+        self.memory = memory
+
+    def __enter__(self):
+        self.profiler.enter(self.memory)
+        return self.memory
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.exit(self.memory)
+        return False
+
+
+class _Profiler:
+    def __init__(self, mode, snapshot_dir=None, top=5):
+        self.mode = mode
+        self.snapshot_dir = Path(snapshot_dir) if snapshot_dir else None
+        self.top = top
+        self.results = []
+        self._open = []
+        self._lock = threading.Lock()
+        self._snapshots = 0
+
+        self.resets_rss = _reset_rss_peak()
+        if not self.resets_rss:
+            log.info("Cannot reset the RSS high-water mark here, stage peaks are process peaks so far")
+
+        if mode == "python":
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if self.snapshot_dir is not None:
+                self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+
+    def close(self):
+        if self.mode == "python":
+            import tracemalloc
+            tracemalloc.stop()
+
+    def _fold(self):
+        # Give every open stage the peaks since the last reset, then start a new interval
+        rss_peak = _rss_peak()
+        python_peak = None
+        if self.mode == "python":
+            import tracemalloc
+            python_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.reset_peak()
+        for memory in self._open:
+            memory.rss_peak = max(memory.rss_peak, rss_peak)
+            if python_peak is not None:
+                memory.python_peak = max(memory.python_peak or 0, python_peak)
+        if self.resets_rss:
+            _reset_rss_peak()
+
+    def enter(self, memory):
+        with self._lock:
+            self._fold()
+            memory.rss_start = memory.rss_peak = _rss_current()
+            if self.mode == "python":
+                import tracemalloc
+                memory.python_peak = tracemalloc.get_traced_memory()[0]
+            self._open.append(memory)
+            memory._start = time.monotonic()
+
+    def exit(self, memory):
+        with self._lock:
+            memory.seconds = time.monotonic() - memory._start
+            self._fold()
+            self._open.remove(memory)
+            self.results.append(memory)
+
+        snapshot = None
+        if self.mode == "python":
+            import tracemalloc
+            memory.python_end = tracemalloc.get_traced_memory()[0]
+            snapshot = tracemalloc.take_snapshot()
+
+        log.info(memory.summary())
+        if snapshot is not None:
+            for stat in snapshot.statistics("lineno")[:self.top]:
+                log.info(f"  {stat.size / (1 << 20):.1f} MiB in {stat.count} blocks at {stat.traceback[0]}")
+            if self.snapshot_dir is not None:
+                with self._lock:
+                    self._snapshots += 1
+                    index = self._snapshots
+                slug = re.sub(r"[^A-Za-z0-9]+", "-", memory.name).strip("-")
+                snapshot_path = self.snapshot_dir / f"{os.getpid()}-{index:03d}-{slug}.tracemalloc"
+                snapshot.dump(str(snapshot_path))
+                log.info(f"  tracemalloc snapshot: {snapshot_path}")
+
+# %%
+def _rss_current():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return _rss_peak()
+
+
+def _rss_peak():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) << 10
+    except OSError:
+        pass
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss << 10
+
+
+def _reset_rss_peak():
+    # "5" resets VmHWM to the current RSS (Linux 4.0+)
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+# %%
+def configure(mode=None, snapshot_dir=None, top=5):
+    """
+    Turn memory profiling on or off.
+
+    Args:
+        mode (str): "rss", "python", or None to turn profiling off
+        snapshot_dir (str): Optional, directory tracemalloc snapshots are dumped to (python mode)
+        top (int): Allocation sites logged per stage (python mode)
+    """
+    global _profiler
+    if _profiler is not None:
+        _profiler.close()
+        _profiler = None
+
+    if mode:
+        if mode not in MODES:
+            raise ValueError(f"memory profile mode must be one of {', '.join(MODES)}, got {mode!r}")
+        _profiler = _Profiler(mode, snapshot_dir, top)
+        log.info(f"Memory profiling on ({mode})")
+
+
+def stage(name, **attrs):
+    """
+    Measure the memory of a pipeline stage, used as a context manager.
+
+    Args:
+        name (str): Name of the stage (e.g. "pull", "load manifest")
+        **attrs: Attributes logged with the stage (e.g. dataset)
+
+    Returns:
+        A context manager yielding the stage's StageMemory, or None when profiling is off
+    """
+    profiler = _profiler
+    if profiler is None:
+        return _NOOP_STAGE
+    return _Stage(profiler, StageMemory(name, attrs))
+
+
+def results():
+    """
+    Get the stages measured so far, in the order they finished.
+
+    Returns:
+        list: StageMemory objects
+    """
+    return list(_profiler.results) if _profiler is not None else []
+
+
+if os.getenv("PENNSIEVE_MEMORY_PROFILE"):
+    try:
+        configure(os.getenv("PENNSIEVE_MEMORY_PROFILE"), os.getenv("PENNSIEVE_MEMORY_SNAPSHOT_DIR"))
+    except ValueError as e:
+        log.warning(f"Memory profiling stays off: {e}")
@@ -1,18 +1,36 @@
 #%%
+import os
 import logging
 import backoff
+import socket
 import subprocess
 import json
+import queue
+import requests
+import threading
+import time
 import typer
+import tracing
+import memprofile
 
 from pathlib import Path
-from config import Config
-from clients import AuthenticationClient, SessionManager
-from clients import PackageClient
+from typing import List
+from fs_scanner import scan_tree
+from download_writer import download_file
+from dehydrate_pennsieve_datasets import dehydrate, record_pulled
+from scratch_stage import ScratchStage
+from download_cache import DownloadCache
+from work_queue import WorkQueue
+from state import load_state, save_state
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 log = logging.getLogger(__name__)
 
+# Placeholders only hold a package ID, so anything larger is already downloaded
+PLACEHOLDER_MAX_SIZE = 1024
+
+THROUGHPUT_FILE = "pull_throughput.json"
+THROUGHPUT_HISTORY = 20
+
 #%%
 def setup_pennsieve_clients():
     """
@@ -21,6 +39,10 @@ def setup_pennsieve_clients():
     Returns:
         PackageClient: Client for downloading Pennsieve packages
     """
+    from config import Config
+    from clients import AuthenticationClient, SessionManager
+    from clients import PackageClient
+
     log.info("Setting up Pennsieve Package Download Client...")
     config = Config()
     authorization_client = AuthenticationClient(api_host=config.API_HOST)
@@ -63,72 +85,363 @@ def download_file_with_curl_backoff(url, output_path):
     log.info(f"Successfully downloaded file to {output_path}")
     return result
 
-def process_files_and_download(file_path, package_client):
+def iter_placeholders(path, valid_package_ids):
     """
-    Process either a single file or all files recursively in a directory and download them.
+    Stream the placeholder files under a path that still need downloading.
     
     Args:
-        file_path (str or Path): Path to a file or directory containing package IDs
-        package_client: The Pennsieve package client for getting download URLs
-    """
-    path = Path(file_path)
-    
-    # Check if path exists
-    if not path.exists():
-        log.error(f"Path does not exist: {path}")
-        return
+        path (Path): Path to a file or directory of a mapped dataset
+        valid_package_ids (set): Package IDs from the dataset manifest
     
-    # Find the manifest.json file to validate package IDs
-    manifest_path = find_manifest_file(path)
-    if not manifest_path:
-        log.error("Could not find manifest.json file. Cannot validate package IDs.")
-        return
-    
-    # Load valid package IDs from manifest
-    valid_package_ids = load_valid_package_ids(manifest_path)
-    log.info(f"Loaded {len(valid_package_ids)} valid package IDs from manifest")
-    
-    # Determine if it's a file or directory
-    if path.is_file():
-        log.info(f"Processing single file: {path}")
-        files_to_process = [path]
-    elif path.is_dir():
-        log.info(f"Processing directory: {path}")
-        # Get all files in the directory and subdirectories recursively
-        files_to_process = [f for f in path.rglob('*') if f.is_file()]
-        log.info(f"Found {len(files_to_process)} files to process")
-    else:
-        log.error(f"Path is neither a file nor a directory: {path}")
-        return
-    
-    # Process each file
-    for file_path in files_to_process:
+    Yields:
+        tuple: (file_path, package_id) for each placeholder
+    """
+    for entry in scan_tree(path, skip_dirs={'.pennsieve'}):
+        file_path = Path(entry.path)
+        
+        # The scan already has the size, so downloaded files are never opened
+        if entry.size > PLACEHOLDER_MAX_SIZE:
+            log.debug(f"Skipping {file_path.name} - already downloaded")
+            continue
+        
         try:
-            log.info(f"Processing file: {file_path}")
-            
             # Read the content from the file
             with open(file_path, 'r') as f:
                 content = f.read().strip()  # strip() removes any whitespace
-            
-            # Validate if this is a valid package ID by checking against manifest
-            if content not in valid_package_ids:
-                log.info(f"Skipping {file_path.name} - already downloaded (package ID not found in manifest or invalid)")
-                continue
-            
-            package_id = content
-            log.info(f"Valid package ID found: {package_id}")
-            
-            # Get the download manifest from Pennsieve
-            response = package_client.get_download_manifest(package_id)
-            presigned_url = response['data'][0]['url']
-            
-            # Download the file using curl with backoff
-            log.info(f"Downloading to {file_path}")
-            download_file_with_curl_backoff(presigned_url, file_path)
-            
         except Exception as e:
             log.error(f"Error processing file {file_path}: {str(e)}")
-            continue  # Continue with the next file even if one fails
+            continue
+        
+        # Validate if this is a valid package ID by checking against manifest
+        if content not in valid_package_ids:
+            log.info(f"Skipping {file_path.name} - already downloaded (package ID not found in manifest or invalid)")
+            continue
+        
+        yield file_path, content
+
+def resolve_download_urls(placeholders, package_client, download_queue, on_error=None, cache=None, cache_trust_size=False):
+    """
+    Resolve presigned URLs for placeholders and feed them to the downloader.
+    
+    Runs ahead of the downloads by at most the queue's size, so the next
+    URL is ready when a transfer finishes and URLs don't expire while queued.
+    A None sentinel marks the end of the work.
+    
+    Args:
+        placeholders (iterable): (file_path, package_id) tuples
+        package_client: The Pennsieve package client for getting download URLs
+        download_queue (queue.Queue): Bounded queue of (file_path, package_id, manifest entry) tuples;
+            with cache_trust_size, the entry (url, size, ...) is None for packages already in the cache
+        on_error (callable): Optional, called with (file_path, exception) when a URL can't be resolved
+        cache (DownloadCache): Optional shared cache the downloads are served from
+        cache_trust_size (bool): If True, a cached package of the right size is a hit without
+            asking Pennsieve for its checksum, so a package replaced by one of the same size is
+            served stale; by default the entry, and its checksum, is resolved for every package
+    """
+    try:
+        for file_path, package_id in placeholders:
+            try:
+                log.info(f"Valid package ID found: {package_id}")
+                
+                if cache is not None and cache_trust_size and cache.lookup(package_id) is not None:
+                    download_queue.put((file_path, package_id, None))
+                    continue
+                
+                # Get the download manifest from Pennsieve
+                with tracing.span("resolve url", file=str(file_path), package_id=package_id):
+                    response = package_client.get_download_manifest(package_id)
+                download_queue.put((file_path, package_id, response['data'][0]))
+            except Exception as e:
+                log.error(f"Error processing file {file_path}: {str(e)}")
+                if on_error:
+                    on_error(file_path, e)
+                continue  # Continue with the next file even if one fails
+    finally:
+        download_queue.put(None)
+
+def iter_path_placeholders(paths, manifests):
+    """
+    Stream the placeholders of several paths, loading each dataset's manifest once.
+    
+    Paths that overlap (a dataset and one of its folders, or the same folder
+    spelled differently or reached through a symlink) yield each file once.
+    
+    Args:
+        paths (list): Paths to files or directories of mapped datasets
+        manifests (dict): Valid package IDs by manifest path, filled in as datasets are found
+    
+    Yields:
+        tuple: (file_path, package_id) for each placeholder
+    """
+    seen = set()
+    for path in paths:
+        path = Path(path)
+        
+        # Check if path exists
+        if not path.exists():
+            log.error(f"Path does not exist: {path}")
+            continue
+        
+        # Find the manifest.json file to validate package IDs
+        manifest_path = find_manifest_file(path)
+        if not manifest_path:
+            log.error(f"Could not find manifest.json file for {path}. Cannot validate package IDs.")
+            continue
+        
+        # Load valid package IDs from manifest, once per dataset
+        valid_package_ids = manifests.get(manifest_path)
+        if valid_package_ids is None:
+            with memprofile.stage("load manifest", manifest=str(manifest_path)):
+                valid_package_ids = manifests[manifest_path] = load_valid_package_ids(manifest_path)
+            log.info(f"Loaded {len(valid_package_ids)} valid package IDs from manifest")
+        
+        log.info(f"Processing {'single file' if path.is_file() else 'directory'}: {path}")
+        for file_path, package_id in iter_placeholders(path, valid_package_ids):
+            real_path = os.path.realpath(file_path)
+            if real_path not in seen:
+                seen.add(real_path)
+                yield file_path, package_id
+
+def process_files_and_download(file_path, package_client, prefetch=4, work_queue=None, worker_id=None, jobs=1, writer="python",
+                               scratch_dir=None, scratch_bytes=0, move_jobs=2, cache_dir=None, cache_trust_size=False):
+    """
+    Process files or directories recursively and download their placeholders.
+    
+    A resolver thread looks up presigned URLs up to `prefetch` files ahead
+    while files download, so there is no API round trip between transfers.
+    All paths share one pool of `jobs` download threads, so the number of
+    concurrent transfers stays bounded however many paths are pulled.
+    
+    With a shared work queue, the placeholders found are added to the queue
+    and this worker only downloads the items it leases, so several machines
+    can pull the same directory without duplicate transfers.
+    
+    With a scratch directory, files are downloaded to the scratch tier and a
+    background mover copies them over their placeholders (see scratch_stage.py);
+    files of unknown size or larger than the tier are downloaded in place.
+    
+    With a cache directory, packages are taken from the shared download cache
+    and misses are downloaded into it first (see download_cache.py). A cached
+    package is only used if its checksum matches the one Pennsieve reports,
+    unless cache_trust_size skips that lookup.
+    
+    Args:
+        file_path (str, Path or list): Path(s) to files or directories containing package IDs
+        package_client: The Pennsieve package client for getting download URLs
+        prefetch (int): Number of presigned URLs resolved ahead of the downloads
+        work_queue (WorkQueue): Optional shared queue to take the work from (single path only)
+        worker_id (str): ID of this worker in the shared queue
+        jobs (int): Number of files downloaded concurrently
+        writer (str): "python" to preallocate and write through download_writer,
+            "curl" for curl's own output handling
+        scratch_dir (str or Path): Optional fast local directory downloads land in first
+        scratch_bytes (int): Size limit of the scratch directory
+        move_jobs (int): Files moved from scratch to the mapped tree concurrently
+        cache_dir (str or Path): Optional shared download cache directory
+        cache_trust_size (bool): If True, serve cached packages of the right size without
+            checking their checksum with Pennsieve
+    """
+    paths = [file_path] if isinstance(file_path, (str, Path)) else list(file_path)
+    manifests = {}
+    
+    placeholders = iter_path_placeholders(paths, manifests)
+    on_error = None
+    heartbeat = None
+    if work_queue is not None:
+        # Every worker seeds the queue from its scan; existing items are kept
+        added = work_queue.enqueue(placeholders)
+        log.info(f"Added or reset {added} placeholders in the shared work queue {work_queue.db_path}")
+        placeholders = work_queue.claims(worker_id, batch_size=max(prefetch, 1))
+        on_error = lambda failed_path, e: work_queue.fail(failed_path, worker_id, e)
+        heartbeat = work_queue.start_heartbeat(worker_id)
+    
+    cache = DownloadCache(cache_dir) if cache_dir else None
+    
+    # Resolve URLs on a separate thread, bounded so memory and URL age stay small
+    download_queue = queue.Queue(maxsize=max(prefetch, jobs, 1))
+    resolver = threading.Thread(
+        target=tracing.wrap(resolve_download_urls),
+        args=(placeholders, package_client, download_queue, on_error, cache, cache_trust_size),
+        daemon=True
+    )
+    resolver.start()
+    
+    totals = {"files": 0, "bytes": 0}
+    totals_lock = threading.Lock()
+    downloaded = []
+    stage = ScratchStage(scratch_dir, scratch_bytes, move_jobs) if scratch_dir else None
+    
+    def fetch(url, output_path, expected_size, package_id):
+        if writer == "curl":
+            download_file_with_curl_backoff(url, output_path)
+            return Path(output_path).stat().st_size
+        try:
+            return download_file(url, output_path, expected_size)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 403:
+                raise
+            # The presigned URL expired while queued; get a fresh one
+            log.info(f"Download URL of {package_id} expired, resolving it again")
+            entry = package_client.get_download_manifest(package_id)['data'][0]
+            return download_file(entry['url'], output_path, entry.get('size'))
+    
+    def finish(file_path, package_id, size, error=None):
+        if error is not None:
+            if on_error:
+                on_error(file_path, error)
+            return
+        with totals_lock:
+            totals["files"] += 1
+            totals["bytes"] += size
+            downloaded.append((file_path, package_id, size))
+        if work_queue is not None:
+            work_queue.complete(file_path, worker_id)
+    
+    def download_worker():
+        while (item := download_queue.get()) is not None:
+            file_path, package_id, entry = item
+            try:
+                if cache is not None:
+                    if entry is None and cache.lookup(package_id) is None:
+                        # Cached when it was queued but gone since: resolve the URL, and its checksum, now
+                        entry = package_client.get_download_manifest(package_id)['data'][0]
+                    
+                    def download_to_cache(object_path, entry=entry, package_id=package_id):
+                        # Removed from the cache after the check above
+                        if entry is None:
+                            entry = package_client.get_download_manifest(package_id)['data'][0]
+                        return fetch(entry['url'], object_path, entry.get('size'), package_id)
+                    
+                    with tracing.span("download", category="transfer", file=str(file_path), writer=writer, cache=entry is None) as span:
+                        size = cache.fetch(package_id, file_path, download_to_cache, entry.get('checksum') if entry else None)
+                        span.set(bytes=size)
+                    finish(file_path, package_id, size)
+                    continue
+                
+                presigned_url, expected_size = entry['url'], entry.get('size')
+                if stage is not None and stage.fits(expected_size):
+                    scratch_path = stage.reserve(expected_size)
+                    log.info(f"Downloading {file_path} to scratch")
+                    stage.download_meter.start()
+                    size = 0
+                    try:
+                        with tracing.span("download", category="transfer", file=str(file_path), writer=writer, scratch=True) as span:
+                            size = fetch(presigned_url, scratch_path, expected_size, package_id)
+                            span.set(bytes=size)
+                    except Exception:
+                        stage.release(expected_size, scratch_path)
+                        raise
+                    finally:
+                        stage.download_meter.stop(size)
+                    stage.move(scratch_path, file_path, expected_size,
+                               lambda moved_path, error, package_id=package_id, size=size: finish(moved_path, package_id, size, error))
+                    continue
+                
+                log.info(f"Downloading to {file_path}")
+                with tracing.span("download", category="transfer", file=str(file_path), writer=writer) as span:
+                    size = fetch(presigned_url, file_path, expected_size, package_id)
+                    span.set(bytes=size)
+                finish(file_path, package_id, size)
+            except Exception as e:
+                log.error(f"Error processing file {file_path}: {str(e)}")
+                if on_error:
+                    on_error(file_path, e)
+                continue  # Continue with the next file even if one fails
+        # Pass the end marker on to the other download threads
+        download_queue.put(None)
+    
+    started = time.monotonic()
+    workers = [threading.Thread(target=tracing.wrap(download_worker), daemon=True) for _ in range(max(jobs, 1))]
+    try:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        resolver.join()
+        if stage is not None:
+            # Leases are kept (heartbeat) until the last staged file is in place
+            stage.close()
+    finally:
+        if heartbeat is not None:
+            heartbeat.set()
+        # Index what was downloaded, even after an interruption, so it can be dehydrated later
+        for manifest_path in manifests:
+            dataset_path = manifest_path.parent.parent
+            pulled = [(path, package_id) for path, package_id, _ in downloaded if Path(path).is_relative_to(dataset_path)]
+            if pulled:
+                record_pulled(dataset_path, pulled)
+    
+    log.info(f"Downloaded {totals['files']} files")
+    if cache is not None:
+        log.info(f"Download cache: {cache.hits} hits, {cache.fills} packages downloaded into {cache.cache_dir}")
+    if totals["files"]:
+        seconds = time.monotonic() - started
+        # Each data directory keeps its own throughput history, so files are credited to the one they belong to
+        by_state_path = {}
+        for manifest_path in manifests:
+            dataset_path = manifest_path.parent.parent
+            sizes = [size for path, _, size in downloaded if Path(path).is_relative_to(dataset_path)]
+            if sizes:
+                group = by_state_path.setdefault(throughput_state_path(manifest_path), [manifest_path, 0, 0])
+                group[1] += len(sizes)
+                group[2] += sum(sizes)
+        for manifest_path, files, total_bytes in by_state_path.values():
+            # The directories shared the wall time; each gets its share of it by bytes
+            share = total_bytes / totals["bytes"] if totals["bytes"] else files / totals["files"]
+            record_throughput(manifest_path, files, total_bytes, seconds * share)
+    if work_queue is not None:
+        log.info(f"Shared work queue: {work_queue.counts()}")
+
+def throughput_state_path(manifest_path):
+    """
+    Get the file keeping the measured pull throughput.
+    
+    Throughput depends on the host and its network, not the dataset, so it is
+    kept once per data directory: <base_data_dir>/output/<dataset>/.pennsieve/manifest.json
+    maps to <base_data_dir>/state/pull_throughput.json.
+    
+    Args:
+        manifest_path (Path): Path to a dataset's manifest.json file
+    
+    Returns:
+        Path: Path of the throughput state file
+    """
+    return Path(manifest_path).parent.parent.parent.parent / "state" / THROUGHPUT_FILE
+
+def record_throughput(manifest_path, files, total_bytes, seconds):
+    """
+    Add a finished pull to the throughput history used by `pull --plan`.
+    
+    Args:
+        manifest_path (Path): Path to the pulled dataset's manifest.json file
+        files (int): Number of files downloaded
+        total_bytes (int): Bytes downloaded
+        seconds (float): Wall time of the downloads, including URL lookups
+    """
+    state_path = throughput_state_path(manifest_path)
+    history = load_state(state_path, default=[])
+    history.append({"time": time.time(), "files": files, "bytes": total_bytes, "seconds": seconds})
+    save_state(state_path, history[-THROUGHPUT_HISTORY:])
+
+def recent_throughput(manifest_path):
+    """
+    Get the throughput of recent pulls.
+    
+    Args:
+        manifest_path (Path): Path to a dataset's manifest.json file
+    
+    Returns:
+        dict or None: bytes_per_second and seconds_per_file over the history, or None without history
+    """
+    history = load_state(throughput_state_path(manifest_path), default=[])
+    seconds = sum(run["seconds"] for run in history)
+    if not history or seconds <= 0:
+        return None
+    return {
+        "bytes_per_second": sum(run["bytes"] for run in history) / seconds,
+        "seconds_per_file": seconds / sum(run["files"] for run in history),
+        "runs": len(history),
+    }
 
 def find_manifest_file(start_path):
     """
@@ -180,17 +493,141 @@ def load_valid_package_ids(manifest_path):
     except Exception as e:
         log.error(f"Error reading manifest file {manifest_path}: {str(e)}")
         return set()
+
+def load_package_paths(manifest_path):
+    """
+    Map dataset-relative file paths to package IDs from the manifest.json file.
     
-def main(input_path: str = typer.Option(..., "--input-path", "-i", help="The path to the directory or file containing package IDs in mapped Pennsieve datasets")):
+    Args:
+        manifest_path (Path): Path to the manifest.json file
+    
+    Returns:
+        dict: Package ID (without "N:package:" prefix) for each relative file path
+    """
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest_data = json.load(f)
+        
+        package_paths = {}
+        for file_info in manifest_data.get('files', []):
+            package_id = file_info.get('packageId', '')
+            # Remove the "N:package:" prefix if present
+            if package_id.startswith('N:package:'):
+                package_id = package_id[10:]
+            
+            # Entries hold the folder in 'path' and the file in 'name' (or 'fileName')
+            folder = (file_info.get('path') or '').strip('/')
+            name = file_info.get('name') or file_info.get('fileName')
+            rel_path = f"{folder}/{name}" if folder and name else (name or folder)
+            if package_id and rel_path:
+                package_paths[rel_path] = package_id
+        
+        return package_paths
+        
+    except Exception as e:
+        log.error(f"Error reading manifest file {manifest_path}: {str(e)}")
+        return {}
+    
+def main(
+    input_path: List[str] = typer.Option(None, "--input-path", "-i", help="The path to a directory or file containing package IDs in mapped Pennsieve datasets. Repeat for several paths."),
+    dataset_name: str = typer.Option("", "--dataset-name", "-n", help="Optional: Whole dataset(s) to pull. Can be a single string or a comma-separated list."),
+    base_data_dir: str = typer.Option("data", help="The directory where the datasets are mapped (used with --dataset-name)"),
+    jobs: int = typer.Option(4, "--jobs", "-j", help="Number of files downloaded at once across all paths"),
+    prefetch: int = typer.Option(4, "--prefetch", help="Number of download URLs resolved ahead of the current download"),
+    queue_path: str = typer.Option(None, "--queue", help="SQLite work queue on a shared filesystem; run the same command on several machines to split the pull between them"),
+    worker_id: str = typer.Option(None, "--worker-id", help="ID of this worker in the shared queue (default: <hostname>-<pid>)"),
+    lease_seconds: int = typer.Option(600, "--lease", help="Seconds a claimed file stays leased without a heartbeat before other workers reclaim it"),
+    plan: bool = typer.Option(False, "--plan", help="Don't download; print a JSON plan (a list with several paths) with file counts, bytes per subject/session/modality and an estimated duration"),
+    plan_output: str = typer.Option(None, "--plan-output", help="Optional: Save the plan to a JSON file instead of printing it"),
+    writer: str = typer.Option("python", "--writer", help="Download writer: 'python' (preallocated, aligned, batched fsync) or 'curl'"),
+    scratch_dir: str = typer.Option(None, "--scratch-dir", help="Optional: Fast local directory (NVMe, tmpfs) downloads land in before a background mover copies them into the mapped tree"),
+    scratch_gb: float = typer.Option(50.0, "--scratch-gb", help="With --scratch-dir: size limit of the scratch directory in GB"),
+    move_jobs: int = typer.Option(2, "--move-jobs", help="With --scratch-dir: files moved into the mapped tree at once"),
+    cache_dir: str = typer.Option(None, "--cache-dir", envvar="PENNSIEVE_DOWNLOAD_CACHE", help="Optional: Shared download cache directory; a cached package is used when its checksum matches the one Pennsieve reports"),
+    cache_trust_size: bool = typer.Option(False, "--cache-trust-size", help="With --cache-dir: use a cached package of the right size without asking Pennsieve for its checksum. Saves one API call per cached file, but a package replaced by one of the same size is served stale"),
+    disk_budget_gb: float = typer.Option(None, "--disk-budget-gb", help="Optional: After pulling, dehydrate least recently used pulled files back to placeholders until all pulled files fit in this many GB")
+):
     """
     Main function to process and download files from Pennsieve.
     
     Args:
-        input_path (str): Path to the directory or file containing package IDs
+        input_path (list): Paths to directories or files containing package IDs
+        dataset_name (str): Whole dataset(s) to pull
+        base_data_dir (str): The directory where the datasets are mapped
+        jobs (int): Number of files downloaded at once across all paths
+        prefetch (int): Number of download URLs resolved ahead of the current download
+        queue_path (str): Optional shared work queue for a multi-machine pull
+        worker_id (str): ID of this worker in the shared queue
+        lease_seconds (int): Lease duration of claimed files in the shared queue
+        plan (bool): If True, only report what the pull would download
+        plan_output (str): Optional path to save the plan as JSON
+        writer (str): Download writer, "python" or "curl"
+        scratch_dir (str): Optional scratch directory downloads land in first
+        scratch_gb (float): Size limit of the scratch directory in GB
+        move_jobs (int): Files moved from scratch into the mapped tree at once
+        cache_dir (str): Optional shared download cache directory
+        cache_trust_size (bool): If True, cache hits are decided on size alone
+        disk_budget_gb (float): Optional disk budget for pulled files, enforced after the pull
     """
+    if writer not in ("python", "curl"):
+        log.error(f"Unknown writer '{writer}': use 'python' or 'curl'")
+        raise typer.Exit(code=1)
+    
+    paths = list(input_path or [])
+    if dataset_name:
+        paths.extend(str(Path(base_data_dir) / "output" / name.strip()) for name in dataset_name.split(","))
+    if not paths:
+        log.error("Nothing to pull: give --input-path and/or --dataset-name")
+        raise typer.Exit(code=1)
+    
+    # Enough connections, and hedge threads, for every download and URL lookup in flight
+    from clients.http_client import DEFAULT_POOL_SIZE, default_http_client
+    default_http_client(pool_size=max(DEFAULT_POOL_SIZE, jobs + prefetch))
+    
+    # One client and one authentication for every path
     package_client = setup_pennsieve_clients()
-    process_files_and_download(input_path, package_client)
+    
+    if plan:
+        # The planner imports this module, so it is loaded only when needed
+        from pull_planner import plan_pull
+        
+        plans = [plan_pull(path, package_client) for path in paths]
+        if any(pull_plan is None for pull_plan in plans):
+            raise typer.Exit(code=1)
+        pull_plan = plans[0] if len(plans) == 1 else plans
+        if plan_output:
+            with open(plan_output, 'w') as f:
+                json.dump(pull_plan, f, indent=2)
+            log.info(f"Plan saved to: {plan_output}")
+        else:
+            typer.echo(json.dumps(pull_plan, indent=2))
+        return
+    
+    work_queue = None
+    if queue_path:
+        if len(paths) != 1:
+            log.error("--queue takes a single input path; start one queue per path")
+            raise typer.Exit(code=1)
+        path = Path(paths[0])
+        work_queue = WorkQueue(queue_path, path if path.is_dir() else path.parent, lease_seconds=lease_seconds)
+        worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        log.info(f"Pulling as worker {worker_id} from shared queue {queue_path}")
+    
+    with tracing.span("pull", paths=paths), memprofile.stage("pull"):
+        process_files_and_download(paths, package_client, prefetch=prefetch, work_queue=work_queue, worker_id=worker_id, jobs=jobs, writer=writer,
+                                   scratch_dir=scratch_dir, scratch_bytes=int(scratch_gb * 1e9), move_jobs=move_jobs,
+                                   cache_dir=cache_dir, cache_trust_size=cache_trust_size)
+    
+    if disk_budget_gb is not None:
+        # Every dataset under a data directory shares its budget:
+        # <base_data_dir>/output/<dataset>/.pennsieve/manifest.json
+        base_dirs = {manifest_path.parent.parent.parent.parent for manifest_path in (find_manifest_file(Path(path)) for path in paths) if manifest_path}
+        for base_dir in sorted(base_dirs):
+            stats = dehydrate(base_dir, int(disk_budget_gb * 1e9))
+            log.info(f"Dehydrated {stats['dehydrated_files']} files ({stats['dehydrated_bytes'] / 1e9:.2f} GB) in {base_dir}; "
+                     f"pulled files take {stats['pulled_bytes_after'] / 1e9:.2f} of {disk_budget_gb} GB")
 
 #%%
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     typer.run(main)
@@ -0,0 +1,154 @@
+"""
+Pull planner - Report what a pull would download without downloading it
+
+`pull --plan` scans a mapped path once, splits its files into placeholders
+still to download and files already present, and looks up the size of every
+placeholder with batched download-manifest requests. The report is broken
+down by BIDS subject, session and modality, and the duration is estimated
+from the throughput of recent pulls on this host. It is printed as JSON so a
+scheduler can decide which pulls to run when.
+"""
+#%%
+import logging
+import os
+
+from pathlib import Path
+
+from fs_scanner import scan_tree
+from pull_pennseive_datasets import (
+    PLACEHOLDER_MAX_SIZE,
+    find_manifest_file,
+    load_valid_package_ids,
+    recent_throughput,
+)
+
+log = logging.getLogger(__name__)
+
+#%%
+def bids_entities(rel_path):
+    """
+    Get the BIDS subject, session and modality of a dataset-relative path.
+
+    Args:
+        rel_path (str): Path relative to the mapped dataset
+
+    Returns:
+        tuple: (subject, session, modality); None for parts the path does not have
+    """
+    folders = Path(rel_path).parts[:-1]
+    subject = next((part for part in folders if part.startswith('sub-')), None)
+    session = next((part for part in folders if part.startswith('ses-')), None)
+
+    # The modality folder (anat, ct, ieeg, ...) sits right below the subject or session
+    modality = None
+    if subject and folders[-1] not in (subject, session):
+        modality = folders[-1]
+    return subject, session, modality
+
+def lookup_sizes(package_client, package_ids, batch_size=50):
+    """
+    Look up the file sizes of packages with batched download-manifest requests.
+
+    Args:
+        package_client: The Pennsieve package client
+        package_ids (list): Package IDs (without "N:package:" prefix)
+        batch_size (int): Packages per request
+
+    Returns:
+        tuple: (sizes by package ID, list of package IDs whose lookup failed)
+    """
+    sizes = {}
+    failed = []
+    for start in range(0, len(package_ids), batch_size):
+        batch = package_ids[start:start + batch_size]
+        try:
+            response = package_client.get_download_manifests(batch)
+        except Exception as e:
+            log.error(f"Failed to look up {len(batch)} packages: {e}")
+            failed.extend(batch)
+            continue
+
+        for entry in response.get('data', []):
+            package_id = entry.get('nodeId', '').removeprefix('N:package:')
+            sizes[package_id] = sizes.get(package_id, 0) + (entry.get('size') or 0)
+        failed.extend(package_id for package_id in batch if package_id not in sizes)
+
+    return sizes, failed
+
+def plan_pull(input_path, package_client, batch_size=50):
+    """
+    Plan a pull: what it would download, what is already present, and how long it would take.
+
+    Args:
+        input_path (str or Path): Path to a file or directory of a mapped dataset
+        package_client: The Pennsieve package client
+        batch_size (int): Packages per download-manifest request
+
+    Returns:
+        dict or None: JSON-serializable plan, or None if the path can't be planned
+    """
+    path = Path(input_path)
+    if not path.exists():
+        log.error(f"Path does not exist: {path}")
+        return None
+
+    manifest_path = find_manifest_file(path)
+    if not manifest_path:
+        log.error("Could not find manifest.json file. Cannot validate package IDs.")
+        return None
+
+    valid_package_ids = load_valid_package_ids(manifest_path)
+    dataset_path = manifest_path.parent.parent
+
+    # One scan: placeholders hold a manifest package ID, anything else is present
+    placeholders = []
+    present_files = present_bytes = 0
+    for entry in scan_tree(path, skip_dirs={'.pennsieve'}):
+        package_id = None
+        if entry.size <= PLACEHOLDER_MAX_SIZE:
+            try:
+                with open(entry.path, 'r') as f:
+                    package_id = f.read().strip()
+            except (OSError, UnicodeDecodeError):
+                pass
+        if package_id in valid_package_ids:
+            placeholders.append((Path(os.path.relpath(entry.path, dataset_path)).as_posix(), package_id))
+        else:
+            present_files += 1
+            present_bytes += entry.size
+
+    log.info(f"Looking up sizes of {len(placeholders)} placeholders")
+    sizes, failed = lookup_sizes(package_client, sorted({package_id for _, package_id in placeholders}), batch_size)
+
+    groups = {}
+    total_bytes = 0
+    unknown = 0
+    for rel_path, package_id in placeholders:
+        key = bids_entities(rel_path)
+        group = groups.setdefault(key, {"files": 0, "bytes": 0})
+        group["files"] += 1
+        size = sizes.get(package_id)
+        if size is None:
+            unknown += 1
+            continue
+        group["bytes"] += size
+        total_bytes += size
+
+    throughput = recent_throughput(manifest_path)
+    estimated_seconds = None
+    if throughput:
+        estimated_seconds = total_bytes / throughput["bytes_per_second"] + unknown * throughput["seconds_per_file"]
+
+    return {
+        "path": str(path),
+        "dataset": dataset_path.name,
+        "to_download": {"files": len(placeholders), "bytes": total_bytes, "unknown_size": unknown},
+        "already_present": {"files": present_files, "bytes": present_bytes},
+        "breakdown": [
+            {"subject": subject, "session": session, "modality": modality, **group}
+            for (subject, session, modality), group in sorted(groups.items(), key=lambda item: tuple(part or '' for part in item[0]))
+        ],
+        "throughput": throughput,
+        "estimated_seconds": estimated_seconds,
+        "failed_lookups": failed,
+    }
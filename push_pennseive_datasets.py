@@ -9,6 +9,18 @@ Key Features:
     - Each file uploaded with correct target path on Pennsieve
     - Dry-run mode to preview changes
     - Batch processing for multiple datasets
+    - Streaming mode that adds files to the manifest while the diff is running
+    - Delta mode that also uploads MODIFIED files, but only if their content
+      hash differs from the checksum on Pennsieve (cached digest index)
+    - Timeseries mode that imports EDF/BrainVision recordings in bulk through
+      the import service (see timeseries_import.py)
+    - Sharded mode that splits the files into size-balanced manifests, uploads
+      several at once (each shard waits for its uploads, so the limit holds)
+      and retries only the files that failed
+    - Wait mode that follows the agent until every file is uploaded, reporting
+      per-file completion and throughput without another diff (see upload_tracker.py)
+    - Watch mode that keeps running and pushes new files in batches as they
+      are written, without re-running the diff (see push_watch.py)
 
 Prerequisites:
     1. Pennsieve Agent running: pennsieve agent
@@ -31,30 +43,436 @@ Usage:
     
     # Dry run (preview what will be uploaded)
     uv run push_pennseive_datasets.py -n "PennEPI00143" --dry-run
+    
+    # Stream the diff (start adding files before the diff finishes)
+    uv run push_pennseive_datasets.py -n "PennEPI00143" --stream
+    
+    # Also push MODIFIED files whose content actually changed
+    uv run push_pennseive_datasets.py -n "PennEPI00143" --delta
+    
+    # Split a large push into 8 manifests, 4 uploading at a time
+    uv run push_pennseive_datasets.py -n "PennEPI00143" --shards 8 --max-concurrent 4
+    
+    # Block until the agent has uploaded every file
+    uv run push_pennseive_datasets.py -n "PennEPI00143" --wait
+    
+    # Keep running and push new derivatives as they are written
+    uv run push_pennseive_datasets.py -n "PennEPI00143" --watch
 
 Reference:
     https://docs.pennsieve.io/docs/uploading-files-using-the-pennsieve-agent
 """
 #%%
+import heapq
+import os
 import subprocess
 import logging
 import re
+import stat
 import typer
-import pandas as pd
 import get_pennseive_datasets as pennseive
 import diff_pennseive_datasets as diff_pennseive
+import pull_pennseive_datasets as pull_pennseive
+import timeseries_import
+import tracing
+import memprofile
+import upload_tracker
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from digest_index import DigestIndex
+from state import dataset_state_dir, save_state
 
 
-# Configure logging to show info messages
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 log = logging.getLogger(__name__)
 
 #%%
-def push_dataset(dataset_id, dataset_name, base_data_dir="data", upload_path=None, dry_run=False, diff_df=None):
+def create_manifest(full_path, target_path=""):
+    """
+    Create an upload manifest with its first file.
+    
+    Note: pennsieve manifest create requires a file path, not just --dataset flag
+    
+    Args:
+        full_path (str): Local path of the file
+        target_path (str): Target folder on Pennsieve (-t flag)
+    
+    Returns:
+        str or None: The manifest ID, or None if it could not be extracted
+    """
+    # Build create command with target path flag
+    create_cmd = [
+        'pennsieve',
+        'manifest',
+        'create',
+        str(full_path)
+    ]
+    
+    # Add target path if specified
+    if target_path and str(target_path).strip():
+        create_cmd.extend(['-t', str(target_path).strip()])
+    
+    with tracing.span("pennsieve manifest create", category="subprocess", file=str(full_path)):
+        result = subprocess.run(create_cmd, capture_output=True, text=True, check=True)
+    
+    log.info(result.stdout)
+    
+    # Extract manifest ID from output
+    # Expected format: "Manifest ID: 40 Message: Successfully indexed 1 files."
+    for line in result.stdout.split('\n'):
+        # Look for "ID:" or "Manifest ID:" pattern
+        if 'id' in line.lower():
+            # Extract first number after "ID:"
+            match = re.search(r'ID:\s*(\d+)', line, re.IGNORECASE)
+            if match:
+                return match.group(1)
+    
+    log.error("Could not extract manifest ID from output.")
+    log.error(f"Output was: {result.stdout}")
+    return None
+
+def add_to_manifest(manifest_id, full_path, target_path=""):
+    """
+    Add a file to an existing upload manifest.
+    
+    Args:
+        manifest_id (str): The manifest ID
+        full_path (str): Local path of the file
+        target_path (str): Target folder on Pennsieve (-t flag)
+    
+    Raises:
+        subprocess.CalledProcessError: If the file could not be added
+    """
+    add_cmd = [
+        'pennsieve',
+        'manifest',
+        'add',
+        manifest_id,
+        str(full_path)
+    ]
+    
+    # Add target path if specified
+    if target_path and str(target_path).strip():
+        add_cmd.extend(['-t', str(target_path).strip()])
+    
+    with tracing.span("pennsieve manifest add", category="subprocess", file=str(full_path)):
+        subprocess.run(add_cmd, capture_output=True, text=True, check=True)
+
+def upload_manifest(manifest_id):
+    """
+    Start uploading a manifest through the Pennsieve agent.
+    
+    Args:
+        manifest_id (str): The manifest ID
+    """
+    log.info(f"Starting upload for manifest {manifest_id}...")
+    with tracing.span("pennsieve upload manifest", category="subprocess", manifest_id=manifest_id):
+        result = subprocess.run([
+            'pennsieve',
+            'upload',
+            'manifest',
+            manifest_id
+        ], capture_output=True, text=True, check=True)
+    log.info(result.stdout)
+
+def build_manifest(files, file_exists, failed_files=None):
+    """
+    Put files into a new upload manifest as they arrive.
+    
+    The manifest is created with the first file that exists locally; every
+    following file is added to it with its target path.
+    
+    Args:
+        files (iterable): (full_path, target_path, file_name) tuples
+        file_exists (callable): Returns True if a local path exists
+        failed_files (list): Optional, collects the full paths of files that were not added
+    
+    Returns:
+        tuple: (manifest_id, success_count, failed_count); manifest_id is None
+            if no manifest could be created
+    """
+    manifest_id = None
+    success_count = 0
+    failed_count = 0
+    
+    for full_path, target_path, file_name in files:
+        # Check if file exists
+        if not file_exists(full_path):
+            log.warning(f"File not found, skipping: {full_path}")
+            failed_count += 1
+            if failed_files is not None:
+                failed_files.append(full_path)
+            continue
+        
+        if manifest_id is None:
+            log.info(f"Creating manifest with first file: {file_name} -> {target_path}")
+            manifest_id = create_manifest(full_path, target_path)
+            if manifest_id is None:
+                if failed_files is not None:
+                    failed_files.append(full_path)
+                return None, success_count, failed_count + 1
+            log.info(f"Created manifest with ID: {manifest_id}")
+            success_count += 1
+            continue
+        
+        # Add file to manifest with target path
+        log.info(f"Adding: {file_name} -> {target_path}")
+        try:
+            add_to_manifest(manifest_id, full_path, target_path)
+            success_count += 1
+            log.debug(f"Added successfully: {file_name}")
+        except subprocess.CalledProcessError as e:
+            log.error(f"Failed to add {file_name}: {e.stderr}")
+            failed_count += 1
+            if failed_files is not None:
+                failed_files.append(full_path)
+    
+    return manifest_id, success_count, failed_count
+
+def stat_local_files(paths):
+    """
+    Get the size of every path that is a regular file.
+
+    Symlinks are followed, so files under symlinked directories are found too.
+
+    Args:
+        paths (iterable): Local file paths
+
+    Returns:
+        dict: Size in bytes by normalized path, for the paths that are files
+    """
+    sizes = {}
+    for path in paths:
+        path = os.path.normpath(path)
+        if path in sizes:
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if stat.S_ISREG(st.st_mode):
+            sizes[path] = st.st_size
+    return sizes
+
+def shard_files(files, file_size, shard_count):
+    """
+    Split files into size-balanced shards.
+    
+    Files are placed largest first, each into the shard with the fewest bytes
+    so far, which keeps the shards within one file of each other.
+    
+    Args:
+        files (list): (full_path, target_path, file_name) tuples
+        file_size (callable): Returns the size of a local path in bytes
+        shard_count (int): Number of shards
+    
+    Returns:
+        list: Non-empty lists of (full_path, target_path, file_name) tuples
+    """
+    shards = [[] for _ in range(max(1, shard_count))]
+    heap = [(0, index) for index in range(len(shards))]
+    for file, size in sorted(((file, file_size(file[0])) for file in files), key=lambda item: -item[1]):
+        total, index = heapq.heappop(heap)
+        shards[index].append(file)
+        heapq.heappush(heap, (total + size, index))
+    return [shard for shard in shards if shard]
+
+def push_shard(files, file_exists, shard_name, wait=False, poll_seconds=10.0, wait_timeout=None):
+    """
+    Put one shard into its own manifest and upload it.
+    
+    Args:
+        files (list): (full_path, target_path, file_name) tuples
+        file_exists (callable): Returns True if a local path exists
+        shard_name (str): Name used in log messages
+        wait (bool): If True, return only once the agent finished the upload
+        poll_seconds (float): Seconds between upload status checks
+        wait_timeout (float): Optional, stop waiting after this many seconds
+    
+    Returns:
+        tuple: (manifest_id, success_count, failed files, file states, finished);
+            every file of the shard is failed if its manifest could not be
+            created or uploaded, and with wait also if the agent failed to
+            upload it. finished is False if the wait stopped before every
+            file of the manifest was final
+    """
+    failed_files = []
+    try:
+        manifest_id, success_count, _ = build_manifest(files, file_exists, failed_files)
+        if manifest_id is None:
+            return None, 0, [file for file in files if file_exists(file[0])], {}, True
+        upload_manifest(manifest_id)
+    except subprocess.CalledProcessError as e:
+        log.error(f"Failed to push {shard_name}: {e.stderr}")
+        return None, 0, list(files), {}, True
+    
+    log.info(f"{shard_name}: uploading {success_count} files in manifest {manifest_id}")
+    failed = {os.path.abspath(path) for path in failed_files}
+    states = {}
+    finished = True
+    if wait:
+        progress = upload_tracker.wait_for_manifests([manifest_id], poll_seconds, wait_timeout)
+        states = progress.states
+        failed.update(os.path.abspath(path) for path in progress.failed)
+        success_count -= len(progress.failed) + progress.pending
+        finished = not progress.unfinished
+    # Missing files won't appear on a retry, only those the agent refused or failed are retried;
+    # files still uploading when the wait stopped are not retried either, they may yet arrive
+    return manifest_id, success_count, [
+        file for file in files if os.path.abspath(file[0]) in failed and file_exists(file[0])
+    ], states, finished
+
+def push_sharded(files, file_exists, file_size, shard_count, max_concurrent=4, retries=2, poll_seconds=10.0, wait_timeout=None):
+    """
+    Upload files as several size-balanced manifests, a few at a time.
+    
+    A shard holds its slot until the agent finished uploading it, so
+    `max_concurrent` bounds the uploads in flight. Shards that fail (or the
+    files in them the agent refused or failed to upload) are pushed again as
+    new manifests, up to `retries` times; shards that succeeded are left alone.
+    
+    Args:
+        files (list): (full_path, target_path, file_name) tuples
+        file_exists (callable): Returns True if a local path exists
+        file_size (callable): Returns the size of a local path in bytes
+        shard_count (int): Number of manifests to split the files into
+        max_concurrent (int): Shards pushed at the same time
+        retries (int): Extra attempts for failed shards
+        poll_seconds (float): Seconds between upload status checks
+        wait_timeout (float): Optional, stop waiting for a shard after this many seconds
+    
+    Returns:
+        tuple: (manifest IDs, success_count, failed files, file states,
+            IDs of manifests whose uploads were not followed to the end)
+    """
+    shards = {f"shard {index + 1}": shard for index, shard in enumerate(shard_files(files, file_size, shard_count))}
+    log.info(f"Pushing {len(files)} files in {len(shards)} shards, {max_concurrent} at a time")
+    
+    manifest_ids = []
+    success_count = 0
+    file_states = {}
+    unfinished = []
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrent), thread_name_prefix="push-shard") as pool:
+        for attempt in range(retries + 1):
+            if attempt:
+                log.warning(f"Retrying {len(shards)} failed shards (attempt {attempt + 1}/{retries + 1})")
+            futures = {
+                name: pool.submit(tracing.wrap(push_shard), shard, file_exists, name, True, poll_seconds, wait_timeout)
+                for name, shard in shards.items()
+            }
+            failed_shards = {}
+            for name, future in futures.items():
+                manifest_id, pushed, failed, states, finished = future.result()
+                if manifest_id is not None:
+                    manifest_ids.append(manifest_id)
+                if not finished:
+                    unfinished.append(manifest_id)
+                success_count += pushed
+                # A retried file's latest state replaces the failed one
+                file_states.update(states)
+                if failed:
+                    failed_shards[name] = failed
+            shards = failed_shards
+            if not shards:
+                break
+    
+    failed_files = [file for shard in shards.values() for file in shard]
+    return manifest_ids, success_count, failed_files, file_states, unfinished
+
+def save_upload_states(base_data_dir, dataset_name, manifest_ids, file_states):
+    """
+    Keep the final upload state of every file of a push.
+    
+    Args:
+        base_data_dir (str): Base directory where datasets are mapped
+        dataset_name (str): Dataset name (used for directory)
+        manifest_ids (list): Manifests of the push
+        file_states (dict): Agent state of each file by its local source path
+    """
+    state_path = dataset_state_dir(base_data_dir, dataset_name) / upload_tracker.UPLOAD_STATES_FILE
+    save_state(state_path, {"manifests": list(manifest_ids), "files": file_states})
+    log.info(f"Upload states saved to: {state_path}")
+
+def iter_diff_files(changed_files, dataset_path):
+    """
+    Get (full_path, target_path, file_name, change_type) tuples from rows of a diff DataFrame.
+    
+    Args:
+        changed_files (pd.DataFrame): Rows of the diff results
+        dataset_path (Path): Path to the mapped dataset
+    
+    Yields:
+        tuple: (full_path, target_path, file_name, change_type) for each row
+    """
+    import pandas as pd
+    
+    # Get column names
+    file_name_col, path_col, update_col = diff_pennseive.find_diff_columns(changed_files.columns)
+    full_path_col = next(
+        (col for col in changed_files.columns if 'FULL_PATH' in col.upper() or 'FULL PATH' in col.upper()),
+        None
+    )
+    
+    for values in changed_files.itertuples(index=False, name=None):
+        row = dict(zip(changed_files.columns, values))
+        file_name = row[file_name_col]
+        target_path = row[path_col] if not pd.isna(row[path_col]) else ""
+        full_path = row.get(full_path_col, '') if full_path_col else ""
+        
+        # If we don't have FULL_PATH, construct it
+        if not full_path:
+            full_path = str(dataset_path / str(target_path).strip() / file_name) if target_path else str(dataset_path / file_name)
+        
+        yield full_path, str(target_path).strip(), file_name, str(row[update_col]).upper()
+
+def content_changed(full_path, dataset_path, digest_index, package_paths, package_client):
+    """
+    Check whether a MODIFIED file's content differs from its copy on Pennsieve.
+    
+    Compares the cached digests of the local file, hashed with Pennsieve's
+    chunk size, with the checksum Pennsieve stored for the file's package, so
+    files whose mtime changed but whose content is identical are not uploaded
+    again.
+    
+    Args:
+        full_path (str): Local path of the file
+        dataset_path (Path): Path to the mapped dataset
+        digest_index (DigestIndex): Cached local digests and remote checksums
+        package_paths (dict): Package ID for each dataset-relative file path
+        package_client: The Pennsieve package client
+    
+    Returns:
+        bool: True if the file should be uploaded
+    """
+    rel_path = Path(os.path.relpath(full_path, dataset_path)).as_posix()
+    
+    package_id = package_paths.get(rel_path)
+    if package_id is None:
+        log.warning(f"No package found for {rel_path} in manifest, uploading it")
+        return True
+    
+    try:
+        remote = digest_index.remote_checksum(package_id, package_client)
+        if remote is None:
+            log.warning(f"Pennsieve has no checksum for {rel_path}, uploading it")
+            return True
+        
+        checksum, chunk_size = remote
+        if checksum in digest_index.local_digests(full_path, chunk_size):
+            log.info(f"Skipping {rel_path} - content unchanged (only mtime differs)")
+            return False
+    except FileNotFoundError:
+        # Reported as missing when it is added to the manifest
+        return True
+    
+    # The upload changes the package, so its checksum is looked up again next time
+    digest_index.forget_remote(package_id)
+    return True
+
+def push_dataset(dataset_id, dataset_name, base_data_dir="data", upload_path=None, dry_run=False, diff_df=None, stream=False, delta=False, timeseries=False,
+                 shards=1, max_concurrent=4, shard_retries=2, wait=False, poll_seconds=10.0, wait_timeout=None):
     """
-    Push ADDED files from a locally mapped dataset to Pennsieve.
+    Push ADDED (and with delta, content-changed MODIFIED) files from a locally mapped dataset to Pennsieve.
     
     Workflow:
         1. Set active dataset
@@ -70,9 +488,23 @@ def push_dataset(dataset_id, dataset_name, base_data_dir="data", upload_path=Non
         upload_path (str): Unused (kept for compatibility)
         dry_run (bool): If True, preview without uploading
         diff_df (pd.DataFrame): Diff results. If None, runs diff automatically
+        stream (bool): If True, ignore diff_df and add ADDED files to the manifest
+            while `pennsieve map diff` is still printing them
+        delta (bool): If True, also upload MODIFIED files whose content hash
+            differs from the checksum stored on Pennsieve
+        timeseries (bool): If True, upload EDF/BrainVision recordings as bulk
+            timeseries imports instead of through the agent manifest
+        shards (int): Number of size-balanced manifests to split the upload into;
+            more than one always waits for the uploads, as with wait
+        max_concurrent (int): Shards uploading at the same time
+        shard_retries (int): Extra attempts for shards that failed
+        wait (bool): If True, block until the agent finished every upload and
+            save the per-file final states
+        poll_seconds (float): Seconds between upload status checks
+        wait_timeout (float): Optional, stop waiting for uploads after this many seconds
     
     Returns:
-        bool: True if successful, False otherwise
+        bool: True if successful (with wait: every file uploaded), False otherwise
     """
     # Create the full path for the dataset directory
     dataset_path = Path(base_data_dir) / "output" / dataset_name
@@ -82,202 +514,158 @@ def push_dataset(dataset_id, dataset_name, base_data_dir="data", upload_path=Non
         log.info(f"Hint: You may need to map the dataset first using map_pennseive_datasets.py")
         return False
     
+    digest_index = None
     try:
         # Step 1: Set the active dataset
         log.info(f"Setting active dataset to '{dataset_name}' (ID: {dataset_id})")
-        result = subprocess.run([
-            'pennsieve',
-            'dataset',
-            'use',
-            dataset_id
-        ], capture_output=True, text=True, check=True)
+        with tracing.span("pennsieve dataset use", category="subprocess", dataset=dataset_name):
+            result = subprocess.run([
+                'pennsieve',
+                'dataset',
+                'use',
+                dataset_id
+            ], capture_output=True, text=True, check=True)
         log.info(f"Active dataset set: {result.stdout.strip()}")
         
-        # Step 2: Get diff to identify ADDED files
-        if diff_df is None:
-            log.info("Running diff to identify files to upload...")
-            diff_df = diff_pennseive.diff_dataset(
-                dataset_name=dataset_name,
-                base_data_dir=base_data_dir
+        # ADDED files are always uploaded; in delta mode MODIFIED files are
+        # uploaded only if their content actually differs from Pennsieve
+        if delta:
+            manifest_path = pull_pennseive.find_manifest_file(dataset_path)
+            package_paths = pull_pennseive.load_package_paths(manifest_path) if manifest_path else {}
+            digest_index = DigestIndex(base_data_dir, dataset_name)
+            package_client = pull_pennseive.setup_pennsieve_clients()
+        
+        def should_upload(change_type, full_path):
+            if change_type == 'ADDED':
+                return True
+            return delta and change_type == 'MODIFIED' and content_changed(
+                full_path, dataset_path, digest_index, package_paths, package_client
             )
-            
-            if diff_df is None:
-                log.error("Failed to get diff results")
-                return False
         
-        # Filter for ADDED files only
-        # Find the UPDATE/CHANGE column
-        update_col = None
-        for col in diff_df.columns:
-            if 'UPDATE' in col.upper() or 'CHANGE' in col.upper():
-                update_col = col
-                break
+        change_types = ('ADDED', 'MODIFIED') if delta else ('ADDED',)
         
-        if update_col is None:
-            log.error("Could not find UPDATE column in diff results")
-            log.info(f"Available columns: {diff_df.columns.tolist()}")
-            return False
-        
-        # Filter for ADDED files
-        added_files = diff_df[diff_df[update_col].str.upper() == 'ADDED'].copy()
-        
-        if len(added_files) == 0:
-            log.info("No ADDED files found. Nothing to upload.")
-            return True
-        
-        log.info(f"Found {len(added_files)} ADDED files to upload")
+        # Step 2: Identify files to upload
+        if stream:
+            log.info("Streaming diff to identify files to upload...")
+            added = (
+                (record.full_path, record.path, record.file_name)
+                for record in diff_pennseive.iter_diff_records(dataset_path)
+                if should_upload((record.change_type or '').upper(), record.full_path)
+            )
+            # The tree is still being diffed, so check each file as it arrives
+            file_exists = os.path.isfile
+        else:
+            changed = select_changed_files(diff_df, dataset_name, base_data_dir, dataset_path, change_types)
+            if changed is None:
+                return False
+            added = [
+                (full_path, target_path, file_name)
+                for full_path, target_path, file_name, change_type in changed
+                if should_upload(change_type, full_path)
+            ]
+            
+            # Stat only the files to upload, once each, instead of scanning the whole tree
+            local_files = stat_local_files(full_path for full_path, _, _ in added)
+            file_exists = lambda full_path: os.path.normpath(full_path) in local_files
+        
+        # Recordings go through the import service, everything else through the agent.
+        # They are set aside while the (possibly streamed) file list is consumed and
+        # imported once it is drained, since recordings are grouped from all their files.
+        timeseries_files = []
+        if timeseries:
+            def split_timeseries(files):
+                for file in files:
+                    if not timeseries_import.is_timeseries_file(file[2]):
+                        yield file
+                    elif file_exists(file[0]):
+                        timeseries_files.append(file)
+            added = split_timeseries(added)
+        
+        def import_recordings():
+            if timeseries:
+                # build_manifest stops early when no manifest can be created; collect the rest
+                for _ in added:
+                    pass
+            if not timeseries_files:
+                return True
+            if dry_run:
+                log.info(f"DRY RUN: Would import {len(timeseries_files)} timeseries files:")
+                for full_path, target_path, file_name in timeseries_files:
+                    log.info(f"  - {target_path}/{file_name}")
+                return True
+            return timeseries_import.import_timeseries(
+                dataset_id=dataset_id,
+                dataset_name=dataset_name,
+                files=timeseries_files,
+                base_data_dir=base_data_dir
+            )
         
         if dry_run:
             log.info("DRY RUN: Would upload the following files:")
-            for idx, row in added_files.iterrows():
-                file_name = row.get('FILE NAME', row.get('File Name', ''))
-                path = row.get('PATH', row.get('Path', ''))
-                log.info(f"  - {path}/{file_name}")
-            return True
-        
-        # Get column names
-        file_name_col = None
-        path_col = None
-        full_path_col = None
-        
-        for col in added_files.columns:
-            if 'FILE NAME' in col.upper() or 'FILENAME' in col.upper():
-                file_name_col = col
-            if 'PATH' in col.upper() and 'FULL' not in col.upper():
-                path_col = col
-            if 'FULL_PATH' in col.upper() or 'FULL PATH' in col.upper():
-                full_path_col = col
-        
-        if not file_name_col or not path_col:
-            log.error("Could not find required columns in diff results")
-            log.info(f"Available columns: {added_files.columns.tolist()}")
-            return False
-        
-        # Step 3: Create manifest with first file
-        # Note: pennsieve manifest create requires a file path, not just --dataset flag
-        first_file = added_files.iloc[0]
-        first_full_path = first_file.get(full_path_col, '') if full_path_col else ""
-        first_target_path = first_file[path_col] if not pd.isna(first_file[path_col]) else ""
-        first_file_name = first_file[file_name_col]
-        
-        # If we don't have FULL_PATH, construct it
-        if not first_full_path:
-            first_full_path = str(dataset_path / str(first_target_path).strip() / first_file_name) if first_target_path else str(dataset_path / first_file_name)
-        
-        if not Path(first_full_path).exists():
-            log.error(f"First file not found: {first_full_path}")
-            return False
-        
-        log.info(f"Creating manifest with first file: {first_file_name} -> {first_target_path}")
-        
-        # Build create command with target path flag
-        create_cmd = [
-            'pennsieve',
-            'manifest',
-            'create',
-            str(first_full_path)
-        ]
-        
-        # Add target path if specified
-        if first_target_path and str(first_target_path).strip():
-            create_cmd.extend(['-t', str(first_target_path).strip()])
-        
-        result = subprocess.run(create_cmd, capture_output=True, text=True, check=True)
-        
-        log.info(result.stdout)
-        
-        # Extract manifest ID from output
-        # Expected format: "Manifest ID: 40 Message: Successfully indexed 1 files."
-        manifest_id = None
-        for line in result.stdout.split('\n'):
-            # Look for "ID:" or "Manifest ID:" pattern
-            if 'id' in line.lower():
-                # Extract first number after "ID:"
-                match = re.search(r'ID:\s*(\d+)', line, re.IGNORECASE)
-                if match:
-                    manifest_id = match.group(1)
-                    break
-        
-        if not manifest_id:
-            log.error("Could not extract manifest ID from output.")
-            log.error(f"Output was: {result.stdout}")
-            return False
-        
-        log.info(f"Created manifest with ID: {manifest_id}")
-        
-        # Step 4: Add remaining ADDED files to the manifest with proper target path
-        # (First file already added during manifest creation)
-        remaining_files = added_files.iloc[1:]  # Skip first file
-        
-        if len(remaining_files) > 0:
-            log.info(f"Adding {len(remaining_files)} more files to manifest {manifest_id}...")
-        else:
-            log.info("Only one file to upload (already in manifest)")
-        
-        # Add remaining files one by one with target path
-        success_count = 1  # First file already added
-        failed_count = 0
-        
-        for idx, row in remaining_files.iterrows():
-            file_name = row[file_name_col]
-            target_path = row[path_col] if not pd.isna(row[path_col]) else ""
-            local_full_path = row.get(full_path_col, '') if full_path_col else ""
+            count = 0
+            for full_path, target_path, file_name in added:
+                log.info(f"  - {target_path}/{file_name}")
+                count += 1
+            if count == 0:
+                log.info("No ADDED files found. Nothing to upload.")
+            return import_recordings()
+        
+        if shards > 1:
+            # Sharding needs every file and its size up front, so a streamed diff is drained first
+            added = list(added)
+            if stream:
+                file_size = lambda full_path: os.path.getsize(full_path) if os.path.isfile(full_path) else 0
+            else:
+                file_size = lambda full_path: local_files.get(os.path.normpath(full_path), 0)
             
-            # If we don't have FULL_PATH, construct it
-            if not local_full_path:
-                local_full_path = str(dataset_path / str(target_path).strip() / file_name) if target_path else str(dataset_path / file_name)
-            
-            # Check if file exists
-            if not Path(local_full_path).exists():
-                log.warning(f"File not found, skipping: {local_full_path}")
-                failed_count += 1
-                continue
-            
-            # Add file to manifest with target path
-            log.info(f"Adding: {file_name} -> {target_path}")
-            
-            add_cmd = [
-                'pennsieve',
-                'manifest',
-                'add',
-                manifest_id,
-                str(local_full_path)
-            ]
-            
-            # Add target path if specified
-            if target_path and str(target_path).strip():
-                add_cmd.extend(['-t', str(target_path).strip()])
+            # Shards always wait for their uploads, otherwise neither the concurrency limit nor the retries would hold
+            manifest_ids, success_count, failed_files, file_states, unfinished = push_sharded(
+                added, file_exists, file_size, shards, max_concurrent, shard_retries, poll_seconds, wait_timeout
+            )
+            timeseries_ok = import_recordings()
+            if not added:
+                log.info("No ADDED files found. Nothing to upload.")
+                return timeseries_ok
             
-            try:
-                result = subprocess.run(add_cmd, capture_output=True, text=True, check=True)
-                success_count += 1
-                log.debug(f"Added successfully: {file_name}")
-            except subprocess.CalledProcessError as e:
-                log.error(f"Failed to add {file_name}: {e.stderr}")
-                failed_count += 1
-                continue
+            log.info(f"✓ Upload finished for '{dataset_name}'")
+            log.info(f"Uploaded {success_count} files in manifests {', '.join(manifest_ids) or '-'}, failed: {len(failed_files)}")
+            for full_path, _, _ in failed_files:
+                log.error(f"  Not uploaded: {full_path}")
+            save_upload_states(base_data_dir, dataset_name, manifest_ids, file_states)
+            for manifest_id in unfinished:
+                log.warning(f"  Upload not confirmed: manifest {manifest_id}, check it with: pennsieve manifest list {manifest_id}")
+            return timeseries_ok and not failed_files and not unfinished
+        
+        # Steps 3 and 4: Create the manifest and add every ADDED file with its target path
+        manifest_id, success_count, failed_count = build_manifest(added, file_exists)
+        timeseries_ok = import_recordings()
         
         log.info(f"Total files in manifest: {success_count}, failed: {failed_count}")
         
-        if success_count == 0:
+        if manifest_id is None:
+            if failed_count == 0:
+                log.info("No ADDED files found. Nothing to upload.")
+                return timeseries_ok
             log.error("No files were added to manifest successfully")
             return False
         
         # Step 5: Upload the manifest
-        log.info(f"Starting upload for manifest {manifest_id}...")
-        result = subprocess.run([
-            'pennsieve',
-            'upload',
-            'manifest',
-            manifest_id
-        ], capture_output=True, text=True, check=True)
-        log.info(result.stdout)
+        upload_manifest(manifest_id)
+        
+        if wait:
+            progress = upload_tracker.wait_for_manifests([manifest_id], poll_seconds, wait_timeout)
+            save_upload_states(base_data_dir, dataset_name, [manifest_id], progress.states)
+            log.info(f"✓ Upload finished for '{dataset_name}': {len(progress.states) - progress.pending - len(progress.failed)} files uploaded, "
+                     f"{len(progress.failed)} failed, {progress.pending} still pending")
+            if progress.unfinished:
+                log.warning(f"Upload not confirmed, check it with: pennsieve manifest list {manifest_id}")
+            return timeseries_ok and failed_count == 0 and not progress.failed and progress.pending == 0 and not progress.unfinished
         
         log.info(f"✓ Upload initiated for '{dataset_name}'")
-        log.info(f"Uploaded {success_count} ADDED files to manifest {manifest_id}")
+        log.info(f"Uploaded {success_count} files to manifest {manifest_id}")
         log.info(f"Monitor progress: pennsieve manifest list {manifest_id}")
         log.info(f"Or subscribe to updates: pennsieve agent subscribe")
-        return True
+        return timeseries_ok
         
     except subprocess.CalledProcessError as e:
         log.error(f"Failed to push '{dataset_name}': {e.stderr}")
@@ -293,13 +681,78 @@ def push_dataset(dataset_id, dataset_name, base_data_dir="data", upload_path=Non
         import traceback
         log.error(traceback.format_exc())
         return False
+    
+    finally:
+        if digest_index is not None:
+            log.info(f"Hashed {digest_index.hashed} files")
+            digest_index.save()
+
+def select_changed_files(diff_df, dataset_name, base_data_dir, dataset_path, change_types=('ADDED',)):
+    """
+    Get the changed files of a dataset from diff results, running the diff if needed.
+    
+    Args:
+        diff_df (pd.DataFrame): Diff results. If None, runs diff automatically
+        dataset_name (str): Dataset name (used for directory)
+        base_data_dir (str): Base directory where datasets are mapped
+        dataset_path (Path): Path to the mapped dataset
+        change_types (tuple): Change types to select (e.g. 'ADDED', 'MODIFIED')
+    
+    Returns:
+        list or None: (full_path, target_path, file_name, change_type) tuples, or None on error
+    """
+    if diff_df is None:
+        log.info("Running diff to identify files to upload...")
+        diff_df = diff_pennseive.diff_dataset(
+            dataset_name=dataset_name,
+            base_data_dir=base_data_dir
+        )
+        
+        if diff_df is None:
+            log.error("Failed to get diff results")
+            return None
+    
+    # Find the UPDATE/CHANGE column
+    file_name_col, path_col, update_col = diff_pennseive.find_diff_columns(diff_df.columns)
+    
+    if update_col is None:
+        log.error("Could not find UPDATE column in diff results")
+        log.info(f"Available columns: {diff_df.columns.tolist()}")
+        return None
+    
+    if not file_name_col or not path_col:
+        log.error("Could not find required columns in diff results")
+        log.info(f"Available columns: {diff_df.columns.tolist()}")
+        return None
+    
+    # Filter for the requested change types
+    changed_files = diff_df[diff_df[update_col].str.upper().isin(change_types)]
+    log.info(f"Found {len(changed_files)} {'/'.join(change_types)} files to upload")
+    
+    return list(iter_diff_files(changed_files, dataset_path))
 
 # %%
 def main(
     base_data_dir: str = typer.Option("data", help="The directory where the datasets are mapped"),
     dataset_name: str = typer.Option("", "--dataset-name", "-n", help="The name(s) of the dataset(s) to push. Can be a single string or a comma-separated list."),
     upload_path: str = typer.Option(None, "--upload-path", "-p", help="Optional: Specific file or directory path within the dataset to upload"),
-    dry_run: bool = typer.Option(False, "--dry-run", "-d", help="Show what would be uploaded without actually uploading")
+    dry_run: bool = typer.Option(False, "--dry-run", "-d", help="Show what would be uploaded without actually uploading"),
+    stream: bool = typer.Option(False, "--stream", help="Start adding ADDED files to the manifest while the diff is still running"),
+    delta: bool = typer.Option(False, "--delta", help="Also upload MODIFIED files whose content hash differs from Pennsieve"),
+    timeseries: bool = typer.Option(False, "--timeseries", help="Upload EDF/BrainVision recordings as bulk timeseries imports"),
+    watch: bool = typer.Option(False, "--watch", help="Keep running and push new files in batches as they are written (Ctrl-C to stop)"),
+    settle_seconds: float = typer.Option(30.0, "--settle-seconds", help="With --watch: seconds a file must stay unchanged before it is pushed"),
+    batch_seconds: float = typer.Option(300.0, "--batch-seconds", help="With --watch: push a batch once it is this old"),
+    batch_gb: float = typer.Option(10.0, "--batch-gb", help="With --watch: push a batch once it holds this many GB"),
+    batch_files: int = typer.Option(1000, "--batch-files", help="With --watch: push a batch once it holds this many files"),
+    poll_interval: float = typer.Option(10.0, "--poll-interval", help="With --watch: seconds between rescans when polling"),
+    poll: bool = typer.Option(False, "--poll", help="With --watch: poll the tree instead of using inotify (e.g. on NFS)"),
+    shards: int = typer.Option(1, "--shards", help="Split the upload into this many size-balanced manifests; each shard waits for its uploads, as with --wait"),
+    max_concurrent: int = typer.Option(4, "--max-concurrent", help="With --shards: manifests uploading at the same time"),
+    shard_retries: int = typer.Option(2, "--shard-retries", help="With --shards: extra attempts for shards that failed"),
+    wait: bool = typer.Option(False, "--wait", help="Block until the agent finished every upload and report per-file results"),
+    poll_seconds: float = typer.Option(10.0, "--poll-seconds", help="With --wait or --shards: seconds between upload status checks"),
+    wait_timeout: float = typer.Option(None, "--wait-timeout", help="With --wait or --shards: stop waiting for uploads after this many seconds")
 ):
     """
     Push ADDED files from mapped datasets to Pennsieve.
@@ -312,14 +765,37 @@ def main(
         dataset_name: Dataset name(s) to push (comma-separated for multiple)
         upload_path: Unused (kept for compatibility)
         dry_run: If True, preview without uploading
+        stream: If True, consume ADDED files as the diff prints them
+        delta: If True, also upload MODIFIED files whose content changed
+        timeseries: If True, import recordings through the import service
+        watch: If True, watch the dataset and push new files until interrupted
+        settle_seconds: Seconds a watched file must stay unchanged before it is pushed
+        batch_seconds: Age at which a watch batch is pushed
+        batch_gb: Size in GB at which a watch batch is pushed
+        batch_files: Number of files at which a watch batch is pushed
+        poll_interval: Seconds between rescans when polling
+        poll: If True, poll instead of using inotify
+        shards: Number of size-balanced manifests to split each upload into
+        max_concurrent: Shards pushed at the same time
+        shard_retries: Extra attempts for shards that failed
+        wait: If True, block until every upload finished
+        poll_seconds: Seconds between upload status checks
+        wait_timeout: Seconds after which to stop waiting for uploads
     
     Examples:
         uv run push_pennseive_datasets.py -n "PennEPI00143"
         uv run push_pennseive_datasets.py -n "PennEPI00143,PennEPI00049"
         uv run push_pennseive_datasets.py -n "PennEPI00143" --dry-run
+        uv run push_pennseive_datasets.py -n "PennEPI00143" --stream
+        uv run push_pennseive_datasets.py -n "PennEPI00143" --delta
+        uv run push_pennseive_datasets.py -n "PennEPI00143" --timeseries
+        uv run push_pennseive_datasets.py -n "PennEPI00143" --watch
+        uv run push_pennseive_datasets.py -n "PennEPI00143" --shards 8 --max-concurrent 4
+        uv run push_pennseive_datasets.py -n "PennEPI00143" --wait
+        uv run push_pennseive_datasets.py -n "PennEPI00143" --wait --wait-timeout 7200
     
     Note:
-        Only uploads ADDED files. Modified/deleted files are ignored.
+        Only uploads ADDED files unless --delta is set. Deleted files are ignored.
     """
     # Get all PennEPI datasets
     log.info("Fetching Pennsieve datasets...")
@@ -349,51 +825,112 @@ def main(
         log.error("Please specify at least one dataset name using --dataset-name or -n")
         return
     
+    if watch:
+        if len(pennepi_collection) != 1:
+            log.error("--watch takes a single dataset")
+            return
+        # Loaded only for watch mode; push_watch imports this module
+        import push_watch
+        
+        dataset = pennepi_collection[0]
+        with tracing.span("watch dataset", dataset=dataset['name']):
+            success = push_watch.watch_dataset(
+                dataset_id=dataset['id'],
+                dataset_name=dataset['name'],
+                base_data_dir=base_data_dir,
+                dry_run=dry_run,
+                settle_seconds=settle_seconds,
+                batch_seconds=batch_seconds,
+                batch_bytes=int(batch_gb * (1 << 30)),
+                batch_files=batch_files,
+                poll_interval=poll_interval,
+                use_inotify=not poll
+            )
+        if not success:
+            log.error(f"Watch of '{dataset['name']}' ended with files that were not pushed")
+            raise typer.Exit(code=1)
+        return
+    
     # Push each dataset in the collection
     success_count = 0
     failure_count = 0
     
     for dataset in pennepi_collection:
-        log.info(f"Processing dataset: {dataset['name']}")
+        with tracing.span("push dataset", dataset=dataset['name']), memprofile.stage("push dataset", dataset=dataset['name']):
+            log.info(f"Processing dataset: {dataset['name']}")
+        
+            if stream:
+                # The diff runs inside push_dataset, feeding files to the manifest as they arrive
+                success = push_dataset(
+                    dataset_id=dataset['id'],
+                    dataset_name=dataset['name'],
+                    base_data_dir=base_data_dir,
+                    upload_path=upload_path,
+                    dry_run=dry_run,
+                    stream=True,
+                    delta=delta,
+                    timeseries=timeseries,
+                    shards=shards,
+                    max_concurrent=max_concurrent,
+                    shard_retries=shard_retries,
+                    wait=wait,
+                    poll_seconds=poll_seconds,
+                    wait_timeout=wait_timeout
+                )
+                if success:
+                    success_count += 1
+                else:
+                    failure_count += 1
+                continue
         
-        # Check for differences first 
-        log.info("Checking for differences between local and remote...")
-        diff_df = diff_pennseive.diff_dataset(
-            dataset_name=dataset['name'],
-            base_data_dir=base_data_dir
-        )
+            # Check for differences first 
+            log.info("Checking for differences between local and remote...")
+            # Reuses the last diff (e.g. from the diff step in main.sh) if nothing changed since
+            diff_df = diff_pennseive.diff_dataset(
+                dataset_name=dataset['name'],
+                base_data_dir=base_data_dir,
+                remote_updated_at=dataset.get('updatedAt')
+            )
         
-        if diff_df is None:
-            log.error(f"Failed to check differences for '{dataset['name']}'. Skipping upload.")
-            failure_count += 1
-            continue
+            if diff_df is None:
+                log.error(f"Failed to check differences for '{dataset['name']}'. Skipping upload.")
+                failure_count += 1
+                continue
         
-        if len(diff_df) == 0:
-            log.info(f"No changes detected for '{dataset['name']}'. Skipping upload.")
-            continue
+            if len(diff_df) == 0:
+                log.info(f"No changes detected for '{dataset['name']}'. Skipping upload.")
+                continue
         
-        log.info(f"Found {len(diff_df)} changed files:")
-        # Show summary of changes
-        if 'UPDATE' in diff_df.columns or any('update' in col.lower() for col in diff_df.columns):
-            update_col = [col for col in diff_df.columns if 'update' in col.lower()][0]
-            change_summary = diff_df[update_col].value_counts()
-            for change_type, count in change_summary.items():
-                log.info(f"  - {change_type}: {count} files")
-        
-        # Push the dataset (pass diff_df so it knows which files to upload)
-        success = push_dataset(
-            dataset_id=dataset['id'],
-            dataset_name=dataset['name'],
-            base_data_dir=base_data_dir,
-            upload_path=upload_path,
-            dry_run=dry_run,
-            diff_df=diff_df  # Pass the diff results
-        )
+            log.info(f"Found {len(diff_df)} changed files:")
+            # Show summary of changes
+            if 'UPDATE' in diff_df.columns or any('update' in col.lower() for col in diff_df.columns):
+                update_col = [col for col in diff_df.columns if 'update' in col.lower()][0]
+                change_summary = diff_df[update_col].value_counts()
+                for change_type, count in change_summary.items():
+                    log.info(f"  - {change_type}: {count} files")
+        
+            # Push the dataset (pass diff_df so it knows which files to upload)
+            success = push_dataset(
+                dataset_id=dataset['id'],
+                dataset_name=dataset['name'],
+                base_data_dir=base_data_dir,
+                upload_path=upload_path,
+                dry_run=dry_run,
+                diff_df=diff_df,  # Pass the diff results
+                delta=delta,
+                timeseries=timeseries,
+                shards=shards,
+                max_concurrent=max_concurrent,
+                shard_retries=shard_retries,
+                wait=wait,
+                poll_seconds=poll_seconds,
+                wait_timeout=wait_timeout
+            )
         
-        if success:
-            success_count += 1
-        else:
-            failure_count += 1
+            if success:
+                success_count += 1
+            else:
+                failure_count += 1
     
     # Summary
     log.info(f"\n{'='*60}")
@@ -402,12 +939,14 @@ def main(
     log.info(f"  Failed: {failure_count}")
     log.info(f"{'='*60}")
     
-    if not dry_run and success_count > 0:
+    if not dry_run and success_count > 0 and not wait:
         log.info("\nNote: Files may still be processing on Pennsieve.")
         log.info("Use diff_pennseive_datasets.py to verify uploads are complete.")
         
 # %%
 if __name__ == "__main__":
+    # Configure logging to show info messages
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     typer.run(main)
 
 # %%
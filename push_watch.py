@@ -0,0 +1,216 @@
+"""
+Watch mode for push - continuously upload new files of a mapped dataset
+
+`push --watch` keeps running while a derivatives pipeline writes into
+`data/output/<dataset>/`. New files are picked up from filesystem change
+notifications (see fs_watcher.py) instead of repeated `pennsieve map diff`
+runs. Each file waits until it has not changed for `settle_seconds`, so
+writes still in progress are not uploaded. Settled files are grouped into
+batches that are pushed as one agent manifest once the batch is
+`batch_seconds` old or holds `batch_bytes`/`batch_files`.
+
+Only files that appear after the watch starts are pushed. Files the manifest
+already maps to a Pennsieve package are skipped. Every pushed file is
+recorded with its size and mtime in
+`<base_data_dir>/state/<dataset_name>/watch_pushed.json`, so a restarted watch
+never uploads the same file twice. A pushed file that changes later is
+reported but not uploaded again.
+"""
+#%%
+import logging
+import os
+import subprocess
+import time
+
+from pathlib import Path
+
+import tracing
+import pull_pennseive_datasets as pull_pennseive
+from fs_watcher import create_watcher
+from push_pennseive_datasets import build_manifest, upload_manifest
+from state import dataset_state_dir, load_state, save_state
+
+log = logging.getLogger(__name__)
+
+PUSHED_FILE = "watch_pushed.json"
+
+#%%
+class UploadBatch:
+    def __init__(self):
+        self.files = []
+        self.bytes = 0
+        self.started = None
+        # Index of each path in files, so a file rewritten before the push is listed once
+        self._index = {}
+
+    def __repr__(self):
+        return f"UploadBatch(files={len(self.files)}, bytes={self.bytes})"
+
+    def add(self, full_path, target_path, file_name, size, mtime_ns):
+        if self.started is None:
+            self.started = time.monotonic()
+        entry = (full_path, target_path, file_name, size, mtime_ns)
+        if full_path in self._index:
+            # Rewritten since it was batched: keep one entry with its latest size and mtime
+            index = self._index[full_path]
+            self.bytes -= self.files[index][3]
+            self.files[index] = entry
+        else:
+            self._index[full_path] = len(self.files)
+            self.files.append(entry)
+        self.bytes += size
+
+    def is_due(self, batch_seconds, batch_bytes, batch_files):
+        if not self.files:
+            return False
+        return (
+            time.monotonic() - self.started >= batch_seconds
+            or self.bytes >= batch_bytes
+            or len(self.files) >= batch_files
+        )
+
+def push_batch(batch, dataset_path, pushed, state_path, dry_run=False):
+    """
+    Push a batch of settled files as one agent manifest.
+
+    Args:
+        batch (UploadBatch): Files to push
+        dataset_path (Path): Path to the mapped dataset
+        pushed (dict): Pushed files by relative path, updated in place
+        state_path (Path): Where the pushed files are saved
+        dry_run (bool): If True, only log the files
+
+    Returns:
+        list: Full paths of files that could not be pushed
+    """
+    files = [(full_path, target_path, file_name) for full_path, target_path, file_name, _, _ in batch.files]
+
+    if dry_run:
+        for _, target_path, file_name in files:
+            log.info(f"DRY RUN: Would upload {target_path}/{file_name}")
+        failed_paths = []
+    else:
+        failed_paths = []
+        with tracing.span("push batch", files=len(files), bytes=batch.bytes):
+            try:
+                manifest_id, success_count, failed_count = build_manifest(files, os.path.isfile, failed_paths)
+                if manifest_id is None:
+                    log.error("Could not create a manifest for the batch, retrying later")
+                    return [full_path for full_path, _, _ in files]
+                upload_manifest(manifest_id)
+            except subprocess.CalledProcessError as e:
+                log.error(f"Failed to push batch: {e.stderr}")
+                return [full_path for full_path, _, _ in files]
+        log.info(f"Pushed {success_count} files ({batch.bytes} bytes) in manifest {manifest_id}, {failed_count} failed")
+        # Files that vanished are dropped; files the agent refused are retried
+        failed_paths = [full_path for full_path in failed_paths if os.path.isfile(full_path)]
+
+    for full_path, _, _, size, mtime_ns in batch.files:
+        if full_path not in failed_paths:
+            pushed[Path(os.path.relpath(full_path, dataset_path)).as_posix()] = [size, mtime_ns]
+    if not dry_run:
+        save_state(state_path, pushed)
+    return failed_paths
+
+def watch_dataset(dataset_id, dataset_name, base_data_dir="data", dry_run=False, settle_seconds=30.0,
+                  batch_seconds=300.0, batch_bytes=10 << 30, batch_files=1000, poll_interval=10.0,
+                  use_inotify=True, duration=None):
+    """
+    Watch a mapped dataset and push new files in batches until interrupted.
+
+    Args:
+        dataset_id (str): Pennsieve dataset ID (format: N:dataset:xxx)
+        dataset_name (str): Dataset name (used for directory)
+        base_data_dir (str): Base directory where datasets are mapped (default: "data")
+        dry_run (bool): If True, log what would be uploaded without uploading
+        settle_seconds (float): Seconds a file must stay unchanged before it is pushed
+        batch_seconds (float): Oldest a batch may get before it is pushed
+        batch_bytes (int): Batch size in bytes that triggers a push
+        batch_files (int): Number of files that triggers a push
+        poll_interval (float): Seconds between rescans when inotify is unavailable
+        use_inotify (bool): If False, always poll
+        duration (float): Optional, stop after this many seconds
+
+    Returns:
+        bool: True if every file that failed to push was pushed on a later try
+    """
+    dataset_path = Path(base_data_dir) / "output" / dataset_name
+    if not dataset_path.exists():
+        log.error(f"Dataset directory does not exist: {dataset_path}")
+        return False
+
+    manifest_path = pull_pennseive.find_manifest_file(dataset_path)
+    package_paths = pull_pennseive.load_package_paths(manifest_path) if manifest_path else {}
+    state_path = dataset_state_dir(base_data_dir, dataset_name) / PUSHED_FILE
+    pushed = load_state(state_path, default={})
+
+    if not dry_run:
+        try:
+            subprocess.run(['pennsieve', 'dataset', 'use', dataset_id], capture_output=True, text=True, check=True)
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            log.error(f"Failed to set active dataset '{dataset_name}': {getattr(e, 'stderr', e)}")
+            return False
+
+    watcher = create_watcher(dataset_path, skip_dirs={'.pennsieve'}, poll_interval=poll_interval, use_inotify=use_inotify)
+    pending = {}
+    batch = UploadBatch()
+    # Files whose last push failed; they are retried with a later batch
+    unpushed = set()
+    deadline = time.monotonic() + duration if duration else None
+    log.info(f"Watching '{dataset_name}' for new files (Ctrl-C to stop)")
+
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            now = time.monotonic()
+            for path in watcher.changes(timeout=min(settle_seconds, 1.0)):
+                pending[path] = now
+
+            # A file is settled once nothing touched it for settle_seconds
+            wall_now = time.time()
+            for path, changed_at in list(pending.items()):
+                if now - changed_at < settle_seconds:
+                    continue
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    del pending[path]
+                    unpushed.discard(path)
+                    continue
+                if wall_now - st.st_mtime < settle_seconds:
+                    pending[path] = now
+                    continue
+                del pending[path]
+
+                rel_path = Path(os.path.relpath(path, dataset_path)).as_posix()
+                if rel_path in package_paths:
+                    log.debug(f"Skipping {rel_path}: already a Pennsieve package")
+                    continue
+                if rel_path in pushed:
+                    if pushed[rel_path] != [st.st_size, st.st_mtime_ns]:
+                        log.warning(f"{rel_path} changed after it was pushed; not uploading it again")
+                    continue
+                target_path, _, file_name = rel_path.rpartition('/')
+                batch.add(path, target_path, file_name, st.st_size, st.st_mtime_ns)
+
+            if batch.is_due(batch_seconds, batch_bytes, batch_files):
+                retry = push_batch(batch, dataset_path, pushed, state_path, dry_run)
+                unpushed.difference_update(full_path for full_path, *_ in batch.files)
+                unpushed.update(retry)
+                for path in retry:
+                    pending[path] = time.monotonic()
+                batch = UploadBatch()
+    except KeyboardInterrupt:
+        log.info("Stopping watch")
+    finally:
+        watcher.close()
+
+    # Push what already settled instead of dropping it
+    if batch.files:
+        retry = push_batch(batch, dataset_path, pushed, state_path, dry_run)
+        unpushed.difference_update(full_path for full_path, *_ in batch.files)
+        unpushed.update(retry)
+    if pending.keys() - unpushed:
+        log.info(f"{len(pending.keys() - unpushed)} files were still being written and were not pushed")
+    for path in sorted(unpushed):
+        log.error(f"Not pushed: {path}")
+    return not unpushed
@@ -0,0 +1,252 @@
+"""
+Remote file - Read parts of a Pennsieve file without downloading it
+
+`RemoteFile` is a seekable, read-only file object for the file behind a
+placeholder. Reads are served from fixed-size blocks fetched with HTTP Range
+requests from the package's presigned URL. Neighbouring missing blocks are
+fetched in one request, and the most recently used blocks stay in an LRU
+cache. Reading an EDF header, a NIfTI header or a short time window then
+transfers a few blocks instead of the whole recording:
+
+    from remote_file import RemoteFile
+    from transcode_pennsieve_datasets import read_edf_header
+
+    package_client = setup_pennsieve_clients()
+    for placeholder in Path("data/output/PennEPI00143").rglob("*.edf"):
+        with RemoteFile.from_placeholder(placeholder, package_client, block_size=64 << 10) as f:
+            print(placeholder, [s["label"] for s in read_edf_header(f)["signals"]])
+
+Presigned URLs expire, so a URL refused with 403 is resolved again through
+`PackageClient` once before the read fails. Reads of up to `HEDGE_MAX_BYTES`
+are hedged by the HTTP client when they are slower than usual; larger ones are
+not, since duplicating them costs more than the tail latency they would save.
+"""
+#%%
+import io
+import logging
+import os
+import re
+import threading
+
+from collections import OrderedDict
+from pathlib import Path
+
+import tracing
+
+log = logging.getLogger(__name__)
+
+BLOCK_SIZE = 1 << 20
+CACHE_BLOCKS = 64
+# Largest range read that is hedged
+HEDGE_MAX_BYTES = 1 << 20
+
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+#%%
+class RemoteFile(io.RawIOBase):
+    def __init__(self, package_id, package_client, block_size=BLOCK_SIZE, cache_blocks=CACHE_BLOCKS, http_client=None):
+        super().__init__()
+        self.package_id = package_id
+        self.package_client = package_client
+        self.block_size = block_size
+        self.cache_blocks = max(1, cache_blocks)
+
+        if http_client is None:
+            from clients.http_client import default_http_client
+            http_client = default_http_client()
+        self.http = http_client
+
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+        self._position = 0
+        self.requests = 0
+        self.bytes_fetched = 0
+
+        self.url, self.size, self.name = self._resolve()
+
+    @classmethod
+    def from_placeholder(cls, path, package_client, **kwargs):
+        """
+        Open the remote file behind a placeholder.
+
+        Args:
+            path (str or Path): Placeholder holding the package ID
+            package_client: The Pennsieve package client
+            **kwargs: Passed to RemoteFile
+
+        Returns:
+            RemoteFile: The opened file
+        """
+        with open(path, 'r') as f:
+            package_id = f.read().strip()
+        return cls(package_id, package_client, **kwargs)
+
+    def __repr__(self):
+        return (f"RemoteFile(package_id={self.package_id}, name={self.name}, size={self.size}, "
+                f"requests={self.requests}, bytes_fetched={self.bytes_fetched})")
+
+    def _resolve(self):
+        response = self.package_client.get_download_manifest(self.package_id)
+        entry = response['data'][0]
+        size = entry.get('size')
+        if size is None:
+            size = self._probe_size(entry['url'])
+        return entry['url'], size, entry.get('fileName') or entry.get('name')
+
+    def _probe_size(self, url):
+        # Presigned URLs are only signed for GET, so ask for one byte instead of a HEAD
+        with self.http.get(url, "range-read", headers={"Range": "bytes=0-0"}, stream=True) as response:
+            response.raise_for_status()
+            match = CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+            if match and match.group(3) != "*":
+                return int(match.group(3))
+            return int(response.headers["Content-Length"])
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            position = offset
+        elif whence == os.SEEK_CUR:
+            position = self._position + offset
+        elif whence == os.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"invalid whence ({whence})")
+        if position < 0:
+            raise ValueError(f"negative seek position {position}")
+        self._position = position
+        return position
+
+    def readinto(self, buffer):
+        """
+        Read up to len(buffer) bytes at the current position.
+
+        Args:
+            buffer (writable buffer): Destination
+
+        Returns:
+            int: Bytes read, 0 at the end of the file
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        view = memoryview(buffer).cast("B")
+        count = min(len(view), max(0, self.size - self._position))
+        if count == 0:
+            return 0
+
+        first = self._position // self.block_size
+        last = (self._position + count - 1) // self.block_size
+        blocks = self._get_blocks(first, last)
+
+        written = 0
+        for index in range(first, last + 1):
+            block = blocks[index]
+            start = self._position + written - index * self.block_size
+            chunk = block[start:start + count - written]
+            view[written:written + len(chunk)] = chunk
+            written += len(chunk)
+
+        self._position += written
+        return written
+
+    def _get_blocks(self, first, last):
+        with self._lock:
+            blocks = {}
+            for index in range(first, last + 1):
+                if index in self._blocks:
+                    self._blocks.move_to_end(index)
+                    blocks[index] = self._blocks[index]
+        missing = [index for index in range(first, last + 1) if index not in blocks]
+
+        # One request per run of neighbouring missing blocks
+        runs = []
+        for index in missing:
+            if runs and runs[-1][1] == index - 1:
+                runs[-1][1] = index
+            else:
+                runs.append([index, index])
+        for run_first, run_last in runs:
+            data = self._fetch(run_first * self.block_size, min(self.size, (run_last + 1) * self.block_size) - 1)
+            for index in range(run_first, run_last + 1):
+                offset = (index - run_first) * self.block_size
+                blocks[index] = data[offset:offset + self.block_size]
+
+        with self._lock:
+            for index in missing:
+                self._blocks[index] = blocks[index]
+                self._blocks.move_to_end(index)
+            while len(self._blocks) > self.cache_blocks:
+                self._blocks.popitem(last=False)
+        return blocks
+
+    def _fetch(self, start, end):
+        endpoint = "range-read" if end - start + 1 <= HEDGE_MAX_BYTES else "range-read-large"
+        with tracing.span("range read", category="transfer", package_id=self.package_id, start=start, bytes=end - start + 1):
+            for attempt in range(2):
+                # Streamed, so a server that ignores the range doesn't have its whole answer buffered
+                response = self.http.get(self.url, endpoint, headers={"Range": f"bytes={start}-{end}"}, stream=True)
+                if response.status_code == 403 and attempt == 0:
+                    # The presigned URL expired; get a fresh one
+                    log.info(f"Download URL of {self.package_id} expired, resolving it again")
+                    response.close()
+                    self.url, self.size, self.name = self._resolve()
+                    continue
+                if response.status_code >= 400:
+                    response.close()
+                response.raise_for_status()
+                break
+
+            self.requests += 1
+            with response:
+                if response.status_code == 206:
+                    match = CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+                    if match is None or int(match.group(1)) != start:
+                        raise OSError(f"Unexpected Content-Range for {self.package_id}: {response.headers.get('Content-Range')}")
+                    data = response.content
+                    self.bytes_fetched += len(data)
+                else:
+                    # The server ignored the range and sends the whole file: keep only the range
+                    log.warning(f"Server ignored the range request for {self.package_id}, skipping to the range in the whole file")
+                    data = self._read_range(response, start, end)
+        return data
+
+    def _read_range(self, response, start, end):
+        # Streams the body up to the end of the range, one block at a time
+        parts = []
+        offset = 0
+        for chunk in response.iter_content(chunk_size=self.block_size):
+            self.bytes_fetched += len(chunk)
+            if offset + len(chunk) > start:
+                parts.append(chunk[max(0, start - offset):end + 1 - offset])
+            offset += len(chunk)
+            if offset > end:
+                break
+        return b"".join(parts)
+
+    def close(self):
+        with self._lock:
+            self._blocks.clear()
+        super().close()
+
+def open_remote(path, package_client, **kwargs):
+    """
+    Open the remote file behind a placeholder as a buffered binary file.
+
+    Args:
+        path (str or Path): Placeholder holding the package ID
+        package_client: The Pennsieve package client
+        **kwargs: Passed to RemoteFile
+
+    Returns:
+        io.BufferedReader: Buffered reader over a RemoteFile
+    """
+    raw = RemoteFile.from_placeholder(Path(path), package_client, **kwargs)
+    return io.BufferedReader(raw, buffer_size=raw.block_size)
@@ -0,0 +1,178 @@
+"""
+Scratch stage - Download to fast local storage, move to the mapped tree in the background
+
+With `pull --scratch-dir`, downloads land on a local scratch tier (NVMe,
+tmpfs) instead of the mapped tree on network storage. A finished and verified
+download is queued for a small pool of mover threads that copy it next to its
+placeholder, sync it and rename it over the placeholder, so the mapped tree
+only ever sees complete files. Scratch space is reserved per file before the
+download starts; downloads wait while the scratch tier is full, so slow
+storage applies backpressure instead of filling the scratch disk.
+
+Both stages measure their own throughput (bytes over the time the stage was
+busy), so a pull reports whether the network or the storage was the limit.
+"""
+#%%
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+
+from pathlib import Path
+
+import tracing
+from download_writer import temp_path
+
+log = logging.getLogger(__name__)
+
+#%%
+class StageMeter:
+    def __init__(self, name):
+        self.name = name
+        self.bytes = 0
+        self.files = 0
+        self._active = 0
+        self._busy = 0.0
+        self._since = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"StageMeter(name={self.name}, files={self.files}, bytes={self.bytes}, busy_seconds={self._busy:.1f})"
+
+    def start(self):
+        with self._lock:
+            if self._active == 0:
+                self._since = time.monotonic()
+            self._active += 1
+
+    def stop(self, size=0):
+        with self._lock:
+            self._active -= 1
+            if self._active == 0:
+                self._busy += time.monotonic() - self._since
+            if size:
+                self.bytes += size
+                self.files += 1
+
+    def bytes_per_second(self):
+        with self._lock:
+            busy = self._busy + (time.monotonic() - self._since if self._active else 0)
+        return self.bytes / busy if busy > 0 else 0.0
+
+    def summary(self):
+        return f"{self.name}: {self.files} files, {self.bytes / (1 << 20):.1f} MiB at {self.bytes_per_second() / (1 << 20):.1f} MiB/s"
+
+class ScratchStage:
+    def __init__(self, scratch_dir, limit_bytes, move_jobs=2):
+        self.scratch_dir = Path(scratch_dir)
+        self.scratch_dir.mkdir(parents=True, exist_ok=True)
+        self.limit_bytes = limit_bytes
+        self.download_meter = StageMeter("download to scratch")
+        self.move_meter = StageMeter("move to mapped tree")
+
+        self._reserved = 0
+        self._space = threading.Condition()
+        self._moves = queue.Queue()
+        self._movers = [
+            threading.Thread(target=tracing.wrap(self._move_worker), daemon=True, name=f"scratch-mover-{i}")
+            for i in range(max(1, move_jobs))
+        ]
+        for mover in self._movers:
+            mover.start()
+
+    def __repr__(self):
+        return f"ScratchStage(scratch_dir={self.scratch_dir}, limit_bytes={self.limit_bytes}, reserved={self._reserved})"
+
+    def fits(self, size):
+        """
+        Check whether a file can be staged at all.
+
+        Args:
+            size (int or None): Size of the file from the download manifest
+
+        Returns:
+            bool: False for unknown sizes and files larger than the scratch tier
+        """
+        return size is not None and size <= self.limit_bytes
+
+    def reserve(self, size):
+        """
+        Reserve scratch space for a download, waiting while the tier is full.
+
+        Args:
+            size (int): Bytes to reserve
+
+        Returns:
+            Path: Scratch file to download to
+        """
+        with self._space:
+            self._space.wait_for(lambda: self._reserved + size <= self.limit_bytes)
+            self._reserved += size
+        return self.scratch_dir / f"{uuid.uuid4().hex}.part"
+
+    def release(self, size, scratch_path=None):
+        """
+        Give back scratch space, removing the scratch file if it is left over.
+
+        Args:
+            size (int): Bytes reserved for the file
+            scratch_path (Path): Optional scratch file to delete
+        """
+        if scratch_path is not None:
+            Path(scratch_path).unlink(missing_ok=True)
+        with self._space:
+            self._reserved -= size
+            self._space.notify_all()
+
+    def move(self, scratch_path, final_path, size, on_done):
+        """
+        Queue a verified download to be moved over its placeholder.
+
+        Args:
+            scratch_path (Path): The downloaded file on scratch
+            final_path (Path): Its place in the mapped tree
+            size (int): Bytes reserved for the file
+            on_done (callable): Called with (final_path, error) once moved; error is None on success
+        """
+        self._moves.put((Path(scratch_path), Path(final_path), size, on_done))
+
+    def _move_worker(self):
+        while (item := self._moves.get()) is not None:
+            scratch_path, final_path, size, on_done = item
+            tmp_path = temp_path(final_path)
+            error = None
+            self.move_meter.start()
+            moved = 0
+            try:
+                with tracing.span("move", category="transfer", file=str(final_path), bytes=size):
+                    # copyfile uses copy_file_range/sendfile, so data is not copied through Python
+                    shutil.copyfile(scratch_path, tmp_path)
+                    with open(tmp_path, 'rb+') as f:
+                        os.fsync(f.fileno())
+                    copied = tmp_path.stat().st_size
+                    if copied != scratch_path.stat().st_size:
+                        raise OSError(f"Copied {copied} of {scratch_path.stat().st_size} bytes")
+                    os.replace(tmp_path, final_path)
+                    moved = copied
+            except Exception as e:
+                error = e
+                tmp_path.unlink(missing_ok=True)
+                log.error(f"Failed to move {scratch_path} to {final_path}: {e}")
+            finally:
+                self.move_meter.stop(moved)
+                self.release(size, scratch_path)
+            on_done(final_path, error)
+        self._moves.put(None)
+
+    def close(self):
+        """
+        Wait for every queued move to finish and stop the movers.
+        """
+        self._moves.put(None)
+        for mover in self._movers:
+            mover.join()
+        log.info(self.download_meter.summary())
+        log.info(self.move_meter.summary())
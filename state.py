@@ -0,0 +1,75 @@
+"""
+Local pipeline state for epilepsy science datasets.
+
+Pipeline stages keep small JSON state files (snapshots, caches, indexes) under
+`<base_data_dir>/state/<dataset_name>/`, outside the mapped dataset tree so
+that `pennsieve map diff` never reports them as local changes.
+"""
+# %%
+import json
+import logging
+import os
+import socket
+import threading
+
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+# %%
+def dataset_state_dir(base_data_dir, dataset_name):
+    """
+    Get (and create) the state directory for a dataset.
+
+    Args:
+        base_data_dir (str or Path): Base directory where datasets are mapped
+        dataset_name (str): The name of the dataset
+
+    Returns:
+        Path: Directory holding the dataset's state files
+    """
+    state_dir = Path(base_data_dir) / "state" / dataset_name
+    state_dir.mkdir(parents=True, exist_ok=True)
+    return state_dir
+
+
+def load_state(state_path, default=None):
+    """
+    Load a JSON state file.
+
+    Args:
+        state_path (str or Path): Path to the state file
+        default: Value returned when the file is missing or unreadable
+
+    Returns:
+        The decoded JSON content, or default
+    """
+    try:
+        with open(state_path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except (OSError, json.JSONDecodeError) as e:
+        log.warning(f"Ignoring unreadable state file {state_path}: {e}")
+        return default
+
+
+def save_state(state_path, data):
+    """
+    Atomically write a JSON state file.
+
+    The content is written to a temporary file next to the target and renamed
+    over it, so readers never see a partially written file. The temporary name
+    carries the host, process and thread, so writers sharing a filesystem
+    never write to the same one.
+
+    Args:
+        state_path (str or Path): Path to the state file
+        data: JSON-serializable content
+    """
+    state_path = Path(state_path)
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = state_path.with_name(f".{state_path.name}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, state_path)
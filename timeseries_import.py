@@ -0,0 +1,282 @@
+"""
+Timeseries Import - Bulk import of iEEG recordings through the Pennsieve import service
+
+Uploads EDF and BrainVision recordings as `timeseries` imports with
+`ImportClient.create` instead of sending them file by file through the agent.
+
+Workflow:
+    1. Group timeseries files into recordings (same folder and file stem, so a
+       BrainVision .vhdr/.vmrk/.eeg triple becomes one import)
+    2. Create one import per recording and record its ID for resume
+    3. Request presigned URLs in concurrent batches
+    4. Upload the files of all recordings concurrently to their presigned URLs
+
+Import IDs, upload keys and per-file upload status are kept in
+`<base_data_dir>/state/<dataset_name>/timeseries_imports.json`, so an
+interrupted run resumes with the files that were not uploaded yet.
+"""
+#%%
+import logging
+import uuid
+import backoff
+import tracing
+
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from pathlib import Path
+
+from state import dataset_state_dir, load_state, save_state
+
+log = logging.getLogger(__name__)
+
+TIMESERIES_EXTENSIONS = {'.edf', '.vhdr', '.vmrk', '.eeg'}
+STATE_FILE = "timeseries_imports.json"
+
+#%%
+def setup_import_client():
+    """
+    Set up the Pennsieve import client.
+
+    Returns:
+        tuple: (ImportClient, Config)
+    """
+    from config import Config
+    from clients import AuthenticationClient, SessionManager
+    from clients import ImportClient
+
+    log.info("Setting up Pennsieve Import Client...")
+    config = Config()
+    authorization_client = AuthenticationClient(api_host=config.API_HOST)
+    session_manager = SessionManager(authorization_client, api_key=config.API_KEY, api_secret=config.API_SECRET)
+    import_client = ImportClient(api_host=config.API_HOST2, session_manager=session_manager)
+    return import_client, config
+
+def is_timeseries_file(file_path):
+    """
+    Check whether a file is an EDF or BrainVision recording file.
+
+    Args:
+        file_path (str or Path): Path of the file
+
+    Returns:
+        bool: True if the file belongs to a timeseries recording
+    """
+    return Path(file_path).suffix.lower() in TIMESERIES_EXTENSIONS
+
+def group_recordings(files):
+    """
+    Group timeseries files into recordings by target folder and file stem.
+
+    Args:
+        files (iterable): (full_path, target_path, file_name) tuples
+
+    Returns:
+        dict: Recording key ("<target_path>/<stem>") to its list of file tuples
+    """
+    recordings = {}
+    for full_path, target_path, file_name in files:
+        key = f"{target_path}/{Path(file_name).stem}" if target_path else Path(file_name).stem
+        recordings.setdefault(key, []).append((full_path, target_path, file_name))
+    return recordings
+
+def import_path(target_path, file_name):
+    """
+    Get the dataset path a file is imported to.
+
+    Args:
+        target_path (str): Target folder on Pennsieve, may be empty
+        file_name (str): Name of the file
+
+    Returns:
+        str: "<target_path>/<file_name>", or the file name for the dataset root
+    """
+    target_path = (target_path or "").strip().strip("/")
+    return f"{target_path}/{file_name}" if target_path else file_name
+
+def create_imports(import_client, imports, recordings, dataset_id, integration_id, state_path):
+    """
+    Create one timeseries import per recording that does not have one yet.
+
+    Args:
+        import_client: The Pennsieve import client
+        imports (dict): Import state by recording key, updated in place
+        recordings (dict): Recording key to its list of file tuples
+        dataset_id (str): Pennsieve dataset ID
+        integration_id (str): Integration the imports belong to
+        state_path (Path): Where the import state is saved after each import
+    """
+    from clients import ImportFile
+
+    for key, files in recordings.items():
+        if key in imports:
+            log.info(f"Resuming import {imports[key]['import_id']} for {key}")
+            continue
+
+        # file_path is where the file lands in the dataset, so it keeps its target folder
+        import_files = [
+            ImportFile(upload_key=uuid.uuid4(), file_path=import_path(target_path, file_name), local_path=full_path)
+            for full_path, target_path, file_name in files
+        ]
+        import_id = import_client.create(integration_id, dataset_id, None, import_files)
+        log.info(f"Created import {import_id} for {key} ({len(import_files)} files)")
+
+        imports[key] = {
+            "import_id": import_id,
+            "files": [
+                {
+                    "upload_key": str(import_file.upload_key),
+                    "file_path": import_file.file_path,
+                    "local_path": str(import_file.local_path),
+                    "uploaded": False,
+                }
+                for import_file in import_files
+            ],
+        }
+        # Save after every import so a crash never orphans an import ID
+        save_state(state_path, imports)
+
+def is_permanent_upload_error(e):
+    """
+    Check whether an upload error won't go away by sending the same request again.
+
+    Args:
+        e (Exception): Error raised by the upload
+
+    Returns:
+        bool: False for connection errors, timeouts, 429 and 5xx responses
+    """
+    import requests
+
+    if isinstance(e, requests.HTTPError):
+        status = e.response.status_code if e.response is not None else None
+        return status is not None and status < 500 and status != 429
+    return not isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+@backoff.on_exception(
+    backoff.expo,
+    OSError,
+    giveup=is_permanent_upload_error,
+    max_tries=4,
+    max_time=300,
+    on_backoff=lambda details: log.warning(f"Upload failed, retrying in {details['wait']:.1f}s (attempt {details['tries']}/{details['max_tries']})")
+)
+def upload_to_presigned_url(url, local_path):
+    """
+    Upload a file to a presigned URL, retrying connection errors, timeouts and
+    5xx responses with exponential backoff. 4xx responses (e.g. 403 for an
+    expired URL) are raised right away.
+
+    The PUT goes through the shared HTTP client with the "import-upload"
+    policy, which sets its timeouts; the policy doesn't retry, backoff does.
+
+    Args:
+        url (str): The presigned upload URL
+        local_path (str): Local path of the file
+    """
+    from clients.http_client import default_http_client
+
+    with tracing.span("upload", category="transfer", file=str(local_path)), open(local_path, 'rb') as f:
+        response = default_http_client().put(url, "import-upload", data=f)
+    response.raise_for_status()
+
+def import_timeseries(dataset_id, dataset_name, files, base_data_dir="data", max_workers=8, presign_batch_size=16):
+    """
+    Import timeseries recordings of a dataset in one parallel pass.
+
+    Args:
+        dataset_id (str): Pennsieve dataset ID (format: N:dataset:xxx)
+        dataset_name (str): Dataset name (used for the state directory)
+        files (iterable): (full_path, target_path, file_name) tuples of timeseries files
+        base_data_dir (str): Base directory where datasets are mapped (default: "data")
+        max_workers (int): Number of concurrent uploads
+        presign_batch_size (int): Number of presigned URLs requested concurrently per batch
+
+    Returns:
+        bool: True if every file was uploaded, False otherwise
+    """
+    recordings = group_recordings(files)
+    if not recordings:
+        log.info("No timeseries recordings to import")
+        return True
+
+    import_client, config = setup_import_client()
+    if not config.INTEGRATION_ID:
+        log.error("INTEGRATION_ID is not set. Cannot create timeseries imports.")
+        return False
+
+    state_path = dataset_state_dir(base_data_dir, dataset_name) / STATE_FILE
+    imports = load_state(state_path, default={})
+
+    create_imports(import_client, imports, recordings, dataset_id, config.INTEGRATION_ID, state_path)
+
+    # Only files of this run's recordings that were not uploaded before
+    pending = [
+        (imports[key]["import_id"], file_state)
+        for key in recordings
+        for file_state in imports[key]["files"]
+        if not file_state["uploaded"]
+    ]
+    log.info(f"Uploading {len(pending)} files for {len(recordings)} recordings")
+
+    @tracing.wrap
+    def presign(item):
+        import_id, file_state = item
+        try:
+            return item, import_client.get_presign_url(import_id, dataset_id, file_state["upload_key"])
+        except Exception as e:
+            log.error(f"Failed to presign {file_state['file_path']}: {e}")
+            return item, None
+
+    def upload(url, item):
+        import requests
+
+        import_id, file_state = item
+        try:
+            upload_to_presigned_url(url, file_state["local_path"])
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 403:
+                raise
+            # The presigned URL expired while queued or retrying; upload once more with a fresh one
+            log.info(f"Upload URL of {file_state['file_path']} was refused, presigning it again")
+            url = import_client.get_presign_url(import_id, dataset_id, file_state["upload_key"])
+            upload_to_presigned_url(url, file_state["local_path"])
+
+    counts = {"uploaded": 0, "failed": 0}
+
+    def collect(done, uploads):
+        for future in done:
+            file_state = uploads.pop(future)
+            try:
+                future.result()
+                file_state["uploaded"] = True
+                counts["uploaded"] += 1
+                log.info(f"Uploaded {file_state['file_path']}")
+                # Checkpoint progress now and then for resume
+                if counts["uploaded"] % 50 == 0:
+                    save_state(state_path, imports)
+            except Exception as e:
+                counts["failed"] += 1
+                log.error(f"Failed to upload {file_state['file_path']}: {e}")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as upload_pool, \
+         ThreadPoolExecutor(max_workers=presign_batch_size) as presign_pool:
+        uploads = {}
+        for start in range(0, len(pending), presign_batch_size):
+            # Presign only when the uploads have caught up, so URLs don't expire in the queue
+            while len(uploads) >= max_workers:
+                done, _ = wait(uploads, return_when=FIRST_COMPLETED)
+                collect(done, uploads)
+
+            batch = pending[start:start + presign_batch_size]
+            for item, url in presign_pool.map(presign, batch):
+                if url is None:
+                    counts["failed"] += 1
+                    continue
+                future = upload_pool.submit(tracing.wrap(upload), url, item)
+                uploads[future] = item[1]
+
+        collect(list(as_completed(uploads)), uploads)
+
+    save_state(state_path, imports)
+
+    log.info(f"Timeseries import: {counts['uploaded']} uploaded, {counts['failed']} failed")
+    return counts["failed"] == 0
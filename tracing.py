@@ -0,0 +1,230 @@
+"""
+Lightweight tracing spans for the map/pull/diff/push pipeline.
+
+Spans are written to a local file in the Chrome Trace Event Format (a JSON
+array of complete "X" events), which opens directly in Perfetto
+(https://ui.perfetto.dev) or chrome://tracing. Each event carries its
+trace_id, span_id and parent_id in `args`, so per-dataset and per-file
+parent/child relationships survive across threads.
+
+Tracing is off unless a trace file is configured, either with the
+PENNSIEVE_TRACE_FILE environment variable or `cli.py --trace-file`. The
+sample rate (PENNSIEVE_TRACE_SAMPLE_RATE or `--trace-sample-rate`) is applied
+per root span: an unsampled root silences all of its children. When tracing
+is off or a root is unsampled, `span()` returns a shared no-op object, so the
+instrumentation costs one function call per span.
+"""
+# %%
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar("pennsieve_trace_span", default=None)
+_tracer = None
+
+# %%
+class _Tracer:
+    def __init__(self, trace_file, sample_rate):
+        self.trace_file = trace_file
+        self.sample_rate = sample_rate
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        # The closing bracket is optional in the JSON array format, so a
+        # crashed run still leaves a readable trace
+        self._file = open(trace_file, 'w')
+        self._file.write("[\n")
+
+    def write(self, span, end_ns):
+        event = {
+            "name": span.name,
+            "cat": span.category,
+            "ph": "X",
+            "ts": span.start_ns // 1000,
+            "dur": (end_ns - span.start_ns) // 1000,
+            "pid": self.pid,
+            "tid": threading.get_ident(),
+            "args": {
+                "trace_id": span.trace_id,
+                "span_id": span.span_id,
+                "parent_id": span.parent_id,
+                **span.attrs,
+            },
+        }
+        line = json.dumps(event, default=str) + ",\n"
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                # Trailing metadata event keeps the array valid after the last comma
+                self._file.write(json.dumps({"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": "epilepsy-science"}}))
+                self._file.write("\n]\n")
+                self._file.close()
+                self._file = None
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _UnsampledSpan(_NoopSpan):
+    """Root span that was not sampled; marks the context so children are skipped."""
+    __slots__ = ("token",)
+
+    def __enter__(self):
+        self.token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self.token)
+        return False
+
+
+class Span:
+    __slots__ = ("name", "category", "attrs", "trace_id", "span_id", "parent_id", "start_ns", "token")
+
+    def __init__(self, name, category, attrs, trace_id, parent_id):
+        self.name = name
+        self.category = category
+        self.attrs = attrs
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+
+    def __repr__(self):
+        return f"Span(name={self.name}, span_id={self.span_id}, parent_id={self.parent_id})"
+
+    def __enter__(self):
+        self.start_ns = time.time_ns()
+        self.token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end_ns = time.time_ns()
+        _current_span.reset(self.token)
+        if exc_type is not None:
+            self.attrs["error"] = f"{exc_type.__name__}: {exc}"
+        tracer = _tracer
+        if tracer is not None:
+            tracer.write(self, end_ns)
+        return False
+
+    def set(self, **attrs):
+        """Attach attributes known only after the span started (e.g. bytes transferred)."""
+        self.attrs.update(attrs)
+
+# %%
+def configure(trace_file=None, sample_rate=None):
+    """
+    Turn tracing on or off.
+
+    Args:
+        trace_file (str): File the trace is written to; None turns tracing off
+        sample_rate (float): Fraction of root spans recorded (default 1.0)
+    """
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+        _tracer = None
+
+    if trace_file:
+        rate = 1.0 if sample_rate is None else min(max(float(sample_rate), 0.0), 1.0)
+        _tracer = _Tracer(trace_file, rate)
+        log.info(f"Tracing to {trace_file} (sample rate {rate})")
+
+
+def span(name, category="pipeline", **attrs):
+    """
+    Start a span, used as a context manager.
+
+    Args:
+        name (str): Name of the span (e.g. "pennsieve map diff")
+        category (str): Kind of work: "pipeline", "client", "subprocess" or "transfer"
+        **attrs: Attributes recorded with the span (e.g. dataset, file)
+
+    Returns:
+        A context manager; its `set(**attrs)` adds attributes while it runs
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _NOOP_SPAN
+
+    parent = _current_span.get()
+    if parent is None:
+        if random.random() >= tracer.sample_rate:
+            return _UnsampledSpan()
+        return Span(name, category, attrs, f"{random.getrandbits(64):016x}", None)
+    if isinstance(parent, _UnsampledSpan):
+        return _NOOP_SPAN
+    return Span(name, category, attrs, parent.trace_id, parent.span_id)
+
+
+def traced(name=None, category="pipeline"):
+    """
+    Decorator running a function inside a span.
+
+    Args:
+        name (str): Span name (defaults to the function's qualified name)
+        category (str): Kind of work, as for span()
+    """
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def wrap(func):
+    """
+    Bind a function to the current span so spans it starts on another thread
+    (threading.Thread target, executor task) become children of it.
+
+    Args:
+        func (callable): Function to run on another thread
+
+    Returns:
+        callable: Function running in a copy of the caller's context
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # A context can only be entered by one thread at a time
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
+
+
+@atexit.register
+def _close():
+    if _tracer is not None:
+        _tracer.close()
+
+
+if os.getenv("PENNSIEVE_TRACE_FILE"):
+    configure(os.getenv("PENNSIEVE_TRACE_FILE"), os.getenv("PENNSIEVE_TRACE_SAMPLE_RATE"))
@@ -0,0 +1,380 @@
+"""
+Transcode Pennsieve Datasets - Convert pulled iEEG recordings into a chunked, memory-mappable store
+
+Atlas jobs slice single channels and time windows out of the same EDF files
+over and over. This optional stage, run after pull, converts every pulled EDF
+recording once into one array file per channel:
+
+    <base_data_dir>/store/<dataset_name>/<recording path without .edf>/
+        index.json      channels, sampling rates, scaling and source version
+        ch000.npy       (n_blocks, block_len) int16 samples of channel 0
+        ch001.npy       ...
+
+Each time block holds a whole number of EDF data records. The .npy files are
+opened with `np.load(..., mmap_mode='r')`, so reading a channel or time window
+is a zero-copy view of the page cache instead of a parse of the whole EDF
+(see `read_channel`). Samples stay in their digital int16 form; the index has
+the gain and offset that give physical values (`digital * gain + offset`).
+
+The index records the size and mtime of the source EDF, so re-running the
+stage only converts recordings that were newly pulled or changed.
+
+Usage:
+    # Transcode every mapped dataset
+    uv run transcode_pennsieve_datasets.py --base-data-dir /app/data
+
+    # Transcode specific datasets with 30 s time blocks
+    uv run transcode_pennsieve_datasets.py -n "PennEPI00143" --block-seconds 30
+"""
+#%%
+import json
+import logging
+import os
+import shutil
+import typer
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+
+from fs_scanner import scan_tree
+from pull_pennseive_datasets import PLACEHOLDER_MAX_SIZE
+
+
+log = logging.getLogger(__name__)
+
+INDEX_FILE = "index.json"
+
+# Bump when the store layout changes so existing stores are rebuilt
+STORE_VERSION = 1
+
+# Records copied per pass, so memory stays bounded for long recordings
+CHUNK_BYTES = 64 << 20
+
+#%%
+def read_edf_header(path):
+    """
+    Read the fields of an EDF/EDF+ header needed to locate every channel's samples.
+
+    Args:
+        path (str, Path or file): Path to the EDF file, or a binary file object
+            such as a RemoteFile (only the header bytes are read)
+
+    Returns:
+        dict: Header fields, with one entry per signal in "signals"
+
+    Raises:
+        ValueError: If the header is not a readable EDF header
+    """
+    if hasattr(path, 'read'):
+        path.seek(0)
+    with (nullcontext(path) if hasattr(path, 'read') else open(path, 'rb')) as f:
+        fixed = f.read(256)
+        if len(fixed) < 256:
+            raise ValueError("file shorter than the 256-byte EDF header")
+
+        def field(start, end):
+            return fixed[start:end].decode('ascii', errors='replace').strip()
+
+        n_signals = int(field(252, 256))
+        signal_header = f.read(256 * n_signals)
+        if len(signal_header) < 256 * n_signals:
+            raise ValueError("file shorter than its signal headers")
+
+    def column(offset, width):
+        start = offset * n_signals
+        return [
+            signal_header[start + i * width:start + (i + 1) * width].decode('ascii', errors='replace').strip()
+            for i in range(n_signals)
+        ]
+
+    labels = column(0, 16)
+    dimensions = column(96, 8)
+    physical_min = column(104, 8)
+    physical_max = column(112, 8)
+    digital_min = column(120, 8)
+    digital_max = column(128, 8)
+    samples_per_record = column(216, 8)
+
+    return {
+        "header_bytes": int(field(184, 192)),
+        "edf_plus": field(192, 197),
+        "start_date": field(168, 176),
+        "start_time": field(176, 184),
+        "n_records": int(field(236, 244)),
+        "record_duration": float(field(244, 252)),
+        "signals": [
+            {
+                "label": labels[i],
+                "physical_dimension": dimensions[i],
+                "physical_min": float(physical_min[i]),
+                "physical_max": float(physical_max[i]),
+                "digital_min": int(digital_min[i]),
+                "digital_max": int(digital_max[i]),
+                "samples_per_record": int(samples_per_record[i]),
+            }
+            for i in range(n_signals)
+        ],
+    }
+
+def recording_store_dir(base_data_dir, dataset_name, rel_path):
+    """
+    Get the store directory of a recording.
+
+    Args:
+        base_data_dir (str or Path): Base directory where datasets are mapped
+        dataset_name (str): The name of the dataset
+        rel_path (str): Path of the EDF file relative to the mapped dataset
+
+    Returns:
+        Path: Directory holding the recording's index and channel arrays
+    """
+    return Path(base_data_dir) / "store" / dataset_name / Path(rel_path).with_suffix('')
+
+def is_current(store_dir, rel_path, size, mtime_ns):
+    """
+    Check whether a recording's store was built from this version of its EDF.
+
+    Args:
+        store_dir (Path): Store directory of the recording
+        rel_path (str): Path of the EDF file relative to the mapped dataset
+        size (int): Size of the EDF file in bytes
+        mtime_ns (int): Modification time of the EDF file
+
+    Returns:
+        bool: True if the store is up to date
+    """
+    try:
+        with open(store_dir / INDEX_FILE, 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return (
+        index.get("version") == STORE_VERSION
+        and index.get("source") == rel_path
+        and index.get("source_size") == size
+        and index.get("source_mtime_ns") == mtime_ns
+    )
+
+def transcode_recording(edf_path, store_dir, rel_path, block_seconds=10.0):
+    """
+    Convert one EDF recording into per-channel block arrays.
+
+    The store is written to a temporary directory next to its final place
+    and moved there only when complete, so readers never see a partial store.
+
+    Args:
+        edf_path (str or Path): Path to the EDF file
+        store_dir (Path): Store directory of the recording
+        rel_path (str): Path of the EDF file relative to the mapped dataset
+        block_seconds (float): Target duration of one time block
+
+    Returns:
+        dict: The recording's index
+    """
+    # numpy is only needed for this stage
+    import numpy as np
+
+    st = os.stat(edf_path)
+    header = read_edf_header(edf_path)
+    signals = header["signals"]
+    record_samples = sum(signal["samples_per_record"] for signal in signals)
+    record_bytes = record_samples * 2
+
+    # Recordings that were not closed properly leave n_records at -1
+    available = (st.st_size - header["header_bytes"]) // record_bytes if record_bytes else 0
+    n_records = header["n_records"] if header["n_records"] >= 0 else available
+    if n_records > available:
+        raise ValueError(f"truncated: header declares {n_records} data records, file holds {available}")
+
+    record_duration = header["record_duration"] or 1.0
+    records_per_block = max(1, round(block_seconds / record_duration))
+    n_blocks = max(1, -(-n_records // records_per_block))
+
+    tmp_dir = store_dir.with_name(f".{store_dir.name}.tmp-{os.getpid()}")
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+
+    channels = []
+    outputs = []
+    column = 0
+    for i, signal in enumerate(signals):
+        spr = signal["samples_per_record"]
+        # EDF+ annotation channels hold text, not samples
+        if signal["label"] != "EDF Annotations":
+            file_name = f"ch{i:03d}.npy"
+            block_len = spr * records_per_block
+            digital_range = (signal["digital_max"] - signal["digital_min"]) or 1
+            gain = (signal["physical_max"] - signal["physical_min"]) / digital_range
+            channels.append({
+                "label": signal["label"],
+                "file": file_name,
+                "sampling_rate": spr / record_duration,
+                "n_samples": n_records * spr,
+                "n_blocks": n_blocks,
+                "block_len": block_len,
+                "dtype": "<i2",
+                "physical_dimension": signal["physical_dimension"],
+                "gain": gain,
+                "offset": signal["physical_max"] - gain * signal["digital_max"],
+            })
+            out = np.lib.format.open_memmap(tmp_dir / file_name, mode='w+', dtype='<i2', shape=(n_blocks, block_len))
+            outputs.append((out, out.reshape(-1), column, spr))
+        column += spr
+
+    if n_records:
+        data = np.memmap(edf_path, dtype='<i2', mode='r', offset=header["header_bytes"], shape=(n_records, record_samples))
+        # Read each chunk of records once and scatter it to every channel
+        chunk_records = max(1, CHUNK_BYTES // record_bytes)
+        for start in range(0, n_records, chunk_records):
+            stop = min(start + chunk_records, n_records)
+            chunk = data[start:stop]
+            for _, flat, col, spr in outputs:
+                flat[start * spr:stop * spr] = chunk[:, col:col + spr].reshape(-1)
+        del data
+
+    for out, _, _, _ in outputs:
+        out.flush()
+    del outputs
+
+    index = {
+        "version": STORE_VERSION,
+        "source": rel_path,
+        "source_size": st.st_size,
+        "source_mtime_ns": st.st_mtime_ns,
+        "edf_plus": header["edf_plus"],
+        "start_date": header["start_date"],
+        "start_time": header["start_time"],
+        "record_duration": record_duration,
+        "n_records": n_records,
+        "records_per_block": records_per_block,
+        "channels": channels,
+    }
+    with open(tmp_dir / INDEX_FILE, 'w') as f:
+        json.dump(index, f, indent=2)
+
+    if store_dir.exists():
+        shutil.rmtree(store_dir)
+    os.replace(tmp_dir, store_dir)
+    return index
+
+def transcode_dataset(dataset_name, base_data_dir="data", block_seconds=10.0, max_workers=4):
+    """
+    Transcode every pulled EDF recording of a mapped dataset that changed since the last run.
+
+    Args:
+        dataset_name (str): The name of the dataset (used for directory name)
+        base_data_dir (str): Base directory where datasets are mapped (default: "data")
+        block_seconds (float): Target duration of one time block
+        max_workers (int): Number of recordings converted concurrently
+
+    Returns:
+        tuple or None: (converted, up_to_date, failed) counts, or None on error
+    """
+    dataset_path = Path(base_data_dir) / "output" / dataset_name
+    if not dataset_path.exists():
+        log.error(f"Dataset directory does not exist: {dataset_path}")
+        return None
+
+    to_convert = []
+    up_to_date = 0
+    for entry in scan_tree(dataset_path, skip_dirs={'.pennsieve'}):
+        # Placeholders of recordings that were not pulled are skipped
+        if not entry.path.lower().endswith('.edf') or entry.size <= PLACEHOLDER_MAX_SIZE:
+            continue
+        rel_path = Path(os.path.relpath(entry.path, dataset_path)).as_posix()
+        store_dir = recording_store_dir(base_data_dir, dataset_name, rel_path)
+        if is_current(store_dir, rel_path, entry.size, entry.mtime_ns):
+            up_to_date += 1
+        else:
+            to_convert.append((entry.path, store_dir, rel_path))
+
+    log.info(f"Transcoding {len(to_convert)} recordings of '{dataset_name}' ({up_to_date} up to date)")
+
+    def convert(item):
+        edf_path, store_dir, rel_path = item
+        try:
+            index = transcode_recording(edf_path, store_dir, rel_path, block_seconds=block_seconds)
+            log.info(f"Transcoded {rel_path}: {len(index['channels'])} channels, {index['n_records']} records")
+            return True
+        except Exception as e:
+            log.error(f"Failed to transcode {rel_path}: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(convert, to_convert))
+
+    converted = sum(results)
+    return converted, up_to_date, len(results) - converted
+
+def read_channel(store_dir, channel, start=0, stop=None):
+    """
+    Read one channel's samples from a transcoded recording without copying.
+
+    Args:
+        store_dir (str or Path): Store directory of the recording
+        channel (str or int): Channel label or position in the index
+        start (int): First sample to read
+        stop (int): Sample to stop before (default: end of the recording)
+
+    Returns:
+        tuple: (samples, gain, offset); samples is a read-only int16 view,
+            physical values are `samples * gain + offset`
+    """
+    import numpy as np
+
+    store_dir = Path(store_dir)
+    with open(store_dir / INDEX_FILE, 'r') as f:
+        index = json.load(f)
+
+    channels = index["channels"]
+    info = channels[channel] if isinstance(channel, int) else next(c for c in channels if c["label"] == channel)
+    blocks = np.load(store_dir / info["file"], mmap_mode='r')
+    samples = blocks.reshape(-1)[:info["n_samples"]]
+    return samples[start:stop], info["gain"], info["offset"]
+
+# %%
+def main(
+    base_data_dir: str = typer.Option("data", help="The directory where the datasets are mapped"),
+    dataset_name: str = typer.Option("", "--dataset-name", "-n", help="The name(s) of the dataset(s) to transcode. Can be a single string or a comma-separated list. Defaults to all mapped datasets."),
+    block_seconds: float = typer.Option(10.0, "--block-seconds", help="Target duration of one time block"),
+    workers: int = typer.Option(4, "--workers", "-w", help="Number of recordings converted concurrently")
+):
+    """
+    Transcode pulled iEEG recordings into a chunked, memory-mappable store.
+
+    Args:
+        base_data_dir: The directory where the datasets are mapped
+        dataset_name: The name(s) of the dataset(s) to transcode
+        block_seconds: Target duration of one time block
+        workers: Number of recordings converted concurrently
+    """
+    if dataset_name:
+        dataset_names = [name.strip() for name in dataset_name.split(",")]
+    else:
+        output_dir = Path(base_data_dir) / "output"
+        dataset_names = sorted(p.name for p in output_dir.iterdir() if p.is_dir()) if output_dir.exists() else []
+
+    if not dataset_names:
+        log.warning("No mapped datasets found to transcode")
+        return
+
+    failures = 0
+    for name in dataset_names:
+        result = transcode_dataset(name, base_data_dir=base_data_dir, block_seconds=block_seconds, max_workers=workers)
+        if result is None:
+            failures += 1
+            continue
+        converted, up_to_date, failed = result
+        log.info(f"'{name}': {converted} transcoded, {up_to_date} up to date, {failed} failed")
+        failures += failed
+
+    if failures:
+        raise typer.Exit(code=1)
+
+# %%
+if __name__ == "__main__":
+    # Configure logging to show info messages
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    typer.run(main)
@@ -0,0 +1,226 @@
+"""
+Upload tracker - Follow agent uploads to completion without re-running the diff
+
+`pennsieve upload manifest` returns as soon as the agent has queued the
+upload. The tracker polls `pennsieve manifest list <id>`, which only reads the
+agent's local manifest database, and reports every file as it reaches a final
+state together with the live upload throughput. `push --wait` blocks on it and
+keeps the per-file final states in
+`<base_data_dir>/state/<dataset_name>/upload_states.json`, so checking an
+upload no longer needs a second full `pennsieve map diff`.
+
+Agent file states:
+    LOCAL, REGISTERED    - queued or uploading
+    UPLOADED, FINALIZED  - in storage, being imported
+    IMPORTED, VERIFIED   - done
+    FAILED               - upload failed
+    REMOVED              - removed from the manifest (ignored)
+"""
+#%%
+import logging
+import os
+import subprocess
+import time
+
+import tracing
+
+log = logging.getLogger(__name__)
+
+UPLOAD_STATES_FILE = "upload_states.json"
+
+DONE_STATES = {"UPLOADED", "FINALIZED", "IMPORTED", "VERIFIED"}
+FAILED_STATES = {"FAILED"}
+IGNORED_STATES = {"REMOVED"}
+
+# Rows requested per `manifest list` call
+PAGE_SIZE = 1000
+
+# Consecutive failed or empty `manifest list` calls before a manifest is given up
+MAX_LIST_ERRORS = 5
+
+#%%
+def normalize_state(state):
+    """
+    Normalize an agent file state, e.g. "FILE_FINALIZED" or "Finalized" -> "FINALIZED".
+
+    Args:
+        state (str): State as printed by the agent
+
+    Returns:
+        str: Upper-case state without the FILE_ prefix
+    """
+    return state.strip().upper().removeprefix("FILE_")
+
+def parse_manifest_list(lines):
+    """
+    Parse the file table printed by `pennsieve manifest list <id>`.
+
+    Args:
+        lines (iterable): Lines of the command output
+
+    Returns:
+        dict: State of each file by its local source path
+    """
+    states = {}
+    headers = None
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('+'):
+            continue
+
+        cells = tuple(cell.strip() for cell in line.split('|')[1:-1])
+        if headers is None:
+            upper = [cell.upper() for cell in cells]
+            if any('STATUS' in cell for cell in upper):
+                headers = upper
+                status_idx = next(i for i, cell in enumerate(upper) if 'STATUS' in cell)
+                source_idx = next(
+                    (i for i, cell in enumerate(upper) if 'SOURCE' in cell),
+                    next((i for i, cell in enumerate(upper) if 'PATH' in cell and 'TARGET' not in cell), None)
+                )
+            continue
+
+        if len(cells) != len(headers) or source_idx is None:
+            continue
+        states[cells[source_idx]] = normalize_state(cells[status_idx])
+
+    if headers is None:
+        log.warning("Could not find header row in manifest list output")
+    return states
+
+def manifest_file_states(manifest_id, page_size=PAGE_SIZE):
+    """
+    Get the state of every file in an agent manifest.
+
+    Args:
+        manifest_id (str): The manifest ID
+        page_size (int): Rows requested per call
+
+    Returns:
+        dict: State of each file by its local source path
+
+    Raises:
+        subprocess.CalledProcessError: If the manifest could not be listed
+    """
+    states = {}
+    offset = 0
+    while True:
+        with tracing.span("pennsieve manifest list", category="subprocess", manifest_id=manifest_id, offset=offset):
+            result = subprocess.run(
+                ['pennsieve', 'manifest', 'list', str(manifest_id), '--limit', str(page_size), '--offset', str(offset)],
+                capture_output=True, text=True, check=True
+            )
+        page = parse_manifest_list(result.stdout.splitlines())
+        states.update(page)
+        if len(page) < page_size:
+            return states
+        offset += page_size
+
+class UploadProgress:
+    def __init__(self, manifest_ids):
+        self.manifest_ids = list(manifest_ids)
+        self.states = {}
+        # Manifests that were stopped being followed before every file was final
+        self.unfinished = []
+        self.done_bytes = 0
+        self.started = time.monotonic()
+
+    def __repr__(self):
+        return f"UploadProgress(manifests={len(self.manifest_ids)}, files={len(self.states)}, pending={self.pending})"
+
+    @property
+    def pending(self):
+        return sum(1 for state in self.states.values() if not is_final(state))
+
+    @property
+    def failed(self):
+        return [path for path, state in self.states.items() if state in FAILED_STATES]
+
+    def bytes_per_second(self):
+        elapsed = time.monotonic() - self.started
+        return self.done_bytes / elapsed if elapsed > 0 else 0.0
+
+    def update(self, states):
+        """
+        Record new states and log files that just reached a final state.
+
+        Args:
+            states (dict): State of each file by its local source path
+        """
+        for path, state in states.items():
+            previous = self.states.get(path)
+            self.states[path] = state
+            if is_final(state) and not is_final(previous):
+                if state in FAILED_STATES:
+                    log.error(f"Upload failed: {path}")
+                elif state in DONE_STATES:
+                    self.done_bytes += _file_size(path)
+                    log.info(f"Uploaded: {path}")
+
+def is_final(state):
+    return state is not None and (state in DONE_STATES or state in FAILED_STATES or state in IGNORED_STATES)
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def wait_for_manifests(manifest_ids, poll_seconds=10.0, timeout=None, max_errors=MAX_LIST_ERRORS):
+    """
+    Block until every file of the manifests is uploaded or failed.
+
+    A manifest that could not be listed, or listed no files, `max_errors`
+    times in a row is given up, so a stopped agent does not block forever.
+
+    Args:
+        manifest_ids (list): Manifest IDs to follow
+        poll_seconds (float): Seconds between status checks
+        timeout (float): Optional, give up after this many seconds
+        max_errors (int): Consecutive failed listings before a manifest is given up
+
+    Returns:
+        UploadProgress: Final state of every file; files still pending after
+            a timeout keep their last state, and manifests given up are in
+            `unfinished`
+    """
+    progress = UploadProgress(manifest_ids)
+    deadline = time.monotonic() + timeout if timeout else None
+    remaining = list(manifest_ids)
+    errors = dict.fromkeys(remaining, 0)
+
+    with tracing.span("wait for uploads", manifests=len(remaining)) as wait_span:
+        while remaining:
+            for manifest_id in list(remaining):
+                try:
+                    states = manifest_file_states(manifest_id)
+                except subprocess.CalledProcessError as e:
+                    log.warning(f"Could not list manifest {manifest_id}: {e.stderr}")
+                    states = {}
+                if not states:
+                    errors[manifest_id] += 1
+                    if errors[manifest_id] >= max_errors:
+                        log.error(f"Giving up on manifest {manifest_id} after {max_errors} failed listings")
+                        remaining.remove(manifest_id)
+                        progress.unfinished.append(manifest_id)
+                    continue
+                errors[manifest_id] = 0
+                progress.update(states)
+                if states and all(is_final(state) for state in states.values()):
+                    remaining.remove(manifest_id)
+
+            total = len(progress.states)
+            log.info(
+                f"Uploads: {total - progress.pending}/{total} files final, "
+                f"{len(progress.failed)} failed, {progress.bytes_per_second() / (1 << 20):.1f} MiB/s"
+            )
+            if not remaining:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                log.warning(f"Stopped waiting with {progress.pending} files still uploading")
+                progress.unfinished.extend(remaining)
+                break
+            time.sleep(poll_seconds)
+
+        wait_span.set(files=len(progress.states), failed=len(progress.failed), bytes=progress.done_bytes)
+    return progress
@@ -0,0 +1,347 @@
+"""
+Validate Pennsieve Datasets - Check mapped datasets are complete for downstream services
+
+Checks that every file a downstream atlas build needs is present and whole,
+without reading full payloads:
+
+    - EDF/BDF: header size plus declared data records must match the file length
+    - NIfTI (.nii): header dims and bitpix must fit in the file after vox_offset
+    - NIfTI (.nii.gz): header dims must match the gzip trailer's uncompressed size
+    - BIDS sidecars (.json): must be a valid JSON object
+    - Placeholders: files still holding a package ID were never pulled
+
+Headers are read through memory maps, files are validated in parallel, and
+results are cached per file keyed on (size, mtime) in
+`<base_data_dir>/state/<dataset_name>/validation_cache.json`, so re-validating
+an unchanged collection only stats files.
+
+Usage:
+    # Validate every mapped dataset
+    uv run validate_pennsieve_datasets.py --base-data-dir /app/data
+
+    # Validate specific datasets and save a report
+    uv run validate_pennsieve_datasets.py -n "PennEPI00143,PennEPI00049" -o report.json
+"""
+#%%
+import gzip
+import json
+import logging
+import mmap
+import os
+import struct
+import typer
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from fs_scanner import scan_tree
+from pull_pennseive_datasets import find_manifest_file, load_valid_package_ids, PLACEHOLDER_MAX_SIZE
+from state import dataset_state_dir, load_state, save_state
+
+
+log = logging.getLogger(__name__)
+
+CACHE_FILE = "validation_cache.json"
+
+# Bump when checks change so cached results are not reused
+VALIDATOR_VERSION = 1
+
+#%%
+def check_edf(m, file_size, bytes_per_sample=2):
+    """
+    Check an EDF/BDF header against the file length.
+
+    Args:
+        m (mmap.mmap): Memory map of the file
+        file_size (int): Size of the file in bytes
+        bytes_per_sample (int): 2 for EDF, 3 for BDF
+
+    Returns:
+        list: Issues found (empty if valid)
+    """
+    if file_size < 256:
+        return ["file shorter than the 256-byte EDF header"]
+
+    try:
+        header_bytes = int(m[184:192].decode('ascii').strip())
+        n_records = int(m[236:244].decode('ascii').strip())
+        n_signals = int(m[252:256].decode('ascii').strip())
+    except ValueError:
+        return ["unreadable EDF header fields"]
+
+    if header_bytes != 256 * (n_signals + 1):
+        return [f"header size {header_bytes} does not match {n_signals} signals"]
+    if file_size < header_bytes:
+        return ["file shorter than its declared header"]
+
+    # Samples per data record are stored per signal, 8 bytes each
+    offset = 256 + n_signals * 216
+    try:
+        samples = [int(m[offset + i * 8:offset + (i + 1) * 8].decode('ascii').strip()) for i in range(n_signals)]
+    except ValueError:
+        return ["unreadable samples per record"]
+
+    record_size = sum(samples) * bytes_per_sample
+    if n_records < 0:
+        # Recording was not closed properly, so the count was never written
+        return ["number of data records unknown (-1)"]
+
+    expected = header_bytes + n_records * record_size
+    if file_size < expected:
+        return [f"truncated: {file_size} bytes, header declares {expected}"]
+    if file_size > expected:
+        return [f"{file_size - expected} trailing bytes after {n_records} data records"]
+    return []
+
+def parse_nifti_header(header):
+    """
+    Parse the fields of a NIfTI-1 or NIfTI-2 header needed to size its data.
+
+    Args:
+        header (bytes): At least the first 540 bytes of the file (348 for NIfTI-1)
+
+    Returns:
+        tuple or None: (dims, bitpix, vox_offset), or None if not a NIfTI header
+    """
+    for endian in ('<', '>'):
+        if len(header) >= 348 and struct.unpack_from(f'{endian}i', header, 0)[0] == 348:
+            dim = struct.unpack_from(f'{endian}8h', header, 40)
+            bitpix = struct.unpack_from(f'{endian}h', header, 72)[0]
+            vox_offset = int(struct.unpack_from(f'{endian}f', header, 108)[0])
+            return dim[1:1 + dim[0]], bitpix, vox_offset
+        if len(header) >= 540 and struct.unpack_from(f'{endian}i', header, 0)[0] == 540:
+            bitpix = struct.unpack_from(f'{endian}h', header, 14)[0]
+            dim = struct.unpack_from(f'{endian}8q', header, 16)
+            vox_offset = struct.unpack_from(f'{endian}q', header, 168)[0]
+            return dim[1:1 + dim[0]], bitpix, vox_offset
+    return None
+
+def nifti_expected_size(dims, bitpix, vox_offset):
+    n_voxels = 1
+    for d in dims:
+        n_voxels *= max(d, 1)
+    return vox_offset + n_voxels * bitpix // 8
+
+def check_nifti(m, file_size):
+    """
+    Check an uncompressed NIfTI header against the file length.
+
+    Args:
+        m (mmap.mmap): Memory map of the file
+        file_size (int): Size of the file in bytes
+
+    Returns:
+        list: Issues found (empty if valid)
+    """
+    parsed = parse_nifti_header(m[:540])
+    if parsed is None:
+        return ["not a NIfTI header"]
+
+    expected = nifti_expected_size(*parsed)
+    if file_size < expected:
+        return [f"truncated: {file_size} bytes, header declares {expected}"]
+    return []
+
+def check_nifti_gz(path, m, file_size):
+    """
+    Check a gzipped NIfTI header against the gzip trailer.
+
+    Only the header is decompressed. The trailer stores the uncompressed size
+    modulo 2**32, which is compared to the size the header declares.
+
+    Args:
+        path (str): Path to the file
+        m (mmap.mmap): Memory map of the file
+        file_size (int): Size of the file in bytes
+
+    Returns:
+        list: Issues found (empty if valid)
+    """
+    if file_size < 18 or m[:2] != b'\x1f\x8b':
+        return ["not a gzip file"]
+
+    try:
+        with gzip.open(path, 'rb') as f:
+            header = f.read(540)
+    except (OSError, EOFError) as e:
+        return [f"unreadable gzip stream: {e}"]
+
+    parsed = parse_nifti_header(header)
+    if parsed is None:
+        return ["not a NIfTI header"]
+
+    expected = nifti_expected_size(*parsed)
+    isize = struct.unpack('<I', m[file_size - 4:file_size])[0]
+    if isize != expected % 2**32:
+        return [f"gzip trailer size {isize} does not match header ({expected} bytes), file likely truncated"]
+    return []
+
+def check_sidecar(m):
+    """
+    Check a BIDS JSON sidecar parses to an object.
+
+    Args:
+        m (mmap.mmap): Memory map of the file
+
+    Returns:
+        list: Issues found (empty if valid)
+    """
+    try:
+        data = json.loads(m[:])
+    except (ValueError, UnicodeDecodeError) as e:
+        return [f"invalid JSON: {e}"]
+    if not isinstance(data, dict):
+        return ["sidecar is not a JSON object"]
+    return []
+
+def validate_file(path, file_size, valid_package_ids):
+    """
+    Validate a single file from its header.
+
+    Args:
+        path (str): Path to the file
+        file_size (int): Size of the file in bytes (from the scan)
+        valid_package_ids (set): Package IDs from the dataset manifest
+
+    Returns:
+        list: Issues found (empty if valid)
+    """
+    name = path.lower()
+
+    # A small file holding a manifest package ID was never pulled
+    if file_size <= PLACEHOLDER_MAX_SIZE:
+        try:
+            with open(path, 'r') as f:
+                if f.read().strip() in valid_package_ids:
+                    return ["placeholder: file was not pulled"]
+        except UnicodeDecodeError:
+            pass
+
+    if name.endswith(('.edf', '.bdf', '.nii', '.nii.gz', '.json')):
+        if file_size == 0:
+            return ["empty file"]
+
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            if name.endswith('.edf'):
+                return check_edf(m, file_size)
+            if name.endswith('.bdf'):
+                return check_edf(m, file_size, bytes_per_sample=3)
+            if name.endswith('.nii'):
+                return check_nifti(m, file_size)
+            if name.endswith('.nii.gz'):
+                return check_nifti_gz(path, m, file_size)
+            return check_sidecar(m)
+
+    return []
+
+def validate_dataset(dataset_name, base_data_dir="data", max_workers=8):
+    """
+    Validate every file of a mapped dataset.
+
+    Args:
+        dataset_name (str): The name of the dataset (used for directory name)
+        base_data_dir (str): Base directory where datasets are mapped (default: "data")
+        max_workers (int): Number of files validated concurrently
+
+    Returns:
+        dict or None: Issues by dataset-relative path (empty if complete), or None on error
+    """
+    dataset_path = Path(base_data_dir) / "output" / dataset_name
+    if not dataset_path.exists():
+        log.error(f"Dataset directory does not exist: {dataset_path}")
+        return None
+
+    manifest_path = find_manifest_file(dataset_path)
+    valid_package_ids = load_valid_package_ids(manifest_path) if manifest_path else set()
+
+    cache_path = dataset_state_dir(base_data_dir, dataset_name) / CACHE_FILE
+    cache = load_state(cache_path, default={})
+    if cache.get("version") != VALIDATOR_VERSION:
+        cache = {"version": VALIDATOR_VERSION, "files": {}}
+    cached_files = cache["files"]
+
+    results = {}
+    to_check = []
+    for entry in scan_tree(dataset_path, skip_dirs={'.pennsieve'}):
+        rel_path = Path(os.path.relpath(entry.path, dataset_path)).as_posix()
+        cached = cached_files.get(rel_path)
+        if cached and cached["size"] == entry.size and cached["mtime_ns"] == entry.mtime_ns:
+            results[rel_path] = cached["issues"]
+        else:
+            to_check.append((rel_path, entry))
+
+    log.info(f"Validating {len(to_check)} changed files in '{dataset_name}' ({len(results)} cached)")
+
+    def check(item):
+        rel_path, entry = item
+        try:
+            return rel_path, entry, validate_file(entry.path, entry.size, valid_package_ids)
+        except OSError as e:
+            return rel_path, entry, [f"unreadable: {e}"]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for rel_path, entry, issues in executor.map(check, to_check):
+            results[rel_path] = issues
+            cached_files[rel_path] = {"size": entry.size, "mtime_ns": entry.mtime_ns, "issues": issues}
+
+    # Forget files that no longer exist
+    for rel_path in set(cached_files) - set(results):
+        del cached_files[rel_path]
+    save_state(cache_path, cache)
+
+    return {rel_path: issues for rel_path, issues in results.items() if issues}
+
+# %%
+def main(
+    base_data_dir: str = typer.Option("data", help="The directory where the datasets are mapped"),
+    dataset_name: str = typer.Option("", "--dataset-name", "-n", help="The name(s) of the dataset(s) to validate. Can be a single string or a comma-separated list. Defaults to all mapped datasets."),
+    output_json: str = typer.Option(None, "--output-json", "-o", help="Optional: Save the issues found to a JSON file"),
+    workers: int = typer.Option(8, "--workers", "-w", help="Number of files validated concurrently")
+):
+    """
+    Validate that mapped datasets are complete for downstream services.
+
+    Args:
+        base_data_dir: The directory where the datasets are mapped
+        dataset_name: The name(s) of the dataset(s) to validate
+        output_json: Optional path to save the issues found as JSON
+        workers: Number of files validated concurrently
+    """
+    if dataset_name:
+        dataset_names = [name.strip() for name in dataset_name.split(",")]
+    else:
+        output_dir = Path(base_data_dir) / "output"
+        dataset_names = sorted(p.name for p in output_dir.iterdir() if p.is_dir()) if output_dir.exists() else []
+
+    if not dataset_names:
+        log.warning("No mapped datasets found to validate")
+        return
+
+    report = {}
+    for name in dataset_names:
+        issues = validate_dataset(name, base_data_dir=base_data_dir, max_workers=workers)
+        if issues is None:
+            report[name] = {"error": "dataset directory does not exist"}
+            continue
+
+        report[name] = issues
+        if issues:
+            log.warning(f"'{name}': {len(issues)} files with issues")
+            for rel_path, file_issues in sorted(issues.items()):
+                log.warning(f"  - {rel_path}: {'; '.join(file_issues)}")
+        else:
+            log.info(f"'{name}': complete")
+
+    if output_json:
+        with open(output_json, 'w') as f:
+            json.dump(report, f, indent=2)
+        log.info(f"Report saved to: {output_json}")
+
+    if any(report.values()):
+        raise typer.Exit(code=1)
+
+# %%
+if __name__ == "__main__":
+    # Configure logging to show info messages
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    typer.run(main)
@@ -0,0 +1,277 @@
+"""
+Shared work queue for pulling a dataset from several machines at once.
+
+Workers on different nodes point at the same SQLite file on a shared
+filesystem. Every placeholder to download is one row keyed by its path
+relative to the pulled directory, so each node can mount the dataset at a
+different path. A worker claims a small batch of rows at a time under a lease
+and renews its leases with heartbeats while it downloads. Rows whose lease
+expired (the worker crashed or lost its mount) are claimed again by any other
+worker, so the nodes download disjoint parts of the manifest and nothing is
+left behind.
+
+Claims run in `BEGIN IMMEDIATE` transactions with the rollback journal, which
+rely on POSIX file locks; WAL mode is avoided because it does not work across
+hosts. Use a filesystem with working locks (NFSv4, Lustre, CephFS).
+"""
+# %%
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from contextlib import closing
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+# %%
+class WorkQueue:
+    def __init__(self, db_path, root, lease_seconds=600, max_attempts=3):
+        self.db_path = str(db_path)
+        self.root = Path(root)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        with closing(self._connect()) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS items (
+                    rel_path TEXT PRIMARY KEY,
+                    package_id TEXT NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'pending',
+                    worker TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS items_state ON items (state, lease_expires)")
+
+    def __repr__(self):
+        return f"WorkQueue(db_path={self.db_path}, root={self.root}, lease_seconds={self.lease_seconds})"
+
+    def _connect(self):
+        # One short-lived connection per operation, so any thread can use the queue
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        return conn
+
+    def _rel_path(self, file_path):
+        return Path(os.path.relpath(file_path, self.root)).as_posix()
+
+    def enqueue(self, placeholders, batch_size=1000):
+        """
+        Add placeholders to the queue.
+
+        Every worker can seed the queue from its own scan: the first one adds
+        the rows, the others find them already present. Rows that are done or
+        failed are reset to pending, since the scan only finds files that are
+        placeholders right now: a failed file is retried by the next pull, and
+        a dehydrated one is pulled again. Pending and leased rows are left alone.
+
+        Args:
+            placeholders (iterable): (file_path, package_id) tuples
+            batch_size (int): Rows inserted per transaction
+
+        Returns:
+            int: Number of new or reset rows
+        """
+        added = 0
+        with closing(self._connect()) as conn:
+            batch = []
+            for file_path, package_id in placeholders:
+                batch.append((self._rel_path(file_path), package_id))
+                if len(batch) >= batch_size:
+                    added += self._insert(conn, batch)
+                    batch = []
+            if batch:
+                added += self._insert(conn, batch)
+        return added
+
+    def _insert(self, conn, batch):
+        before = conn.total_changes
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT INTO items (rel_path, package_id) VALUES (?, ?) "
+                "ON CONFLICT(rel_path) DO UPDATE SET state = ?, package_id = excluded.package_id, "
+                "worker = NULL, lease_expires = NULL, attempts = 0, error = NULL WHERE state IN (?, ?)",
+                [(rel_path, package_id, PENDING, DONE, FAILED) for rel_path, package_id in batch]
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return conn.total_changes - before
+
+    def claim(self, worker_id, limit=1):
+        """
+        Lease up to `limit` pending items, or items whose lease expired.
+
+        Items whose lease expired after `max_attempts` claims are marked
+        failed instead.
+
+        Args:
+            worker_id (str): ID of the claiming worker
+            limit (int): Maximum number of items to claim
+
+        Returns:
+            list: (file_path, package_id) tuples now leased to this worker
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            # BEGIN IMMEDIATE takes the write lock up front, so two workers
+            # never select the same rows
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Expired leases that used up their attempts are failed rather than
+                # reclaimed, so a file that kills its worker is not retried forever
+                exhausted = conn.execute(
+                    "UPDATE items SET state = ?, worker = NULL, lease_expires = NULL, "
+                    "error = 'lease expired after ' || attempts || ' attempts' "
+                    "WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+                    (FAILED, LEASED, now, self.max_attempts)
+                ).rowcount
+                if exhausted:
+                    log.warning(f"Failed {exhausted} items whose lease expired after {self.max_attempts} attempts")
+                rows = conn.execute(
+                    "SELECT rel_path, package_id, state, worker FROM items "
+                    "WHERE state = ? OR (state = ? AND lease_expires < ?) LIMIT ?",
+                    (PENDING, LEASED, now, limit)
+                ).fetchall()
+                for rel_path, _, state, worker in rows:
+                    if state == LEASED:
+                        log.warning(f"Reclaiming {rel_path} from {worker} (lease expired)")
+                conn.executemany(
+                    "UPDATE items SET state = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE rel_path = ?",
+                    [(LEASED, worker_id, now + self.lease_seconds, rel_path) for rel_path, *_ in rows]
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return [(self.root / rel_path, package_id) for rel_path, package_id, _, _ in rows]
+
+    def claims(self, worker_id, batch_size=4, poll_seconds=None):
+        """
+        Stream claimed items until every item is done or failed.
+
+        When nothing is claimable but other workers still hold leases, waits
+        and polls, so a surviving worker picks up the items of one that died.
+
+        Args:
+            worker_id (str): ID of the claiming worker
+            batch_size (int): Number of items claimed at a time
+            poll_seconds (float): Wait between polls (default: a quarter of the lease)
+
+        Yields:
+            tuple: (file_path, package_id) leased to this worker
+        """
+        poll_seconds = poll_seconds or max(self.lease_seconds / 4, 1)
+        while True:
+            items = self.claim(worker_id, batch_size)
+            if items:
+                yield from items
+                continue
+
+            leased_by_others = self.counts(exclude_worker=worker_id).get(LEASED, 0)
+            if not leased_by_others:
+                return
+            log.info(f"Waiting for {leased_by_others} items leased by other workers")
+            time.sleep(poll_seconds)
+
+    def heartbeat(self, worker_id):
+        """
+        Extend the leases of every item held by a worker.
+
+        Args:
+            worker_id (str): ID of the worker
+
+        Returns:
+            int: Number of leases extended
+        """
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE items SET lease_expires = ? WHERE state = ? AND worker = ?",
+                (time.time() + self.lease_seconds, LEASED, worker_id)
+            )
+            return cursor.rowcount
+
+    def start_heartbeat(self, worker_id):
+        """
+        Renew a worker's leases in a background thread.
+
+        Args:
+            worker_id (str): ID of the worker
+
+        Returns:
+            threading.Event: Set it to stop the heartbeat
+        """
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.lease_seconds / 3):
+                try:
+                    self.heartbeat(worker_id)
+                except sqlite3.Error as e:
+                    log.warning(f"Heartbeat failed: {e}")
+
+        threading.Thread(target=beat, daemon=True).start()
+        return stop
+
+    def complete(self, file_path, worker_id):
+        """
+        Mark a leased item as downloaded.
+
+        Args:
+            file_path (str or Path): Path of the downloaded file
+            worker_id (str): ID of the worker holding the lease
+        """
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE items SET state = ?, lease_expires = NULL, error = NULL WHERE rel_path = ? AND worker = ?",
+                (DONE, self._rel_path(file_path), worker_id)
+            )
+
+    def fail(self, file_path, worker_id, error):
+        """
+        Release a leased item after a failed download.
+
+        The item goes back to pending for another attempt, or is marked
+        failed once it used up `max_attempts`.
+
+        Args:
+            file_path (str or Path): Path of the file that failed
+            worker_id (str): ID of the worker holding the lease
+            error (Exception or str): Why the download failed
+        """
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE items SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                "worker = NULL, lease_expires = NULL, error = ? WHERE rel_path = ? AND worker = ?",
+                (self.max_attempts, FAILED, PENDING, str(error), self._rel_path(file_path), worker_id)
+            )
+
+    def counts(self, exclude_worker=None):
+        """
+        Count items by state.
+
+        Args:
+            exclude_worker (str): Leave out items leased by this worker
+
+        Returns:
+            dict: Number of items per state
+        """
+        query = "SELECT state, COUNT(*) FROM items"
+        params = ()
+        if exclude_worker is not None:
+            query += " WHERE worker IS NULL OR worker != ?"
+            params = (exclude_worker,)
+        with closing(self._connect()) as conn:
+            return dict(conn.execute(query + " GROUP BY state", params).fetchall())